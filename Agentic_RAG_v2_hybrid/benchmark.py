@@ -2,7 +2,8 @@ import sys, os
 sys.path.insert(0, "cactus/python/src")
 os.environ["CACTUS_NO_CLOUD_TELE"] = "1"
 
-import json
+import json, statistics
+import main
 from main import generate_hybrid
 
 
@@ -394,61 +395,173 @@ def compute_f1(predicted_calls, expected_calls):
     return 2 * precision * recall / (precision + recall)
 
 
-def run_benchmark(benchmarks=None):
-    """Run all benchmark cases and print results."""
+def run_benchmark(benchmarks=None, keep_results=True):
+    """
+    Run benchmark cases and print results.
+
+    `benchmarks` may be any iterable of cases, e.g. corpus.iter_cases(path).
+    With keep_results=False nothing per-case is retained, so memory stays
+    flat however large the corpus; the running totals are returned instead
+    of the result list.
+    """
     if benchmarks is None:
         benchmarks = BENCHMARKS
 
-    total = len(benchmarks)
+    total = len(benchmarks) if hasattr(benchmarks, "__len__") else None
     results = []
+    totals = {}
+    tiers = {}
     for i, case in enumerate(benchmarks, 1):
-        print(f"[{i}/{total}] Running: {case['name']} ({case['difficulty']})...", end=" ", flush=True)
+        progress = f"{i}/{total}" if total is not None else str(i)
+        print(f"[{progress}] Running: {case['name']} ({case['difficulty']})...", end=" ", flush=True)
         result = generate_hybrid(case["messages"], case["tools"])
         f1 = compute_f1(result["function_calls"], case["expected_calls"])
         source = result.get("source", "unknown")
         print(f"F1={f1:.2f} | {result['total_time_ms']:.0f}ms | {source}")
-        results.append({
+        r = {
             "name": case["name"],
             "difficulty": case["difficulty"],
             "total_time_ms": result["total_time_ms"],
             "f1": f1,
             "source": source,
-            "predicted": result["function_calls"],
-            "expected": case["expected_calls"],
-        })
-
-    print("\n=== Benchmark Results ===\n")
-    print(f"  {'#':>2} | {'Difficulty':<10} | {'Name':<28} | {'Time (ms)':>10} | {'F1':>5} | Source")
-    print(f"  {'--':>2}-+-{'-'*10}-+-{'-'*28}-+-{'-'*10}-+-{'-'*5}-+-{'-'*20}")
-    for i, r in enumerate(results, 1):
-        print(f"  {i:>2} | {r['difficulty']:<10} | {r['name']:<28} | {r['total_time_ms']:>10.2f} | {r['f1']:>5.2f} | {r['source']}")
-
+            "tier": result.get("tier", source),
+        }
+        accumulate(totals, r)
+        accumulate(tiers, r, key="tier")
+        if keep_results:
+            r["predicted"] = result["function_calls"]
+            r["expected"] = case["expected_calls"]
+            results.append(r)
+
+    if keep_results:
+        print("\n=== Benchmark Results ===\n")
+        print(f"  {'#':>2} | {'Difficulty':<10} | {'Name':<28} | {'Time (ms)':>10} | {'F1':>5} | Source")
+        print(f"  {'--':>2}-+-{'-'*10}-+-{'-'*28}-+-{'-'*10}-+-{'-'*5}-+-{'-'*20}")
+        for i, r in enumerate(results, 1):
+            print(f"  {i:>2} | {r['difficulty']:<10} | {r['name']:<28} | {r['total_time_ms']:>10.2f} | {r['f1']:>5.2f} | {r['source']}")
+
+    print_summary(totals)
+    print_tiers(tiers)
+    return results if keep_results else totals
+
+
+def accumulate(totals, r, key="difficulty"):
+    """Fold one result into running sums per difficulty (or per `key`, e.g. cascade tier)."""
+    t = totals.setdefault(r[key], {"n": 0, "f1": 0.0, "time_ms": 0.0, "on_device": 0})
+    t["n"] += 1
+    t["f1"] += r["f1"]
+    t["time_ms"] += r["total_time_ms"]
+    t["on_device"] += r["source"] == "on-device"
+    return totals
+
+
+def merge_totals(*parts):
+    """Combine running totals from several shards."""
+    merged = {}
+    for part in parts:
+        for difficulty, t in part.items():
+            m = merged.setdefault(difficulty, {"n": 0, "f1": 0.0, "time_ms": 0.0, "on_device": 0})
+            for k in m:
+                m[k] += t[k]
+    return merged
+
+
+def print_summary(totals):
+    if not totals:
+        print("\nNo cases run.")
+        return
     print(f"\n--- Summary ---")
     for difficulty in ["easy", "medium", "hard"]:
-        group = [r for r in results if r["difficulty"] == difficulty]
-        if not group:
+        t = totals.get(difficulty)
+        if not t:
             continue
-        avg_f1 = sum(r["f1"] for r in group) / len(group)
-        avg_time = sum(r["total_time_ms"] for r in group) / len(group)
-        on_device = sum(1 for r in group if r["source"] == "on-device")
-        cloud = len(group) - on_device
-        print(f"  {difficulty:<8} avg F1={avg_f1:.2f}  avg time={avg_time:.2f}ms  on-device={on_device}/{len(group)} cloud={cloud}/{len(group)}")
-
-    avg_f1 = sum(r["f1"] for r in results) / len(results)
-    avg_time = sum(r["total_time_ms"] for r in results) / len(results)
-    total_time = sum(r["total_time_ms"] for r in results)
-    on_device_total = sum(1 for r in results if r["source"] == "on-device")
-    cloud_total = len(results) - on_device_total
-    print(f"  {'overall':<8} avg F1={avg_f1:.2f}  avg time={avg_time:.2f}ms  total time={total_time:.2f}ms")
-    print(f"           on-device={on_device_total}/{len(results)} ({100*on_device_total/len(results):.0f}%)  cloud={cloud_total}/{len(results)} ({100*cloud_total/len(results):.0f}%)")
+        n = t["n"]
+        print(f"  {difficulty:<8} avg F1={t['f1'] / n:.2f}  avg time={t['time_ms'] / n:.2f}ms  on-device={t['on_device']}/{n} cloud={n - t['on_device']}/{n}")
+
+    n = sum(t["n"] for t in totals.values())
+    f1_sum = sum(t["f1"] for t in totals.values())
+    total_time = sum(t["time_ms"] for t in totals.values())
+    on_device_total = sum(t["on_device"] for t in totals.values())
+    cloud_total = n - on_device_total
+    print(f"  {'overall':<8} avg F1={f1_sum / n:.2f}  avg time={total_time / n:.2f}ms  total time={total_time:.2f}ms")
+    print(f"           on-device={on_device_total}/{n} ({100*on_device_total/n:.0f}%)  cloud={cloud_total}/{n} ({100*cloud_total/n:.0f}%)")
 
     # Total score
-    score = compute_total_score(results)
+    score = score_totals(totals)
     print(f"\n{'='*50}")
     print(f"  TOTAL SCORE: {score:.1f}%")
     print(f"{'='*50}")
 
-    return results
+
+def print_tiers(tiers):
+    """Which cascade tier answered, and how well."""
+    if not tiers:
+        return
+    n = sum(t["n"] for t in tiers.values())
+    print(f"\n--- Cascade tiers ---")
+    for tier, t in sorted(tiers.items(), key=lambda kv: -kv[1]["n"]):
+        print(f"  {tier:<20} answered={t['n']}/{n} ({100 * t['n'] / n:.0f}%)  "
+              f"avg F1={t['f1'] / t['n']:.2f}  avg time={t['time_ms'] / t['n']:.2f}ms")
+
+
+def run_variant(variant, cases):
+    """
+    On-device-only pass over `cases` with one FunctionGemma build: no
+    routing, ensembles or repairs, so differences are the weights'.
+    """
+    main.release_models()
+    main.select_variant(variant)
+    path = main.functiongemma_path
+    f1s, times = [], []
+    for case in cases:
+        local = main.generate_cactus(case["messages"], case["tools"])
+        calls = main.postprocess_batch(local["function_calls"], case["tools"])
+        f1s.append(compute_f1(calls, case["expected_calls"]))
+        times.append(local["total_time_ms"])
+    memory = main.memory_report(path)
+    disk = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return {
+        "variant": variant,
+        "n": len(f1s),
+        "f1": statistics.fmean(f1s) if f1s else 0.0,
+        "avg_ms": statistics.fmean(times) if times else 0.0,
+        "p95_ms": statistics.quantiles(times, n=20)[-1] if len(times) > 1 else sum(times),
+        "disk_mb": disk / 2**20,
+        "weights_rss_mb": memory.get("weights_rss_mb", 0.0),
+        "model_load_mb": memory.get("model_load_mb", 0.0),
+        "rss_mb": memory.get("rss_mb", 0.0),
+    }
+
+
+def compare_variants(variants=None, cases=None):
+    """
+    Run `cases` (default BENCHMARKS) against each model variant (default:
+    every MODEL_VARIANTS build on disk) and print F1, latency and memory,
+    with deltas against the first. The selected variant is restored after.
+    """
+    cases = list(BENCHMARKS if cases is None else cases)
+    if variants is None:
+        variants = [v for v, path in main.MODEL_VARIANTS.items() if os.path.isdir(path)]
+    selected = main.MODEL_VARIANT
+    try:
+        rows = [run_variant(v, cases) for v in variants]
+    finally:
+        main.release_models()
+        main.select_variant(selected)
+    if not rows:
+        print("\nNo model variants on disk.")
+        return rows
+
+    base = rows[0]
+    print(f"\n--- Model variants (on-device only, {len(cases)} cases, deltas vs {base['variant']}) ---")
+    print(f"  {'variant':<8} {'avg F1':>7} {'dF1':>6} {'avg ms':>8} {'dms':>8} {'p95 ms':>8} "
+          f"{'disk MB':>8} {'weights MB':>11} {'dweights':>9} {'load MB':>8} {'RSS MB':>8}")
+    for r in rows:
+        print(f"  {r['variant']:<8} {r['f1']:>7.3f} {r['f1'] - base['f1']:>+6.3f} {r['avg_ms']:>8.1f} "
+              f"{r['avg_ms'] - base['avg_ms']:>+8.1f} {r['p95_ms']:>8.1f} {r['disk_mb']:>8.1f} "
+              f"{r['weights_rss_mb']:>11.1f} {r['weights_rss_mb'] - base['weights_rss_mb']:>+9.1f} "
+              f"{r['model_load_mb']:>8.1f} {r['rss_mb']:>8.1f}")
+    return rows
 
 
 def compute_total_score(results):
@@ -465,18 +578,30 @@ def compute_total_score(results):
       - medium: 30%
       - hard: 50%
     """
+    return score_totals(compute_totals(results))
+
+
+def compute_totals(results):
+    totals = {}
+    for r in results:
+        accumulate(totals, r)
+    return totals
+
+
+def score_totals(totals):
+    """compute_total_score on running totals (see accumulate)."""
     difficulty_weights = {"easy": 0.20, "medium": 0.30, "hard": 0.50}
     time_baseline_ms = 500  # anything under this gets full marks
 
     total_score = 0
     for difficulty, weight in difficulty_weights.items():
-        group = [r for r in results if r["difficulty"] == difficulty]
-        if not group:
+        t = totals.get(difficulty)
+        if not t:
             continue
 
-        avg_f1 = sum(r["f1"] for r in group) / len(group)
-        avg_time = sum(r["total_time_ms"] for r in group) / len(group)
-        on_device_ratio = sum(1 for r in group if r["source"] == "on-device") / len(group)
+        avg_f1 = t["f1"] / t["n"]
+        avg_time = t["time_ms"] / t["n"]
+        on_device_ratio = t["on_device"] / t["n"]
 
         time_score = max(0, 1 - avg_time / time_baseline_ms)
 
@@ -487,4 +612,39 @@ def compute_total_score(results):
 
 
 if __name__ == "__main__":
-    run_benchmark()
+    import argparse
+    from corpus import iter_cases, parse_shard
+
+    parser = argparse.ArgumentParser(description="Run the SwissblAIz benchmark")
+    parser.add_argument("--corpus", help="JSONL(.gz) corpus instead of the built-in cases")
+    parser.add_argument("--shard", default="0/1", help="i/n: run every n-th case starting at i")
+    parser.add_argument("--stream", action="store_true", help="Keep only running totals (constant memory)")
+    parser.add_argument("--totals-out", help="Write running totals as JSON, for merge_totals across shards")
+    parser.add_argument("--profile", metavar="DIR", help="Sample generate_hybrid and write flamegraph files to DIR")
+    parser.add_argument("--profile-format", choices=["collapsed", "speedscope"], default="collapsed")
+    parser.add_argument("--profile-every", type=int, default=100, help="Requests per profile file")
+    parser.add_argument("--variants", nargs="*", metavar="VARIANT",
+                        help="Compare FunctionGemma builds on-device (default: every one on disk)")
+    args = parser.parse_args()
+
+    if args.profile:
+        profiler = main.enable_profiling(args.profile, every=args.profile_every, fmt=args.profile_format)
+
+    shard, num_shards = parse_shard(args.shard)
+    if args.corpus:
+        cases = iter_cases(args.corpus, shard, num_shards)
+    else:
+        cases = BENCHMARKS[shard::num_shards]
+    if args.variants is not None:
+        compare_variants(args.variants or None, cases)
+        sys.exit(0)
+    out = run_benchmark(cases, keep_results=not args.stream)
+    if args.totals_out:
+        totals = out if args.stream else compute_totals(out)
+        with open(args.totals_out, "w") as f:
+            json.dump(totals, f, indent=2)
+    if args.profile:
+        files = main.disable_profiling()
+        print(f"\n  Profile: {profiler.samples} samples over {profiler.requests} requests -> {len(files)} file(s) in {args.profile}")
+        for label, share in profiler.top(10):
+            print(f"  {share:>6.1%}  {label}")
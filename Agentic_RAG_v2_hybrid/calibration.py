@@ -0,0 +1,173 @@
+"""
+Confidence calibration — fit FunctionGemma's confidence to the F1 it actually gets.
+
+The SDK's confidence is not a probability: a 0.6 on an EASY query and a
+0.6 on a HARD one mean different things, and neither is the chance the
+local answer is right. This fits, per complexity tier, a monotone map
+from routing confidence (raw confidence x name/key match score x
+validation score, what generate_hybrid compares) to the local F1 observed for it, using a run
+recorded with `simulate.py record`:
+
+  - isotonic  pool-adjacent-violators; stored as piecewise-linear knots
+  - platt     logistic a*x + b fitted to F1 as a soft label
+
+After calibration a threshold reads as "expected local F1 below which the
+cloud is worth it". The fit also searches thresholds on that scale with
+simulate.Replay and stores them in the artifact, which main.py loads
+with load_calibration() or SWISSBLAIZ_CALIBRATION=<path>.
+
+Usage:
+  python calibration.py fit run.jsonl.gz --method isotonic --out calibration.json
+"""
+
+import argparse, json
+import numpy as np
+
+from simulate import COMPLEXITIES, Replay, best_thresholds, evaluate, load_records, routing_confidence, threshold_policy
+
+MIN_SAMPLES = 20        # tiers with fewer records keep raw confidence
+ECE_BINS = 10
+
+
+# ── Fitting ──
+
+def fit_isotonic(x, y):
+    """Non-decreasing least-squares fit of y on x -> (knot xs, knot ys)."""
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    # Equal confidences must share one fitted value, so pool them up front
+    ux, inverse = np.unique(x, return_inverse=True)
+    sums = np.bincount(inverse, weights=y)
+    counts = np.bincount(inverse).astype(np.float64)
+
+    blocks = []     # [sum, count, first x, last x]
+    for xi, s, n in zip(ux, sums, counts):
+        blocks.append([s, n, xi, xi])
+        while len(blocks) > 1 and blocks[-2][0] * blocks[-1][1] > blocks[-1][0] * blocks[-2][1]:
+            s, n, _, hi = blocks.pop()
+            blocks[-1][0] += s
+            blocks[-1][1] += n
+            blocks[-1][3] = hi
+
+    xs, ys = [], []
+    for s, n, lo, hi in blocks:
+        xs.append(float(lo))
+        ys.append(float(s / n))
+        if hi > lo:
+            xs.append(float(hi))
+            ys.append(float(s / n))
+    return xs, ys
+
+
+def fit_platt(x, y, iterations=50, ridge=1e-6):
+    """Logistic regression of y (in [0, 1]) on x by Newton's method -> (a, b)."""
+    X = np.stack([np.asarray(x, dtype=np.float64), np.ones(len(x))], axis=1)
+    y = np.asarray(y, dtype=np.float64)
+    w = np.zeros(2)
+    for _ in range(iterations):
+        p = 1.0 / (1.0 + np.exp(-np.clip(X @ w, -60, 60)))
+        grad = X.T @ (p - y) + ridge * w
+        hess = (X * (p * (1 - p))[:, None]).T @ X + ridge * np.eye(2)
+        step = np.linalg.solve(hess, grad)
+        w -= step
+        if np.abs(step).max() < 1e-10:
+            break
+    return float(w[0]), float(w[1])
+
+
+def fit(records, method="isotonic"):
+    """Calibration artifact (without thresholds) from recorded runs."""
+    tiers = {}
+    for complexity in COMPLEXITIES:
+        rows = [r for r in records if r["complexity"] == complexity]
+        if len(rows) < MIN_SAMPLES:
+            continue
+        x = [routing_confidence(r) for r in rows]
+        y = [r["local"]["f1"] for r in rows]
+        if method == "isotonic":
+            xs, ys = fit_isotonic(x, y)
+            tiers[complexity] = {"x": xs, "y": ys, "n": len(rows)}
+        elif method == "platt":
+            a, b = fit_platt(x, y)
+            tiers[complexity] = {"a": a, "b": b, "n": len(rows)}
+        else:
+            raise ValueError(f"unknown calibration method {method!r}")
+    return {"method": method, "tiers": tiers}
+
+
+def calibrated_records(records, calibrator):
+    """Copies of `records` whose routing confidence is the calibrated one."""
+    return [dict(r, raw_confidence=calibrator(r["complexity"], routing_confidence(r)),
+                 match_score=1.0, validation_score=1.0)
+            for r in records]
+
+
+def choose_thresholds(records, calibrator, steps=101):
+    """Score-maximizing per-tier thresholds on the calibrated scale."""
+    grid = np.append(np.linspace(0, 1, steps), np.nextafter(1.0, 2.0))
+    thresholds, _ = best_thresholds(Replay(calibrated_records(records, calibrator)), grid)
+    return {c: round(t, 4) for c, t in thresholds.items() if c in calibrator.tiers}
+
+
+# ── Diagnostics ──
+
+def reliability(confidence, f1, bins=ECE_BINS):
+    """(expected calibration error, Brier score) of confidence as a predictor of F1."""
+    confidence, f1 = np.asarray(confidence, dtype=np.float64), np.asarray(f1, dtype=np.float64)
+    if not len(confidence):
+        return 0.0, 0.0
+    which = np.minimum((np.clip(confidence, 0, 1) * bins).astype(int), bins - 1)
+    gap = np.abs(np.bincount(which, weights=confidence - f1, minlength=bins))
+    return float(gap.sum() / len(confidence)), float(np.mean((confidence - f1) ** 2))
+
+
+def summarize(records, policy):
+    """(score, avg F1, cloud round trips) for an escalation policy."""
+    escalated = [policy(r) for r in records]
+    f1 = [r["escalated" if e else "local"]["f1"] for r, e in zip(records, escalated)]
+    return evaluate(records, policy), float(np.mean(f1)) if f1 else 0.0, sum(escalated)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit per-tier confidence calibration")
+    sub = parser.add_subparsers(dest="command", required=True)
+    f = sub.add_parser("fit", help="Fit on a run recorded with simulate.py record")
+    f.add_argument("log")
+    f.add_argument("--method", choices=["isotonic", "platt"], default="isotonic")
+    f.add_argument("--out", default="calibration.json")
+    f.add_argument("--keep-thresholds", action="store_true",
+                   help="Don't store searched thresholds; route with the CONFIG ones")
+    args = parser.parse_args()
+
+    import main
+    records = load_records(args.log)
+    artifact = fit(records, args.method)
+    calibrator = main.Calibrator(artifact)
+    if not args.keep_thresholds:
+        artifact["thresholds"] = calibrator.thresholds = choose_thresholds(records, calibrator)
+
+    print(f"  {'tier':<8} {'n':>6} {'ECE raw':>9} {'ECE cal':>9} {'Brier raw':>10} {'Brier cal':>10}")
+    for complexity in COMPLEXITIES:
+        rows = [r for r in records if r["complexity"] == complexity]
+        if not rows:
+            continue
+        raw = [routing_confidence(r) for r in rows]
+        cal = [calibrator(complexity, c) for c in raw]
+        f1 = [r["local"]["f1"] for r in rows]
+        (ece_raw, brier_raw), (ece_cal, brier_cal) = reliability(raw, f1), reliability(cal, f1)
+        print(f"  {complexity:<8} {len(rows):>6} {ece_raw:>9.3f} {ece_cal:>9.3f} {brier_raw:>10.3f} {brier_cal:>10.3f}")
+
+    current = {"EASY": main.CONFIDENCE_THRESHOLD_EASY, "MEDIUM": main.CONFIDENCE_THRESHOLD_MEDIUM,
+               "HARD": main.CONFIDENCE_THRESHOLD_HARD}
+    routed = dict(current, **calibrator.thresholds)
+    grid = np.append(np.linspace(0, 1, 101), np.nextafter(1.0, 2.0))
+    searched, _ = best_thresholds(Replay(records), grid)
+    print()
+    for label, rs, thresholds in [("raw", records, current),
+                                  ("raw, searched", records, searched),
+                                  ("calibrated", calibrated_records(records, calibrator), routed)]:
+        score, f1, cloud = summarize(rs, threshold_policy(thresholds))
+        print(f"  {label:<14} score {score:6.2f}%  avg F1 {f1:.3f}  cloud round trips {cloud}/{len(rs)}")
+
+    with open(args.out, "w") as out:
+        json.dump(artifact, out, separators=(",", ":"))
+    print(f"\n  Wrote {args.out}; route with SWISSBLAIZ_CALIBRATION={args.out}")
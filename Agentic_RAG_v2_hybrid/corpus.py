@@ -0,0 +1,135 @@
+"""
+Benchmark corpora on disk — JSONL (optionally gzip), streamed case by case.
+
+One JSON record per line. Tool definitions are written once and cases
+refer to them by id; a tool record must come before the first case that
+uses it:
+
+  {"type": "tool", "id": "get_weather", "tool": {"name": "get_weather", ...}}
+  {"type": "case", "name": "weather_sf", "difficulty": "easy",
+   "messages": [...], "tools": ["get_weather"], "expected_calls": [...]}
+
+Cases come back in the in-memory BENCHMARKS shape. Every case shares the
+same tool dicts, so main's per-toolset index cache keeps hitting.
+
+Usage:
+  python corpus.py export benchmarks.jsonl.gz     # dump BENCHMARKS
+  python corpus.py stats benchmarks.jsonl.gz
+  python benchmark.py --corpus benchmarks.jsonl.gz --shard 0/4 --stream --totals-out shard0.json
+  python corpus.py merge shard*.json              # combine shard totals into one score
+"""
+
+import gzip, json, sys
+from collections import Counter
+
+
+def open_jsonl(path, mode):
+    """Text handle on a .jsonl or .jsonl.gz file."""
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def iter_cases(path, shard=0, num_shards=1):
+    """
+    Yield benchmark cases from a corpus file, holding only the tool table
+    in memory. With num_shards > 1, yields every num_shards-th case starting
+    at `shard`, so workers can split one file without coordinating.
+    """
+    if not 0 <= shard < num_shards:
+        raise ValueError(f"shard {shard} out of range for {num_shards} shards")
+    tools = {}
+    index = 0
+    with open_jsonl(path, "r") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.get("type")
+            if kind == "tool":
+                tools[record["id"]] = record["tool"]
+            elif kind == "case":
+                if index % num_shards == shard:
+                    try:
+                        case_tools = [tools[t] for t in record["tools"]]
+                    except KeyError as e:
+                        raise ValueError(f"{path}:{lineno}: unknown tool id {e}") from None
+                    yield {
+                        "name": record["name"],
+                        "difficulty": record["difficulty"],
+                        "messages": record["messages"],
+                        "tools": case_tools,
+                        "expected_calls": record["expected_calls"],
+                    }
+                index += 1
+            else:
+                raise ValueError(f"{path}:{lineno}: unknown record type {kind!r}")
+
+
+def parse_shard(spec):
+    """'2/8' -> (2, 8)."""
+    shard, _, num_shards = spec.partition("/")
+    return int(shard), int(num_shards or 1)
+
+
+def write_corpus(path, cases):
+    """Write cases (BENCHMARKS shape) to a corpus file; returns the case count."""
+    ids = {}        # tool JSON -> id, so identical definitions are stored once
+    taken = set()
+    count = 0
+    with open_jsonl(path, "w") as f:
+        for case in cases:
+            refs = []
+            for tool in case["tools"]:
+                key = json.dumps(tool, sort_keys=True)
+                tool_id = ids.get(key)
+                if tool_id is None:
+                    tool_id = tool["name"]
+                    n = 2
+                    while tool_id in taken:     # same name, different definition
+                        tool_id = f"{tool['name']}#{n}"
+                        n += 1
+                    ids[key] = tool_id
+                    taken.add(tool_id)
+                    f.write(json.dumps({"type": "tool", "id": tool_id, "tool": tool}) + "\n")
+                refs.append(tool_id)
+            f.write(json.dumps({
+                "type": "case",
+                "name": case["name"],
+                "difficulty": case["difficulty"],
+                "messages": case["messages"],
+                "tools": refs,
+                "expected_calls": case["expected_calls"],
+            }) + "\n")
+            count += 1
+    return count
+
+
+def merge_totals_files(paths):
+    """benchmark.merge_totals over the --totals-out JSON files of several shards."""
+    from benchmark import merge_totals
+    parts = []
+    for path in paths:
+        with open(path) as f:
+            parts.append(json.load(f))
+    return merge_totals(*parts)
+
+
+if __name__ == "__main__":
+    command, paths = sys.argv[1] if len(sys.argv) > 1 else None, sys.argv[2:]
+    if command not in ("export", "stats", "merge") or not paths or (command != "merge" and len(paths) != 1):
+        print("usage: python corpus.py export|stats PATH\n       python corpus.py merge TOTALS.json...")
+        sys.exit(2)
+    path = paths[0]
+    if command == "merge":
+        from benchmark import print_summary
+        print(f"  Merged {len(paths)} shard totals")
+        print_summary(merge_totals_files(paths))
+    elif command == "export":
+        from benchmark import BENCHMARKS
+        print(f"  Wrote {write_corpus(path, BENCHMARKS)} cases to {path}")
+    else:
+        by_difficulty = Counter(case["difficulty"] for case in iter_cases(path))
+        print(f"  {sum(by_difficulty.values())} cases in {path}")
+        for difficulty, n in sorted(by_difficulty.items()):
+            print(f"    {difficulty:<8} {n}")
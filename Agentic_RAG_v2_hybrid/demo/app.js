@@ -36,6 +36,7 @@ const pipelineToggle = $('pipelineToggle');
 const pipelineDrawer = $('pipelineDrawer');
 
 // ─── TOOL DEFINITIONS (mirrors main.py benchmark) ───
+// Also in demo/tools.json, which `server.py --warmup-tools` warms: keep the two in sync
 const TOOLS = [
     {
         name: "get_weather",
@@ -242,6 +243,8 @@ async function runPipeline(query) {
     // ── STT Complete ──
     setPipelineStep('stt', 'done', `${Math.round(performance.now() - pipelineStart)}ms`);
 
+    if (BACKEND_URL) return runBackendPipeline(query, pipelineStart);
+
     // ── Classify ──
     setState(State.THINKING);
     setPipelineStep('classify', 'active');
@@ -288,7 +291,10 @@ async function runPipeline(query) {
 
     // ── Generate Tool Calls ──
     const calls = mockToolCall(query);
+    await renderResult(calls, source, inferTime, pipelineStart);
+}
 
+async function renderResult(calls, source, inferTime, pipelineStart) {
     // ── Build Cards ──
     setState(State.RESPONDING);
     clearCards();
@@ -321,6 +327,91 @@ async function runPipeline(query) {
 }
 
 
+// ═══════════════════════════════════════════════════════════
+// BACKEND PIPELINE — real generate_hybrid via server.py
+// Enable with index.html?backend=ws://localhost:8765
+// ═══════════════════════════════════════════════════════════
+
+const BACKEND_URL = new URLSearchParams(location.search).get('backend');
+const SESSION_ID = (crypto.randomUUID && crypto.randomUUID()) || String(Date.now());
+let backendSocket = null;
+
+function connectBackend() {
+    if (backendSocket && backendSocket.readyState <= WebSocket.OPEN) return backendSocket;
+    backendSocket = new WebSocket(`${BACKEND_URL.replace(/^http/, 'ws').replace(/\/$/, '')}/v1/stream`);
+    return backendSocket;
+}
+
+function backendInfer(query, onEvent) {
+    return new Promise((resolve, reject) => {
+        const ws = connectBackend();
+        const send = () => ws.send(JSON.stringify({ query, tools: TOOLS, session_id: SESSION_ID }));
+        ws.onmessage = (msg) => {
+            const event = JSON.parse(msg.data);
+            if (event.event === 'result') resolve(event.result);
+            else if (event.event === 'error') reject(new Error(event.error));
+            else onEvent(event);
+        };
+        ws.onerror = () => reject(new Error('Backend unreachable'));
+        if (ws.readyState === WebSocket.OPEN) send();
+        else ws.onopen = send;
+    });
+}
+
+function handleBackendEvent(event) {
+    switch (event.event) {
+        case 'classify':
+            setPipelineStep('classify', 'done', `${event.ms.toFixed(1)}ms`);
+            updateMetric('complexityMetric', event.complexity,
+                event.complexity === 'EASY' ? 'highlight-cyan' :
+                    event.complexity === 'HARD' ? 'highlight-red' : 'highlight-amber');
+            setPipelineStep('route', 'active');
+            break;
+        case 'route':
+            setPipelineStep('route', 'done', `≥${event.threshold.toFixed(2)}`);
+            updateMetric('confidenceMetric', event.confidence.toFixed(2),
+                event.confidence > 0.7 ? 'highlight-green' :
+                    event.confidence > 0.4 ? 'highlight-cyan' : 'highlight-red');
+            if (event.decision === 'cloud') {
+                setState(State.ESCALATING);
+                setRouting('escalating', '⚡→☁️ ESCALATING');
+                setPipelineStep('infer', 'cloud-active');
+            } else {
+                setRouting('on-device', '⚡ ON-DEVICE');
+                setPipelineStep('infer', 'active');
+            }
+            break;
+        case 'infer':
+            if (event.target === 'cloud' && !event.error) setRouting('cloud', '☁️ CLOUD');
+            break;
+    }
+}
+
+async function runBackendPipeline(query, pipelineStart) {
+    setState(State.THINKING);
+    setPipelineStep('classify', 'active');
+
+    let result;
+    try {
+        result = await backendInfer(query, handleBackendEvent);
+    } catch (err) {
+        setState(State.ERROR);
+        orbStatus.textContent = err.message;
+        setTimeout(() => setState(State.IDLE), 3000);
+        return;
+    }
+
+    const source = result.source === 'on-device' ? 'on-device' : 'cloud';
+    const inferTime = Math.round(result.total_time_ms);
+    setPipelineStep('infer', 'done', `${inferTime}ms`);
+    updateMetric('latencyMetric', `${inferTime}ms`,
+        inferTime < 100 ? 'highlight-cyan' :
+            inferTime < 300 ? 'highlight-amber' : 'highlight-red');
+
+    await renderResult(result.function_calls, source, inferTime, pipelineStart);
+}
+
+
 // ═══════════════════════════════════════════════════════════
 // ACTION CARD BUILDERS
 // ═══════════════════════════════════════════════════════════
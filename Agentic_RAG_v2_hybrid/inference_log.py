@@ -0,0 +1,337 @@
+"""
+Inference log — every generate_hybrid request on disk, for offline analysis.
+
+Routing can only be tuned on traffic it actually saw. With the log on,
+each request becomes one record:
+
+  {"type": "request", "ts": 1760870000.1, "toolset": "3f2a9c...", "messages": [...],
+   "complexity": "MEDIUM", "threshold": 0.5, "source": "cloud (fallback)", "tier": "cloud",
+   "local": {"tier": "functiongemma-270m", "calls": [...], "confidence": 0.41,
+             "routing_confidence": 0.2, "validation": {...}},
+   "cloud": {"calls": [...], "ms": 812.0},            null when answered on-device
+   (local is null for requests the scheduler shed straight to the cloud)
+   "stages": [{"stage": "classify", "ms": 0.1}, {"stage": "infer", "tier": ..., "ms": 38.0}, ...],
+   "total_ms": 851.3}
+
+Toolsets are stored once per file, as {"type": "toolset", "id", "tools"},
+and requests refer to them by content hash (corpus.py does the same for
+tools).
+
+The request thread only queues references to what it already has. The
+queue is bounded, so when the writer falls behind, records are dropped
+and counted, never waited on. A record the writer can't serialize or
+write is counted in `failed` and skipped; the writer keeps going. A daemon thread builds the records,
+hashes toolsets, compresses and rotates:
+
+  <out_dir>/inference-<UTC start>-<seq>.jsonl.gz    fmt="jsonl"
+  <out_dir>/inference-<UTC start>-<seq>.parquet     fmt="parquet" (needs pyarrow)
+
+Each file is written as ".part" and renamed once it rotates (every
+`max_records` requests or `rotate_s` seconds) or the log stops, so
+readers only ever see complete files.
+
+Enable with main.enable_inference_log(...) or
+`SWISSBLAIZ_INFERENCE_LOG=<dir>` (plus optional SWISSBLAIZ_INFERENCE_LOG_FORMAT
+/ _MAX_RECORDS / _ROTATE_S).
+
+Usage:
+  python inference_log.py summary inference-logs/     # requests by complexity and source, stage latency
+"""
+
+import argparse, gzip, hashlib, json, os, queue, statistics, threading, time
+from collections import Counter, OrderedDict
+
+LOG_MAX_RECORDS = 50_000        # requests per file
+LOG_ROTATE_S = 300              # ...or seconds, whichever comes first
+LOG_QUEUE_SIZE = 10_000         # records waiting for the writer before new ones are dropped
+TOOLSET_CACHE_SIZE = 256
+FORMATS = {"jsonl": ".jsonl.gz", "parquet": ".parquet"}
+_STOP = object()
+
+
+def toolset_hash(tools):
+    """Short content hash of a toolset; equal toolsets share it across processes and runs."""
+    canonical = json.dumps(tools, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical.encode()).hexdigest()[:16]
+
+
+class InferenceLog:
+    def __init__(self, out_dir="inference-logs", fmt="jsonl", max_records=LOG_MAX_RECORDS,
+                 rotate_s=LOG_ROTATE_S, queue_size=LOG_QUEUE_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown log format {fmt!r}, expected one of {sorted(FORMATS)}")
+        if fmt == "parquet":
+            import pyarrow  # noqa: F401 — fail here, not on the writer thread
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.max_records = max_records
+        self.rotate_s = rotate_s
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0                 # records the writer couldn't build or write (see last_error)
+        self.last_error = None
+        self.files = []
+        self._queue = queue.Queue(queue_size)
+        self._drop_lock = threading.Lock()
+        self._toolsets = OrderedDict()  # tool identities -> (tools, hash); holds tools so ids stay unique
+        self._seq = 0
+        self._file = None               # open .part handle (jsonl) or row buffer (parquet)
+        self._path = None
+        self._opened = 0.0
+        self._file_records = 0
+        self._file_toolsets = {}        # hash -> tools written to (or pending for) the current file
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            environ.get("SWISSBLAIZ_INFERENCE_LOG") or "inference-logs",
+            fmt=environ.get("SWISSBLAIZ_INFERENCE_LOG_FORMAT", "jsonl"),
+            max_records=int(environ.get("SWISSBLAIZ_INFERENCE_LOG_MAX_RECORDS", LOG_MAX_RECORDS)),
+            rotate_s=float(environ.get("SWISSBLAIZ_INFERENCE_LOG_ROTATE_S", LOG_ROTATE_S)),
+        )
+
+    # ── Request path ──
+
+    def submit(self, messages, tools, result, events, total_ms):
+        """
+        Queue one finished request without blocking. The arguments are
+        kept by reference, so pass snapshots of anything the caller will
+        still mutate. Returns False if the queue was full and it was dropped.
+        """
+        try:
+            self._queue.put_nowait((time.time(), messages, tools, result, events, total_ms))
+            return True
+        except queue.Full:
+            with self._drop_lock:
+                self.dropped += 1
+            return False
+
+    # ── Writer thread ──
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="inference-log", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Write out everything queued, close the current file; returns every file written."""
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        return self.files
+
+    def _run(self):
+        poll_s = min(1.0, self.rotate_s)
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=poll_s)
+                except queue.Empty:
+                    item = None
+                if item is _STOP:
+                    break
+                try:
+                    if item is not None:
+                        self._write(self._record(*item))
+                    if self._file is not None and time.time() - self._opened >= self.rotate_s:
+                        self._close_file()
+                except Exception as e:
+                    # One unserializable record or failed write costs that record, not the writer
+                    self.failed += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+        finally:
+            self._close_file()
+
+    def _toolset(self, tools):
+        key = tuple(map(id, tools))
+        entry = self._toolsets.get(key)
+        if entry is None:
+            entry = self._toolsets[key] = (tools, toolset_hash(tools))
+            if len(self._toolsets) > TOOLSET_CACHE_SIZE:
+                self._toolsets.popitem(last=False)
+        else:
+            self._toolsets.move_to_end(key)
+        return entry[1]
+
+    def _record(self, ts, messages, tools, result, events, total_ms):
+        """The logged record, from the result plus the on_event stream it was produced with."""
+        stages, complexity, threshold, route, cloud_error = [], None, None, {}, None
+        for stage, payload in events:
+            if stage == "classify":
+                complexity, threshold = payload["complexity"], payload["threshold"]
+            elif stage == "route":
+                route = payload
+            elif stage == "infer" and "error" in payload:
+                cloud_error = payload["error"]
+            if "ms" in payload:
+                entry = {"stage": stage, "ms": payload["ms"]}
+                for key in ("tier", "target", "attempt", "samples"):
+                    if key in payload:
+                        entry[key] = payload[key]
+                stages.append(entry)
+
+        source = result.get("source", "unknown")
+        escalated = result.get("tier") == "cloud"
+        if escalated:
+            local = {"tier": result.get("local_tier"), "calls": result.get("local_calls", []),
+                     "confidence": result.get("local_confidence"), "validation": result.get("local_validation")}
+            cloud = {"calls": result["function_calls"],
+                     "ms": next((s["ms"] for s in stages if s.get("target") == "cloud"), None)}
+        else:
+            local = {"tier": result.get("tier"), "calls": result["function_calls"],
+                     "confidence": result.get("confidence"), "validation": result.get("validation")}
+            cloud = {"error": cloud_error} if cloud_error is not None else None
+        if escalated and "local_calls" not in result:
+            local = None            # shed straight to the cloud; nothing ran on-device
+        else:
+            local["routing_confidence"] = route.get("confidence")
+            if "samples" in result:
+                local["samples"], local["agreement"] = result["samples"], result.get("agreement")
+            if "repair_attempts" in result:
+                local["repair_attempts"] = result["repair_attempts"]
+
+        record = {
+            "type": "request",
+            "ts": round(ts, 3),
+            "toolset": self._toolset(tools),
+            "messages": messages,
+            "complexity": complexity,
+            "threshold": route.get("threshold", threshold),
+            "source": source,
+            "tier": result.get("tier"),
+            "local": local,
+            "cloud": cloud,
+            "stages": stages,
+            "total_ms": total_ms,
+        }
+        if result.get("needs_cloud"):
+            record["needs_cloud"] = True
+        return record, tools
+
+    def _write(self, item):
+        record, tools = item
+        if self._file is None:
+            self._open_file()
+        toolset = record["toolset"]
+        if self.fmt == "jsonl":
+            # Serialize before writing, so a record that fails leaves no partial line behind
+            line = json.dumps(record) + "\n"
+            if toolset not in self._file_toolsets:
+                line = json.dumps({"type": "toolset", "id": toolset, "tools": tools}) + "\n" + line
+                self._file_toolsets[toolset] = tools
+            self._file.write(line)
+        else:
+            self._file_toolsets.setdefault(toolset, tools)
+            self._file.append(record)
+        self.written += 1
+        self._file_records += 1
+        if self._file_records >= self.max_records:
+            self._close_file()
+
+    def _open_file(self):
+        os.makedirs(self.out_dir, exist_ok=True)
+        self._seq += 1
+        self._opened = time.time()
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(self._opened))
+        self._path = os.path.join(self.out_dir, f"inference-{stamp}-{self._seq:04d}{FORMATS[self.fmt]}")
+        self._file = gzip.open(self._path + ".part", "wt", encoding="utf-8") if self.fmt == "jsonl" else []
+        self._file_records = 0
+        self._file_toolsets = {}
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        file, self._file = self._file, None     # a failed close still starts a new file next time
+        if self.fmt == "jsonl":
+            file.close()
+        else:
+            _write_parquet(self._path + ".part", file, self._file_toolsets)
+        os.replace(self._path + ".part", self._path)
+        self.files.append(self._path)
+
+
+# ── Parquet (optional) ──
+
+_JSON_COLUMNS = ("messages", "local", "cloud", "stages")
+
+
+def _write_parquet(path, records, toolsets):
+    """Flat columns, nested fields as JSON text; toolsets go in the file's key-value metadata."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = [{k: json.dumps(v) if k in _JSON_COLUMNS else v for k, v in r.items()}
+            for r in records]
+    table = pa.Table.from_pylist(rows)
+    metadata = {b"swissblaiz.toolsets": json.dumps(toolsets).encode()}
+    pq.write_table(table.replace_schema_metadata(metadata), path)
+
+
+# ── Reading ──
+
+def log_files(path):
+    """Complete log files under a directory (or just `path`), oldest first."""
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(path, name) for name in os.listdir(path)
+                  if name.startswith("inference-") and name.endswith(tuple(FORMATS.values())))
+
+
+def iter_records(path):
+    """Yield request records from a log file or directory, each with its toolset under "tools"."""
+    for file in log_files(path):
+        if file.endswith(".parquet"):
+            import pyarrow.parquet as pq
+            table = pq.read_table(file)
+            toolsets = json.loads(table.schema.metadata[b"swissblaiz.toolsets"])
+            for row in table.to_pylist():
+                record = {k: json.loads(v) if k in _JSON_COLUMNS and v is not None else v for k, v in row.items()}
+                record["tools"] = toolsets[record["toolset"]]
+                yield record
+            continue
+        toolsets = {}
+        with gzip.open(file, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record["type"] == "toolset":
+                    toolsets[record["id"]] = record["tools"]
+                else:
+                    record["tools"] = toolsets[record["toolset"]]
+                    yield record
+
+
+def summarize(records):
+    """Request counts by (complexity, source) and {stage: [ms, ...]} latencies."""
+    routes, stage_ms = Counter(), {}
+    for r in records:
+        routes[(r["complexity"], r["source"])] += 1
+        for s in r["stages"]:
+            label = s["stage"] if "tier" not in s else f"{s['stage']} {s['tier']}"
+            if s.get("target") == "cloud":
+                label = f"{s['stage']} cloud"
+            stage_ms.setdefault(label, []).append(s["ms"])
+        stage_ms.setdefault("total", []).append(r["total_ms"])
+    return routes, stage_ms
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect inference logs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("summary", help="Requests by complexity and source, latency by stage")
+    s.add_argument("path", help="Log file or directory")
+    args = parser.parse_args()
+
+    routes, stage_ms = summarize(iter_records(args.path))
+    n = sum(routes.values())
+    print(f"  {n} requests")
+    for (complexity, source), count in sorted(routes.items(), key=lambda kv: (str(kv[0][0]), kv[0][1])):
+        print(f"  {str(complexity):<8} {source:<20} {count:>7} ({100 * count / n:.0f}%)")
+    print(f"\n  {'stage':<32} {'n':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for label, ms in sorted(stage_ms.items()):
+        p95 = statistics.quantiles(ms, n=20)[-1] if len(ms) > 1 else ms[0]
+        print(f"  {label:<32} {len(ms):>7} {statistics.median(ms):>9.1f} {p95:>9.1f}")
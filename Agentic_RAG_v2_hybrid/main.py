@@ -2,10 +2,48 @@ import sys
 sys.path.insert(0, "cactus/python/src")
 functiongemma_path = "cactus/weights/functiongemma-270m-it"
 
-import json, os, time, re
-from cactus import cactus_init, cactus_complete, cactus_destroy
-from google import genai
-from google.genai import types
+import time
+_IMPORT_START = time.perf_counter()
+
+import json, math, os, re, atexit, bisect, functools, hashlib, importlib, statistics, threading, uuid
+from collections import OrderedDict
+
+try:
+    # Optional: several times faster than json.loads, and reads bytes/memoryview directly
+    from orjson import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+
+class _LazyModule:
+    """
+    Stands in for a module and imports it on first attribute access.
+    The cactus bindings and google.genai are only needed once a request
+    actually reaches the model or the cloud, and genai alone costs more
+    at import than the rest of this file.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            _startup.setdefault(f"import {self._name}", (time.perf_counter() - start) * 1000)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+
+_startup = {}      # step -> ms, see startup_report()
+
+cactus = _LazyModule("cactus")
+genai = _LazyModule("google.genai")
+types = _LazyModule("google.genai.types")
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -15,33 +53,344 @@ CONFIDENCE_THRESHOLD_EASY = 0.70
 CONFIDENCE_THRESHOLD_MEDIUM = 0.50
 CONFIDENCE_THRESHOLD_HARD = 0.30
 
+# Artifact from `python calibration.py fit`; maps confidence to expected local F1 per tier
+CALIBRATION_PATH = os.environ.get("SWISSBLAIZ_CALIBRATION")
+
+SESSION_MAX_TURNS = 8          # user turns kept per session before trimming
+SESSION_MAX_ACTIVE = 64        # sessions held in memory at once
+SESSION_IDLE_TTL_S = 300       # idle sessions are evicted after this
+
+# Backends tried in order before the cloud. A tier answers once its routing
+# confidence clears its threshold for the query's complexity ("thresholds",
+# else the CONFIDENCE_THRESHOLD_* constants) and is skipped once earlier
+# tiers have already spent "budget_ms". cactus tiers load "path" lazily
+# from the model pool (default: the selected FunctionGemma variant);
+# "calibrated" applies the calibration artifact, so set it only on the
+# model and variant that artifact was fitted on. For example:
+#   [{"name": "rules", "backend": "rules"},
+#    {"name": "functiongemma-270m", "backend": "cactus", "calibrated": true},
+#    {"name": "qwen3-1.7b", "backend": "cactus", "path": "cactus/weights/qwen3-1.7b",
+#     "budget_ms": 150, "thresholds": {"EASY": 0.6, "MEDIUM": 0.5, "HARD": 0.4}}]
+# SWISSBLAIZ_CASCADE takes that list inline or as the path of a JSON file.
+CASCADE_BACKENDS = ("rules", "cactus")
+CASCADE = [{"name": "functiongemma-270m", "backend": "cactus", "calibrated": True}]
+
+
+def load_cascade(spec):
+    """
+    Cascade tiers from `spec`: inline JSON, or the path of a file holding
+    it. Raises ValueError unless it is a non-empty list of tiers, each
+    with a unique name and a backend from CASCADE_BACKENDS.
+    """
+    if spec.lstrip().startswith(("[", "{")):
+        source, tiers = "SWISSBLAIZ_CASCADE", json.loads(spec)
+    else:
+        with open(spec) as f:
+            source, tiers = spec, json.load(f)
+    if not isinstance(tiers, list) or not tiers:
+        raise ValueError(f"{source}: cascade must be a non-empty list of tiers")
+    names = set()
+    for i, tier in enumerate(tiers):
+        if not isinstance(tier, dict) or not isinstance(tier.get("name"), str) or not tier["name"]:
+            raise ValueError(f"{source}: tier {i} needs a \"name\"")
+        if tier["name"] in names:
+            raise ValueError(f"{source}: duplicate tier name {tier['name']!r}")
+        if tier.get("backend") not in CASCADE_BACKENDS:
+            raise ValueError(f"{source}: tier {tier['name']!r} has backend {tier.get('backend')!r}, "
+                             f"expected one of {list(CASCADE_BACKENDS)}")
+        if not isinstance(tier.get("thresholds", {}), dict):
+            raise ValueError(f"{source}: tier {tier['name']!r} thresholds must map complexity to a threshold")
+        names.add(tier["name"])
+    return tiers
+
+
+if os.environ.get("SWISSBLAIZ_CASCADE"):
+    CASCADE = load_cascade(os.environ["SWISSBLAIZ_CASCADE"])
+
+# Complexities that vote over several on-device samples, e.g. "MEDIUM". Off by
+# default: it multiplies on-device latency for those tiers by up to ENSEMBLE_SAMPLES
+ENSEMBLE_TIERS = tuple(t for t in os.environ.get("SWISSBLAIZ_ENSEMBLE_TIERS", "").upper().split(",") if t)
+ENSEMBLE_SAMPLES = 3           # at most this many samples per request
+ENSEMBLE_AGREE = 2             # stop as soon as this many agree
+ENSEMBLE_TEMPERATURE = 0.3
+
+REPAIR_MAX_ATTEMPTS = 2        # on-device retries for structurally invalid output (0 disables)
+REPAIR_BUDGET_MS = 150         # extra on-device time repairs may add before the cloud takes over
+
+WARMUP_ROUNDS = 3              # synthetic passes per toolset; the first is the cold one
+WARMUP_TARGET_P50_MS = 500     # warm p50 needed before the instance reports ready
+
+# FunctionGemma builds by weight precision, one directory per `cactus download --precision`
+MODEL_VARIANTS = {
+    "int8": functiongemma_path,
+    "int4": "cactus/weights/functiongemma-270m-it-int4",
+}
+DEFAULT_VARIANT = "int8"
+DEVICE_PROFILES = {"small": "int4", "standard": "int8"}    # device profile -> variant it runs
+SMALL_DEVICE_RAM_GB = 6        # detected profile is "small" below this much physical memory
+# Unset: the variant follows the device profile, which is detected from RAM
+DEVICE_PROFILE = os.environ.get("SWISSBLAIZ_DEVICE_PROFILE")
+MODEL_VARIANT = os.environ.get("SWISSBLAIZ_MODEL_VARIANT")
+
+
+# ═══════════════════════════════════════════════════════════════
+# METRICS — In-process counters and histograms, pluggable sink
+# ═══════════════════════════════════════════════════════════════
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+# Histogram upper bounds by name; unlisted histograms use LATENCY_BUCKETS_MS
+METRIC_BUCKETS = {
+    "swissblaiz_local_confidence": (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+    "swissblaiz_ensemble_agreement": (0.25, 0.34, 0.5, 0.67, 0.75, 1.0),
+}
+
+
+class Metrics:
+    """
+    Default sink: counters and fixed-bucket histograms in dicts keyed by
+    (name, sorted label pairs). An update is one dict lookup under a lock,
+    so the request path pays microseconds. Any object with the same
+    inc/observe methods can take its place via set_metrics_sink — see
+    metrics.py for StatsD and the Prometheus text format.
+    """
+
+    def __init__(self, buckets=None):
+        self.buckets = dict(METRIC_BUCKETS, **(buckets or {}))
+        self.counters = {}
+        self.histograms = {}        # key -> [bounds, per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self.histograms.get(key)
+            if h is None:
+                bounds = self.buckets.get(name, LATENCY_BUCKETS_MS)
+                h = self.histograms[key] = [bounds, [0] * (len(bounds) + 1), 0.0]
+            h[1][bisect.bisect_left(h[0], value)] += 1
+            h[2] += value
+
+    def snapshot(self):
+        """{"counters": {key: n}, "histograms": {key: (bounds, counts, sum)}}, copied."""
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {k: (b, list(c), s) for k, (b, c, s) in self.histograms.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+_metrics = Metrics()
+
+
+def get_metrics():
+    """The active sink."""
+    return _metrics
+
+
+def set_metrics_sink(sink):
+    """Route every metric update to `sink`; returns the previous one."""
+    global _metrics
+    previous, _metrics = _metrics, sink
+    return previous
+
+
+# ── Profiling: opt-in stack sampling of generate_hybrid (see profiler.py) ──
+
+_profiler = None
+
+
+def _profiled(fn):
+    """Run `fn` under the active profiler's tracking; one None check when off."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profiler = _profiler
+        if profiler is None:
+            return fn(*args, **kwargs)
+        with profiler.track():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def enable_profiling(out_dir="profiles", **kwargs):
+    """Start a SamplingProfiler(out_dir, **kwargs) on generate_hybrid; returns it."""
+    global _profiler
+    from profiler import SamplingProfiler
+    disable_profiling()
+    _profiler = SamplingProfiler(out_dir, **kwargs).start()
+    return _profiler
+
+
+def disable_profiling():
+    """Stop sampling and flush; returns the files written, or [] if profiling was off."""
+    global _profiler
+    profiler, _profiler = _profiler, None
+    return profiler.stop() if profiler is not None else []
+
+
+_inference_log = None
+
+
+def _logged(fn):
+    """Hand each request to the active inference log; one None check when off."""
+    @functools.wraps(fn)
+    def wrapper(messages, tools, *args, on_event=None, **kwargs):
+        log = _inference_log
+        if log is None:
+            return fn(messages, tools, *args, on_event=on_event, **kwargs)
+        events = []
+
+        def record(stage, payload):
+            events.append((stage, payload))
+            if on_event is not None:
+                on_event(stage, payload)
+
+        start = time.perf_counter()
+        result = fn(messages, tools, *args, on_event=record, **kwargs)
+        # escalate=False: the caller finishes the request and logs the final result
+        if not result.get("needs_cloud"):
+            log_request(messages, tools, result, events, (time.perf_counter() - start) * 1000)
+        return result
+    return wrapper
+
+
+def log_request(messages, tools, result, events, total_ms):
+    """
+    Hand one finished request to the active inference log, for requests
+    finished outside generate_hybrid (e.g. by the scheduler). `events` are
+    the (stage, payload) pairs its on_event saw. No-op when logging is off.
+    """
+    log = _inference_log
+    if log is None:
+        return
+    # Shallow snapshots only (sessions keep appending to `messages`); the writer thread does the rest
+    if not log.submit(list(messages), tools, dict(result), list(events), total_ms):
+        _metrics.inc("swissblaiz_inference_log_dropped_total")
+
+
+def enable_inference_log(out_dir="inference-logs", **kwargs):
+    """Start an InferenceLog(out_dir, **kwargs) on generate_hybrid; returns it."""
+    global _inference_log
+    from inference_log import InferenceLog
+    disable_inference_log()
+    _inference_log = InferenceLog(out_dir, **kwargs).start()
+    return _inference_log
+
+
+def disable_inference_log():
+    """Drain and close the log; returns the files written, or [] if logging was off."""
+    global _inference_log
+    log, _inference_log = _inference_log, None
+    return log.stop() if log is not None else []
+
 
 # ═══════════════════════════════════════════════════════════════
 # 1. COMPLEXITY ROUTER — Deterministic, <1ms
 # ═══════════════════════════════════════════════════════════════
 
+INTENT_KEYWORDS = {
+    "weather": ["weather", "temperature", "forecast"],
+    "alarm": ["alarm", "wake me", "wake up"],
+    "message": ["send", "text", "message", "tell"],
+    "reminder": ["remind", "reminder"],
+    "search": ["find", "look up", "search", "contacts"],
+    "music": ["play", "music", "song"],
+    "timer": ["timer", "countdown"],
+}
+
+# Endings a keyword may carry and still count as the whole word ("messages", "texting")
+INTENT_INFLECTIONS = frozenset(["s", "es", "d", "ed", "ing", "er", "ers"])
+
+
+class IntentMatcher:
+    """
+    Aho-Corasick automaton over intent keywords: one left-to-right pass
+    finds every keyword, however many there are. A match must start at a
+    word boundary and end at one, optionally after an inflection, so
+    "text" doesn't fire inside "context" nor "play" inside "display".
+    """
+
+    def __init__(self, keywords_by_intent):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]          # node -> [(keyword length, intent, keyword)] ending here
+        for intent, keywords in keywords_by_intent.items():
+            for kw in keywords:
+                kw = kw.lower()
+                node = 0
+                for ch in kw:
+                    nxt = self.goto[node].get(ch)
+                    if nxt is None:
+                        nxt = len(self.goto)
+                        self.goto[node][ch] = nxt
+                        self.goto.append({})
+                        self.fail.append(0)
+                        self.out.append([])
+                    node = nxt
+                self.out[node].append((len(kw), intent, kw))
+
+        # Breadth-first failure links; each node inherits its suffix's outputs
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+                queue.append(nxt)
+
+    def find(self, text):
+        """Every keyword hit as (start, end, intent, keyword), spans indexing `text`."""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            lowered = "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+        goto, fail, out = self.goto, self.fail, self.out
+        n = len(lowered)
+        matches = []
+        node = 0
+        for i, ch in enumerate(lowered):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            for length, intent, kw in out[node]:
+                start = i + 1 - length
+                if start and lowered[start - 1].isalnum():
+                    continue
+                end = i + 1
+                while end < n and lowered[end].isalnum():
+                    end += 1
+                if end - i - 1 and lowered[i + 1:end] not in INTENT_INFLECTIONS:
+                    continue
+                matches.append((start, end, intent, kw))
+        return matches
+
+    def intents(self, text):
+        return {intent for _, _, intent, _ in self.find(text)}
+
+
+_intent_matcher = IntentMatcher(INTENT_KEYWORDS)
+
+
+def detect_intents(message_text):
+    """Intent keyword spans in a message — (start, end, intent, keyword) per hit."""
+    return _intent_matcher.find(message_text)
+
+
 def classify_complexity(message_text: str, tools: list) -> str:
     num_tools = len(tools)
-    text_lower = message_text.lower()
-    
-    intent_keywords = {
-        "weather": ["weather", "temperature", "forecast"],
-        "alarm": ["alarm", "wake me", "wake up"],
-        "message": ["send", "text", "message", "tell"],
-        "reminder": ["remind", "reminder"],
-        "search": ["find", "look up", "search", "contacts"],
-        "music": ["play", "music", "song"],
-        "timer": ["timer", "countdown"],
-    }
-    
-    detected_intents = set()
-    for intent, keywords in intent_keywords.items():
-        for kw in keywords:
-            if kw in text_lower:
-                detected_intents.add(intent)
-                break
-    
-    num_intents = len(detected_intents)
+    num_intents = len(_intent_matcher.intents(message_text))
     
     if num_tools == 1 and num_intents <= 1:
         return "EASY"
@@ -57,40 +406,343 @@ def classify_complexity(message_text: str, tools: list) -> str:
 # 2. ON-DEVICE GENERATION — FunctionGemma via Cactus
 # ═══════════════════════════════════════════════════════════════
 
-def generate_cactus(messages, tools):
-    """Run function calling on-device via FunctionGemma + Cactus."""
-    model = cactus_init(functiongemma_path)
+_models = {}       # path -> (handle, lock); handles stay warm between calls
+_kv_owner = {}     # path -> conversation whose KV state the handle holds
+_model_load_kb = {}  # path -> RSS growth across its cactus_init, see memory_report()
+_pool_lock = threading.Lock()
 
-    # Wrap tools in the format FunctionGemma expects
-    cactus_tools = [{
-        "type": "function",
-        "function": t,
-    } for t in tools]
 
-    raw_str = cactus_complete(
-        model,
-        [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + messages,
-        tools=cactus_tools,
-        force_tools=True,
-        max_tokens=256,
-        stop_sequences=["<|im_end|>", "<end_of_turn>"],
-    )
+def detect_device_profile():
+    """"small" on devices with under SMALL_DEVICE_RAM_GB of physical memory, else "standard"."""
+    try:
+        ram_gb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 2**30
+    except (AttributeError, ValueError, OSError):
+        return "standard"
+    return "small" if ram_gb < SMALL_DEVICE_RAM_GB else "standard"
 
-    cactus_destroy(model)
 
+def select_variant(variant=None, profile=None):
+    """
+    Point FunctionGemma at one of MODEL_VARIANTS and return its name.
+    Without `variant`, the device profile's (`profile`, else DEVICE_PROFILE,
+    else detected); a profile's variant whose weights aren't on disk falls
+    back to DEFAULT_VARIANT. Handles already pooled stay loaded until
+    release_models().
+    """
+    global functiongemma_path, MODEL_VARIANT
+    if variant is None:
+        profile = profile or DEVICE_PROFILE or detect_device_profile()
+        if profile not in DEVICE_PROFILES:
+            raise ValueError(f"unknown device profile {profile!r}, expected one of {sorted(DEVICE_PROFILES)}")
+        variant = DEVICE_PROFILES[profile]
+        if not os.path.isdir(MODEL_VARIANTS.get(variant, "")):
+            variant = DEFAULT_VARIANT
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"unknown model variant {variant!r}, expected one of {sorted(MODEL_VARIANTS)}")
+    functiongemma_path, MODEL_VARIANT = MODEL_VARIANTS[variant], variant
+    return variant
+
+
+select_variant(MODEL_VARIANT)
+
+
+def _rss_kb():
+    """This process's resident set in kB, or None where /proc isn't available."""
     try:
-        raw = json.loads(raw_str)
-    except json.JSONDecodeError:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError):
+        return None
+
+
+def _get_model(path=None):
+    """Return a pooled model handle and its lock, loading it on first use."""
+    path = path or functiongemma_path
+    entry = _models.get(path)
+    if entry is None:
+        with _pool_lock:
+            entry = _models.get(path)
+            if entry is None:
+                init = cactus.cactus_init       # import timed on its own
+                rss_before = _rss_kb()
+                start = time.perf_counter()
+                entry = (init(path), threading.Lock())
+                _startup.setdefault(f"load {os.path.basename(path)}", (time.perf_counter() - start) * 1000)
+                rss_after = _rss_kb()
+                if rss_before is not None and rss_after is not None:
+                    _model_load_kb[path] = max(0, rss_after - rss_before)
+                _models[path] = entry
+    return entry
+
+
+def release_models():
+    """Destroy every pooled model handle."""
+    with _pool_lock:
+        for model, _ in _models.values():
+            cactus.cactus_destroy(model)
+        _models.clear()
+        _model_load_kb.clear()
+        _kv_owner.clear()
+
+
+def memory_report(path=None):
+    """
+    This process's memory in MB, from /proc (Linux): RSS, PSS (shared pages
+    split across the processes mapping them), shared vs private, the pages
+    the SDK maps straight from the weight files, and the model's footprint:
+    how much RSS grew across its cactus_init (0 until it is loaded). Only
+    weight-file pages can be shared between processes; whatever the SDK
+    copies into its own buffers shows up in model_load_mb and private_mb.
+    Empty where /proc isn't available.
+    """
+    model_path = path or functiongemma_path
+    # Trailing separator: ".../functiongemma-270m-it" must not match ".../functiongemma-270m-it-int4"
+    weights_dir = os.path.join(os.path.abspath(model_path), "")
+    totals = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if value.strip().endswith("kB"):
+                    totals[key] = int(value.split()[0])
+    except OSError:
+        return {}
+
+    weights = {"Rss": 0, "Pss": 0}
+    try:
+        with open("/proc/self/smaps") as f:
+            in_weights = False
+            for line in f:
+                key, _, value = line.partition(":")
+                if " " not in key:
+                    if key in weights and in_weights:
+                        weights[key] += int(value.split()[0])
+                else:
+                    # Mapping header: "start-end perms offset dev inode  pathname"
+                    in_weights = line.rstrip().split(None, 5)[-1].startswith(weights_dir)
+    except OSError:
+        pass
+
+    mb = lambda kb: round(kb / 1024, 1)
+    return {
+        "rss_mb": mb(totals.get("Rss", 0)),
+        "pss_mb": mb(totals.get("Pss", 0)),
+        "shared_mb": mb(totals.get("Shared_Clean", 0) + totals.get("Shared_Dirty", 0)),
+        "private_mb": mb(totals.get("Private_Clean", 0) + totals.get("Private_Dirty", 0)),
+        "weights_rss_mb": mb(weights["Rss"]),
+        "weights_pss_mb": mb(weights["Pss"]),
+        "model_load_mb": mb(_model_load_kb.get(model_path, 0)),
+    }
+
+
+atexit.register(release_models)
+
+
+def _parse_completion(raw):
+    """
+    SDK completion -> result dict, decoded once. `raw` may be the JSON
+    str, or bytes / a memoryview over the SDK's buffer, which orjson reads
+    without an intermediate str. The decoded dict is the result: missing
+    fields are filled in place, and any other SDK fields ride along.
+    """
+    if isinstance(raw, memoryview) and _json_loads is json.loads:
+        raw = raw.tobytes()
+    try:
+        parsed = _json_loads(raw)
+    except ValueError:      # orjson.JSONDecodeError is a json.JSONDecodeError
+        parsed = None
+    if not isinstance(parsed, dict):
+        _metrics.inc("swissblaiz_json_parse_failures_total", stage="completion")
         return {
             "function_calls": [],
             "total_time_ms": 0,
             "confidence": 0,
         }
 
+    parsed.setdefault("function_calls", [])
+    parsed.setdefault("total_time_ms", 0)
+    parsed.setdefault("confidence", 0)
+    return parsed
+
+
+def _edge_messages(messages):
+    """Flatten assistant tool calls into text for the on-device chat template."""
+    if not any("function_calls" in m for m in messages):
+        return messages
+    return [
+        {"role": m["role"], "content": m.get("content") or json.dumps(m["function_calls"])}
+        if "function_calls" in m else m
+        for m in messages
+    ]
+
+
+def generate_cactus(messages, tools, kv_key=None, temperature=None, path=None):
+    """
+    Run function calling on-device via FunctionGemma + Cactus.
+
+    The model handle is pooled, so the SDK keeps its KV cache between
+    calls. Consecutive calls sharing a `kv_key` (a session id) extend the
+    same conversation and only prefill the new tokens; anything else,
+    including every call without a key, resets the cache first. `temperature` overrides the SDK's sampling default;
+    `path` picks another pooled model (default: the FunctionGemma build
+    select_variant() chose).
+    """
+    path = path or functiongemma_path
+    model, lock = _get_model(path)
+
+    # Wrap tools in the format FunctionGemma expects
+    cactus_tools = [{
+        "type": "function",
+        "function": t,
+    } for t in tools]
+
+    options = {} if temperature is None else {"temperature": temperature}
+    with lock:
+        reset = getattr(cactus, "cactus_reset", None)
+        # Only the same session continuing may reuse the cache; stateless calls never share it
+        if reset is not None and (kv_key is None or _kv_owner.get(path) != kv_key):
+            reset(model)
+        _kv_owner[path] = kv_key
+
+        raw_str = cactus.cactus_complete(
+            model,
+            [{"role": "system", "content": "You are a helpful assistant that can use tools."}] + _edge_messages(messages),
+            tools=cactus_tools,
+            force_tools=True,
+            max_tokens=256,
+            stop_sequences=["<|im_end|>", "<end_of_turn>"],
+            **options,
+        )
+
+    return _parse_completion(raw_str)
+
+
+def _vote_key(calls, tools):
+    """Normalized call set, order- and case-insensitive, for comparing samples."""
+    return tuple(sorted(json.dumps(c, sort_keys=True).lower() for c in postprocess_batch(calls, tools)))
+
+
+def sample_ensemble(messages, tools, samples=ENSEMBLE_SAMPLES, agree=ENSEMBLE_AGREE,
+                    temperature=ENSEMBLE_TEMPERATURE, kv_key=None, path=None):
+    """
+    Self-consistency on the edge: draw up to `samples` completions at low
+    temperature, group them by normalized call set and stop as soon as
+    `agree` of them match. Samples run back to back on the pooled handle
+    (calls on one handle are serialized anyway), not batched, so early
+    stopping is what bounds the cost. Only the first sample runs under
+    the session's `kv_key`: the session's next turn carries one answer,
+    so later samples reset the cache rather than leave theirs in it.
+
+    Returns the most confident sample of the largest group. Its
+    `confidence` is the agreement rate (votes / samples drawn) times the
+    group's mean SDK confidence, so it stays on the single-sample scale
+    that thresholds and the repair loop compare against: two samples that
+    agree on a low-confidence answer still escalate. The SDK's own score
+    for the returned sample is kept as `sample_confidence`.
+    `total_time_ms` sums every sample and `sample_ms` lists them.
+    """
+    groups, drawn = {}, []
+    for i in range(max(1, samples)):
+        result = generate_cactus(messages, tools, kv_key=kv_key if i == 0 else None,
+                                 temperature=temperature, path=path)
+        drawn.append(result)
+        group = groups.setdefault(_vote_key(result["function_calls"], tools), [])
+        group.append(result)
+        if len(group) >= agree:
+            break
+    winners = max(groups.values(), key=lambda g: (len(g), max(r["confidence"] for r in g)))
+    best = max(winners, key=lambda r: r["confidence"])
+    agreement = len(winners) / len(drawn)
+    _metrics.inc("swissblaiz_ensemble_samples_total", len(drawn))
+    _metrics.observe("swissblaiz_ensemble_agreement", agreement)
+    return dict(
+        best,
+        confidence=agreement * statistics.fmean(r["confidence"] for r in winners),
+        sample_confidence=best["confidence"],
+        agreement=agreement,
+        samples=len(drawn),
+        sample_ms=[r["total_time_ms"] for r in drawn],
+        total_time_ms=sum(r["total_time_ms"] for r in drawn),
+    )
+
+
+# ── Rules backend: a regex grammar for the common one-tool phrasings ──
+
+_NAME = r"(?-i:[A-Z][\w'-]*(?:\s+[A-Z][\w'-]*)*)"
+_PRONOUNS = frozenset(["him", "her", "them"])
+_CLAUSE_SPLIT_RE = re.compile(r",\s*(?:and\s+)?|\s+and\s+(?:then\s+)?|\s+then\s+", re.I)
+# (tool, pattern); named groups are argument names, a trailing digit tells alternatives apart
+RULES = [
+    ("get_weather", r"\b(?:weather|forecast|temperature)(?:\s+like)?\s+(?:in|for|at)\s+(?P<location>.+)$"),
+    ("set_alarm", r"\b(?:alarm|wake me(?:\s+up)?)\b.*?\b(?:for|at)\s+(?P<time>.+)$"),
+    ("set_timer", r"\btimer\s+for\s+(?P<minutes>[\w-]+)\s+min(?:ute)?s?$"),
+    ("set_timer", r"\b(?P<minutes>[\w-]+)[\s-]min(?:ute)?\s+timer$"),
+    ("create_reminder", r"\bremind me\s+(?:to\s+|about\s+(?:the\s+)?)?(?P<title>.+?)\s+at\s+(?P<time>.+)$"),
+    ("search_contacts", rf"\b(?:find|look up|search for)\s+(?P<query>{_NAME})(?:\s+in my contacts)?$"),
+    ("send_message", rf"\b(?:send|text|message)\s+(?:a message to\s+(?P<recipient>{_NAME})"
+                     rf"|(?P<recipient2>{_NAME}|him|her|them)(?:\s+a message)?)\s+saying\s+(?P<message>.+)$"),
+    ("play_music", r"^play\s+(?:some\s+)?(?P<song>.+)$"),
+]
+_COMPILED_RULES = [(tool, re.compile(pattern, re.I)) for tool, pattern in RULES]
+
+
+def _match_rule(clause, index):
+    """(tool, args) for the first rule whose tool is in the toolset and matches, else None."""
+    for tool, pattern in _COMPILED_RULES:
+        if tool not in index.types:
+            continue
+        m = pattern.search(clause)
+        if m:
+            args = {}
+            for key, val in m.groupdict().items():
+                if val is not None:
+                    args[key.rstrip("0123456789")] = val.strip()
+            return tool, args
+    return None
+
+
+def generate_rules(messages, tools):
+    """
+    Answer from RULES alone, no model. The request is split into clauses
+    ("..., and ...", "... then ..."); a clause no rule matches is glued
+    back onto the previous one, so "saying rock and roll" survives.
+    Confidence is 1.0 when every clause that names an intent produced a
+    call and 0.0 otherwise; validation still checks the arguments.
+    """
+    start = time.perf_counter()
+    text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    index = _tool_index(tools)
+    clauses, matched = [], []
+    for clause in _CLAUSE_SPLIT_RE.split(text.strip().rstrip(".!?")):
+        hit = _match_rule(clause, index)
+        if hit is None and clauses:
+            clauses[-1] = f"{clauses[-1]} and {clause}"
+            matched[-1] = _match_rule(clauses[-1], index)
+        else:
+            clauses.append(clause)
+            matched.append(hit)
+
+    calls, names, complete = [], [], True
+    for clause, hit in zip(clauses, matched):
+        if hit is None:
+            complete = complete and not _intent_matcher.intents(clause)
+            continue
+        tool, args = hit
+        if args.get("recipient", "").lower() in _PRONOUNS:
+            if not names:
+                complete = False
+                continue
+            args["recipient"] = names[-1]
+        names += [args[k] for k in ("query", "recipient") if k in args]
+        if index.splits_time[tool] and "time" in args:
+            args = _split_time(args, index.types[tool])
+            args.pop("time", None)
+        calls.append({"name": tool, "arguments": args})
+
     return {
-        "function_calls": raw.get("function_calls", []),
-        "total_time_ms": raw.get("total_time_ms", 0),
-        "confidence": raw.get("confidence", 0),
+        "function_calls": calls,
+        "total_time_ms": (time.perf_counter() - start) * 1000,
+        "confidence": 1.0 if calls and complete else 0.0,
     }
 
 
@@ -98,11 +750,28 @@ def generate_cactus(messages, tools):
 # 3. CLOUD GENERATION — Gemini Flash via google.genai
 # ═══════════════════════════════════════════════════════════════
 
-def generate_cloud(messages, tools):
-    """Run function calling via Gemini Cloud API."""
-    client = genai.Client(api_key=os.environ.get("GEMINI_API_KEY"))
+GEMINI_MODEL = "gemini-2.0-flash"
+CLOUD_CACHE_MIN_TOKENS = 4096   # Gemini rejects cached contents below this size
+CLOUD_CACHE_TTL_S = 600
+CLOUD_CACHE_TTL = f"{CLOUD_CACHE_TTL_S}s"
+CLOUD_CACHE_RENEW_S = 60        # extend a cache's TTL once it has less than this left
+
+_cloud_client = None
+
+
+def _get_cloud_client():
+    """Shared Gemini client — one connection pool for every cloud call."""
+    global _cloud_client
+    if _cloud_client is None:
+        client = genai.Client
+        start = time.perf_counter()
+        _cloud_client = client(api_key=os.environ.get("GEMINI_API_KEY"))
+        _startup.setdefault("create gemini client", (time.perf_counter() - start) * 1000)
+    return _cloud_client
 
-    gemini_tools = [
+
+def _gemini_tools(tools):
+    return [
         types.Tool(function_declarations=[
             types.FunctionDeclaration(
                 name=t["name"],
@@ -120,109 +789,733 @@ def generate_cloud(messages, tools):
         ])
     ]
 
-    contents = [m["content"] for m in messages if m["role"] == "user"]
 
-    start_time = time.time()
+def _message_chars(message):
+    """Cheap size estimate of a message (~4 chars per token)."""
+    size = len(message.get("content") or "")
+    for c in message.get("function_calls") or []:
+        size += len(c.get("name", "")) + len(json.dumps(c.get("arguments", {})))
+    return size
 
-    gemini_response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=contents,
-        config=types.GenerateContentConfig(tools=gemini_tools),
-    )
 
-    total_time_ms = (time.time() - start_time) * 1000
+class CloudSession:
+    """
+    Multi-turn Gemini conversation with incremental, typed history.
 
-    function_calls = []
-    for candidate in gemini_response.candidates:
-        for part in candidate.content.parts:
-            if part.function_call:
-                function_calls.append({
-                    "name": part.function_call.name,
-                    "arguments": dict(part.function_call.args),
-                })
+    Messages are converted to `types.Content` once, as they arrive:
+    system turns become the system instruction, assistant turns become
+    "model" turns (including any `function_calls` they carry) and user
+    turns answer pending function calls before adding their text.
 
-    return {
-        "function_calls": function_calls,
-        "total_time_ms": total_time_ms,
-    }
+    Once the settled prefix is large enough, it is pushed into a Gemini
+    context cache so each new turn only sends the uncached delta. The
+    cache's TTL is extended before it runs out; a cache that can't be
+    extended or is rejected is dropped and the turn sent uncached.
+    """
+
+    def __init__(self, tools, cache=True):
+        self.tools = tools
+        self.gemini_tools = _gemini_tools(tools)
+        self.system_instruction = None
+        self.history = []           # list[types.Content]
+        self.use_cache = cache
+        self._chars = []            # size estimate per history entry
+        self._synced = 0            # caller messages already in history
+        self._pending_calls = []    # model calls awaiting a function response
+        self._cache = None
+        self._cached_upto = 0       # history[:_cached_upto] lives in the cache
+        self._cache_expires = 0.0   # time.monotonic() at which the cache's TTL runs out
+
+    def sync(self, messages):
+        """Convert only the messages not seen on a previous turn."""
+        for m in messages[self._synced:]:
+            self._append(m)
+        self._synced = len(messages)
+
+    def _append(self, message):
+        role = message["role"]
+        content = message.get("content") or ""
+
+        if role == "system":
+            # The system instruction is baked into the cache — changing it invalidates the prefix
+            self.system_instruction = content if not self.system_instruction else self.system_instruction + "\n" + content
+            self._drop_cache()
+            return
+
+        if role == "assistant":
+            calls = message.get("function_calls") or []
+            parts = [types.Part(text=content)] if content else []
+            parts += [
+                types.Part(function_call=types.FunctionCall(name=c["name"], args=c.get("arguments", {})))
+                for c in calls
+            ]
+            self._pending_calls = [c["name"] for c in calls]
+            if parts:
+                self.history.append(types.Content(role="model", parts=parts))
+                self._chars.append(_message_chars(message))
+            return
+
+        # Tools run client-side: acknowledge the model's calls before the next user turn
+        parts = [
+            types.Part.from_function_response(name=name, response={"status": "done"})
+            for name in self._pending_calls
+        ]
+        self._pending_calls = []
+        if content:
+            parts.append(types.Part(text=content))
+        if parts:
+            self.history.append(types.Content(role="user", parts=parts))
+            self._chars.append(_message_chars(message))
+
+    def _drop_cache(self):
+        if self._cache is not None:
+            try:
+                _get_cloud_client().caches.delete(name=self._cache.name)
+            except Exception:
+                pass
+        self._cache = None
+        self._cached_upto = 0
+
+    def _renew_cache(self, client):
+        """Push the cache's expiry out by another TTL once it is close; drop it if that fails."""
+        if self._cache is None or time.monotonic() < self._cache_expires - CLOUD_CACHE_RENEW_S:
+            return
+        try:
+            client.caches.update(name=self._cache.name,
+                                 config=types.UpdateCachedContentConfig(ttl=CLOUD_CACHE_TTL))
+        except Exception:
+            # Already expired or deleted server-side; _refresh_cache rebuilds it from the history
+            self._drop_cache()
+            return
+        self._cache_expires = time.monotonic() + CLOUD_CACHE_TTL_S
+
+    def _refresh_cache(self, client):
+        """Cache everything but the newest turn once the uncached prefix is big enough."""
+        self._renew_cache(client)
+        if not self.use_cache or len(self.history) < 2:
+            return
+        upto = len(self.history) - 1
+        if sum(self._chars[self._cached_upto:upto]) < CLOUD_CACHE_MIN_TOKENS * 4:
+            return
+        created = time.monotonic()
+        try:
+            cache = client.caches.create(
+                model=GEMINI_MODEL,
+                config=types.CreateCachedContentConfig(
+                    contents=self.history[:upto],
+                    system_instruction=self.system_instruction,
+                    tools=self.gemini_tools,
+                    ttl=CLOUD_CACHE_TTL,
+                ),
+            )
+        except Exception:
+            # Model or prefix not cacheable — keep sending full history
+            self.use_cache = False
+            return
+        self._drop_cache()
+        self._cache = cache
+        self._cached_upto = upto
+        self._cache_expires = created + CLOUD_CACHE_TTL_S
+
+    def generate(self, messages):
+        """Run one turn; `messages` is the full conversation so far."""
+        self.sync(messages)
+        client = _get_cloud_client()
+        self._refresh_cache(client)
+
+        start_time = time.time()
+
+        gemini_response = None
+        if self._cache is not None:
+            try:
+                gemini_response = client.models.generate_content(
+                    model=GEMINI_MODEL,
+                    contents=self.history[self._cached_upto:],
+                    config=types.GenerateContentConfig(cached_content=self._cache.name),
+                )
+            except Exception:
+                # Cache gone or rejected: forget it and resend the full history below
+                self._drop_cache()
+        if gemini_response is None:
+            gemini_response = client.models.generate_content(
+                model=GEMINI_MODEL,
+                contents=self.history,
+                config=types.GenerateContentConfig(
+                    tools=self.gemini_tools,
+                    system_instruction=self.system_instruction,
+                ),
+            )
+
+        total_time_ms = (time.time() - start_time) * 1000
+
+        function_calls = []
+        for candidate in gemini_response.candidates:
+            for part in candidate.content.parts:
+                if part.function_call:
+                    function_calls.append({
+                        "name": part.function_call.name,
+                        "arguments": dict(part.function_call.args),
+                    })
+
+        return {
+            "function_calls": function_calls,
+            "total_time_ms": total_time_ms,
+        }
+
+    def close(self):
+        self._drop_cache()
+
+
+def generate_cloud(messages, tools):
+    """Run function calling via Gemini Cloud API (single turn, full history)."""
+    return CloudSession(tools, cache=False).generate(messages)
 
 
 # ═══════════════════════════════════════════════════════════════
 # 4. POST-PROCESSING — Normalize for F1 Score
 # ═══════════════════════════════════════════════════════════════
 
-def postprocess_call(call: dict, tools: list) -> dict:
-    """Normalize function calls for maximum F1 accuracy."""
+# ── Numbers & times: tables and regexes are built once at import ──
+
+_UNITS = [
+    "zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine",
+    "ten", "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen",
+    "seventeen", "eighteen", "nineteen",
+]
+_TENS = ["twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+_IRREGULAR_ORDINALS = {
+    "one": "first", "two": "second", "three": "third", "five": "fifth",
+    "eight": "eighth", "nine": "ninth", "twelve": "twelfth",
+}
+_SCALES = {"hundred": 100, "thousand": 1000}
+
+
+def _ordinal_word(word):
+    if word in _IRREGULAR_ORDINALS:
+        return _IRREGULAR_ORDINALS[word]
+    return word[:-1] + "ieth" if word.endswith("y") else word + "th"
+
+
+_NUMBER_WORDS = {w: n for n, w in enumerate(_UNITS)}
+_NUMBER_WORDS.update({w: 20 + 10 * i for i, w in enumerate(_TENS)})
+_NUMBER_WORDS.update({_ordinal_word(w): n for w, n in list(_NUMBER_WORDS.items()) if n})
+_NUMBER_WORDS.update({"a": 1, "an": 1})   # "a hundred", "an hour"
+
+_LEADING_NUM_RE = re.compile(r"[+-]?\d+(?:\.\d+)?")
+_WORD_SPLIT_RE = re.compile(r"[\s\-]+")
+_TIME_DIGITS_RE = re.compile(r"^(\d{1,2})(?:\s?[:.h ]\s?(\d{2}))?$")
+_MERIDIEM_RE = re.compile(r"\s*(?:(?<![a-z])([ap])\.?\s?m\.?|in the (morning|afternoon|evening)|at night|tonight)$")
+_RELATIVE_TIME_RE = re.compile(r"^(?:a\s+)?(.+?)\s+(past|after|to|till|before|of)\s+(.+)$")
+_OCLOCK_RE = re.compile(r"\s*o'?\s?clock")
+_RELATIVE_MINUTES = {"half": 30, "quarter": 15}
+_NAMED_TIMES = {"noon": (12, 0), "midday": (12, 0), "midnight": (0, 0)}
+
+
+def _words_to_int(tokens):
+    """Value of the leading run of number words, or None if there is none."""
+    total = current = 0
+    seen = False
+    for tok in tokens:
+        if tok == "and" and seen:
+            continue
+        if tok in _SCALES and seen:
+            scale = _SCALES[tok]
+            if scale >= 1000:
+                total += (current or 1) * scale
+                current = 0
+            else:
+                current = (current or 1) * scale
+            continue
+        value = _NUMBER_WORDS.get(tok)
+        if value is None:
+            break
+        current += value
+        seen = True
+    return total + current if seen else None
+
+
+def parse_number(text):
+    """'7', '7.5', 'twenty-five', 'one hundred and five', 'fifth', '5 minutes' -> int, else None."""
+    t = text.strip().lower()
+    if t in _NUMBER_WORDS:
+        return _NUMBER_WORDS[t]
+    m = _LEADING_NUM_RE.match(t)
+    if m:
+        return int(float(m.group()))
+    return _words_to_int(_WORD_SPLIT_RE.split(t))
+
+
+def _parse_time(text):
+    """(hour24, minute, meridiem_known) for a spoken or written time, else None."""
+    t = _OCLOCK_RE.sub("", text.strip().lower()).strip()
+    if t in _NAMED_TIMES:
+        return _NAMED_TIMES[t] + (True,)
+
+    meridiem = None
+    m = _MERIDIEM_RE.search(t)
+    if m:
+        meridiem = "am" if m.group(1) == "a" or m.group(2) == "morning" else "pm"
+        t = t[:m.start()].strip()
+
+    m = _TIME_DIGITS_RE.match(t)
+    if m:
+        hour, minute = int(m.group(1)), int(m.group(2) or 0)
+    else:
+        m = _RELATIVE_TIME_RE.match(t)
+        if m:
+            amount, relation, base = m.groups()
+            minute = _RELATIVE_MINUTES.get(amount)
+            if minute is None:
+                minute = parse_number(amount)
+            hour = parse_number(base) if base not in _NAMED_TIMES else _NAMED_TIMES[base][0]
+            if minute is None or hour is None or not 0 < minute < 60:
+                return None
+            if relation in ("to", "till", "before", "of"):
+                # "quarter to one" reads on a 12-hour clock: 12:45, not 0:45
+                hour, minute = (hour - 1) % 24 or 12, 60 - minute
+        else:
+            tokens = _WORD_SPLIT_RE.split(t)
+            hour = _NUMBER_WORDS.get(tokens[0])
+            rest = tokens[1:]
+            if rest and rest[0] in ("oh", "o"):
+                rest = rest[1:]
+            minute = _words_to_int(rest) if rest else 0
+            if hour is None or minute is None:
+                return None
+
+    if hour > 23 or minute > 59 or (meridiem and not 0 < hour <= 12):
+        return None
+    if meridiem == "pm" and hour < 12:
+        hour += 12
+    elif meridiem == "am" and hour == 12:
+        hour = 0
+    return hour, minute, meridiem is not None or hour == 0 or hour > 12
+
+
+def parse_time(text):
+    """'7:00 AM', '19:30', 'half past seven', 'quarter to 8 pm' -> (hour24, minute), else None."""
+    parsed = _parse_time(text)
+    return parsed[:2] if parsed else None
+
+
+def format_time(hour, minute):
+    """(15, 0) -> '3:00 PM' — the format the benchmark expects for time strings."""
+    return f"{hour % 12 or 12}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+
+
+def _normalize_time_string(val):
+    parsed = _parse_time(val)
+    # Without AM/PM, "3:00" is ambiguous — leave it as the model wrote it
+    if parsed is None or not parsed[2]:
+        return val
+    return format_time(parsed[0], parsed[1])
+
+
+def _split_time(args, prop_types):
+    """Spread a spoken time ("7:30 AM") over integer hour/minute fields."""
+    spoken = args.get("hour")
+    if not isinstance(spoken, str) and "time" not in prop_types:
+        spoken = args.get("time")
+    if not isinstance(spoken, str):
+        return args
+    parsed = parse_time(spoken)
+    if parsed is None:
+        return args
+    args = dict(args)
+    args["hour"] = parsed[0]
+    if parsed[1] or "minute" not in args:
+        args["minute"] = parsed[1]
+    return args
+
+
+# ── Fuzzy identifier matching: near-miss tool names and argument keys ──
+
+FUZZY_MIN_SIMILARITY = 0.75     # below this a near-miss is treated as unknown
+TOKEN_ORDER_SIMILARITY = 0.9    # "weather_get" for "get_weather"
+FUZZY_MEMO_SIZE = 4096
+
+_CAMEL_RE = re.compile(r"(?<=[a-z0-9])(?=[A-Z])")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+
+def _canonical_identifier(word):
+    """'setAlarm', 'Set-Alarm ', 'set alarm' -> 'set_alarm'."""
+    return _NON_ALNUM_RE.sub("_", _CAMEL_RE.sub("_", word).lower()).strip("_")
+
+
+def _levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+    """Burkhard-Keller tree: edit-distance range queries without a full scan."""
+
+    def __init__(self, words=()):
+        self.root = None   # (word, {distance: child})
+        for w in words:
+            self.add(w)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = _levenshtein(word, node[0])
+            if d == 0:
+                return
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (word, {})
+                return
+            node = child
+
+    def search(self, word, max_dist):
+        """[(distance, word)] for every word within `max_dist` edits."""
+        hits = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_word, children = stack.pop()
+            d = _levenshtein(word, node_word)
+            if d <= max_dist:
+                hits.append((d, node_word))
+            for child_dist, child in children.items():
+                if d - max_dist <= child_dist <= d + max_dist:
+                    stack.append(child)
+        return hits
+
+
+class FuzzyMatcher:
+    """
+    Resolves identifiers against a fixed vocabulary, cheapest test first:
+    exact, canonical form (case/camelCase/separators), separator-free form,
+    token order, then bounded edit distance through a BK-tree.
+    `match` returns (word, similarity) or (None, 0.0).
+    """
+
+    def __init__(self, words):
+        self.exact = set(words)
+        self.canonical = {}
+        self.squashed = {}
+        self.token_sets = {}
+        for w in words:
+            c = _canonical_identifier(w)
+            self.canonical.setdefault(c, w)
+            self.squashed.setdefault(c.replace("_", ""), w)
+            self.token_sets.setdefault(tuple(sorted(c.split("_"))), w)
+        self.tree = BKTree(self.canonical)
+        self._memo = {}
+
+    def match(self, word):
+        if word in self.exact:
+            return word, 1.0
+        hit = self._memo.get(word)
+        if hit is None:
+            if len(self._memo) >= FUZZY_MEMO_SIZE:
+                self._memo.clear()
+            hit = self._memo[word] = self._match(word)
+        return hit
+
+    def _match(self, word):
+        c = _canonical_identifier(word)
+        if c in self.canonical:
+            return self.canonical[c], 1.0
+        if c.replace("_", "") in self.squashed:
+            return self.squashed[c.replace("_", "")], 1.0
+        tokens = tuple(sorted(c.split("_")))
+        if tokens in self.token_sets:
+            return self.token_sets[tokens], TOKEN_ORDER_SIMILARITY
+
+        max_dist = int(len(c) * (1 - FUZZY_MIN_SIMILARITY))
+        if max_dist == 0:
+            return None, 0.0
+        hits = sorted(self.tree.search(c, max_dist))
+        # Two equally close candidates: refuse to guess
+        if not hits or (len(hits) > 1 and hits[0][0] == hits[1][0]):
+            return None, 0.0
+        dist, best = hits[0]
+        similarity = 1 - dist / max(len(c), len(best))
+        if similarity < FUZZY_MIN_SIMILARITY:
+            return None, 0.0
+        return self.canonical[best], similarity
+
+
+TOOL_INDEX_CACHE_SIZE = 64
+_tool_indexes = OrderedDict()      # toolset content hash -> ToolIndex
+_tool_index_ids = OrderedDict()    # tuple of tool ids -> (tools, ToolIndex); holding tools keeps the ids live
+_tool_index_lock = threading.Lock()  # both LRUs; server and scheduler workers share them
+
+
+class ToolIndex:
+    """Lookup tables compiled once per toolset so postprocessing never rescans it."""
+
+    def __init__(self, tools):
+        self.tools = tools   # held so the id()-based cache key stays unique
+        self.by_name = {t["name"]: t for t in tools}
+        self.names = FuzzyMatcher(list(self.by_name))
+
+        self.types = {}       # tool -> {prop: type}
+        self.keys = {}        # tool -> FuzzyMatcher over its props
+        self.defaults = {}    # tool -> [(required prop, default)]
+        self.required = {}    # tool -> required props, schema order
+        self.time_keys = {}   # tool -> string props holding a clock time
+        self.splits_time = {} # tool -> has integer hour + minute props
+        for name, t in self.by_name.items():
+            params = t.get("parameters", {})
+            properties = params.get("properties", {})
+            prop_types = {k: p.get("type", "string") for k, p in properties.items()}
+            self.types[name] = prop_types
+            self.time_keys[name] = frozenset(
+                k for k, ptype in prop_types.items()
+                if ptype == "string" and (k == "time" or k.endswith("_time"))
+            )
+            self.splits_time[name] = prop_types.get("hour") == prop_types.get("minute") == "integer"
+            self.keys[name] = FuzzyMatcher(list(properties))
+            self.defaults[name] = [
+                (req, 0 if properties.get(req, {}).get("type", "string") == "integer" else "")
+                for req in params.get("required", [])
+            ]
+            self.required[name] = tuple(params.get("required", []))
+
+    def match_name(self, name):
+        """(tool name, similarity); unknown names come back unchanged with 0.0."""
+        resolved, score = self.names.match(name)
+        return (resolved, score) if resolved is not None else (name, 0.0)
+
+    def match_key(self, tool, key):
+        """(prop, similarity) for an argument key of `tool`, or (None, 0.0)."""
+        return self.keys[tool].match(key)
+
+
+def _toolset_hash(tools):
+    """Content hash of a toolset; equal schemas decoded from different requests share it."""
+    return hashlib.sha1(json.dumps(tools, sort_keys=True, separators=(",", ":"), default=str).encode()).digest()
+
+
+def _tool_index(tools):
+    """
+    Fetch (or compile) the index for a toolset. Repeat calls with the same
+    tool objects hit an identity cache; a toolset seen for the first time
+    (e.g. freshly decoded from a request) is hashed once and shares the
+    index of any equal toolset. Both caches are LRU.
+    """
+    key = tuple(map(id, tools))
+    with _tool_index_lock:
+        entry = _tool_index_ids.get(key)
+        if entry is not None:
+            _tool_index_ids.move_to_end(key)
+            return entry[1]
+
+    digest = _toolset_hash(tools)   # outside the lock; only the cache updates need it
+    with _tool_index_lock:
+        index = _tool_indexes.get(digest)
+        if index is None:
+            index = _tool_indexes[digest] = ToolIndex(tools)
+            if len(_tool_indexes) > TOOL_INDEX_CACHE_SIZE:
+                _tool_indexes.popitem(last=False)
+        else:
+            _tool_indexes.move_to_end(digest)
+        _tool_index_ids[key] = (tools, index)
+        if len(_tool_index_ids) > TOOL_INDEX_CACHE_SIZE:
+            _tool_index_ids.popitem(last=False)
+    return index
+
+
+def _coerce(val, expected_type):
+    if expected_type == "integer":
+        return _normalize_integer(val)
+    if expected_type == "string":
+        return str(val).strip() if val is not None else ""
+    return val
+
+
+def _postprocess(call, index):
+    """(normalized call, match score) — score is 1.0 unless names or keys were guessed."""
     name = call.get("name", "")
     args = call.get("arguments", {})
-    
+
     if isinstance(args, str):
         try:
-            args = json.loads(args)
-        except:
+            args = _json_loads(args)
+        except ValueError:
+            _metrics.inc("swissblaiz_json_parse_failures_total", stage="arguments")
             args = {}
-    
+
     if not isinstance(args, dict):
         args = {}
-    
-    tool_map = {t["name"]: t for t in tools}
-    
+
     # Fuzzy name matching
-    if name not in tool_map:
-        name_lower = name.lower().strip()
-        for tname in tool_map:
-            if tname.lower() == name_lower:
-                name = tname
-                break
-    
-    if name not in tool_map:
-        return {"name": name, "arguments": args}
-    
-    schema = tool_map[name]
-    properties = schema.get("parameters", {}).get("properties", {})
-    
+    resolved, score = index.match_name(name)
+    prop_types = index.types.get(resolved)
+    if prop_types is None:
+        _metrics.inc("swissblaiz_postprocess_repairs_total", kind="unknown_tool")
+        return {"name": resolved, "arguments": args}, 0.0
+    if resolved != name:
+        name = resolved
+        _metrics.inc("swissblaiz_postprocess_repairs_total", kind="tool_name")
+
+    if index.splits_time[name]:
+        args = _split_time(args, prop_types)
+
+    time_keys = index.time_keys[name]
     fixed_args = {}
     for key, val in args.items():
-        if key in properties:
-            expected_type = properties[key].get("type", "string")
-            if expected_type == "integer":
-                fixed_args[key] = _normalize_integer(val)
-            elif expected_type == "string":
-                fixed_args[key] = str(val).strip() if val is not None else ""
-            else:
-                fixed_args[key] = val
+        if key in prop_types:
+            prop_key = key
         else:
             # Fuzzy key matching
-            for prop_key in properties:
-                if key.lower().replace('_','') == prop_key.lower().replace('_',''):
-                    fixed_args[prop_key] = val
-                    break
-    
+            prop_key, key_score = index.match_key(name, key)
+            if prop_key is None:
+                _metrics.inc("swissblaiz_postprocess_repairs_total", kind="dropped_key")
+                continue
+            _metrics.inc("swissblaiz_postprocess_repairs_total", kind="argument_key")
+            score *= key_score
+        val = _coerce(val, prop_types[prop_key])
+        if prop_key in time_keys:
+            val = _normalize_time_string(val)
+        fixed_args[prop_key] = val
+
     # Fill missing required args
-    required = schema.get("parameters", {}).get("required", [])
-    for req in required:
+    for req, default in index.defaults[name]:
         if req not in fixed_args:
-            prop = properties.get(req, {})
-            ptype = prop.get("type", "string")
-            fixed_args[req] = 0 if ptype == "integer" else ""
-    
-    return {"name": name, "arguments": fixed_args}
+            fixed_args[req] = default
+
+    return {"name": name, "arguments": fixed_args}, score
+
+
+def postprocess_call(call: dict, tools: list) -> dict:
+    """Normalize function calls for maximum F1 accuracy."""
+    return _postprocess(call, _tool_index(tools))[0]
+
+
+def postprocess_batch(calls: list, tools: list) -> list:
+    """Normalize many calls against one toolset with a single index lookup."""
+    index = _tool_index(tools)
+    return [_postprocess(c, index)[0] for c in calls]
+
+
+def postprocess_scored(calls: list, tools: list):
+    """
+    Like `postprocess_batch`, plus the lowest match score across the calls:
+    1.0 when every name and key was known, lower for fuzzy repairs, 0.0
+    when a tool could not be resolved. Routing scales confidence by it.
+    """
+    index = _tool_index(tools)
+    fixed, match_score = [], 1.0
+    for c in calls:
+        call, score = _postprocess(c, index)
+        fixed.append(call)
+        match_score = min(match_score, score)
+    return fixed, match_score
+
+
+# ── Structural validation: does an output fit the toolset at all? ──
+
+_INTEGER_STRING_RE = re.compile(r"[+-]?\d+(?:\.0*)?")
+
+
+def _type_ok(val, expected_type):
+    """Would `val` survive as `expected_type` without guessing? Digit strings do, "ten" doesn't."""
+    if expected_type in ("integer", "number"):
+        if isinstance(val, bool):
+            return False
+        if isinstance(val, int):
+            return True
+        if isinstance(val, float):
+            return expected_type == "number" or val.is_integer()
+        pattern = _INTEGER_STRING_RE if expected_type == "integer" else _LEADING_NUM_RE
+        return isinstance(val, str) and pattern.fullmatch(val.strip()) is not None
+    if expected_type == "boolean":
+        return isinstance(val, bool) or (isinstance(val, str) and val.lower() in ("true", "false"))
+    if expected_type == "array":
+        return isinstance(val, list)
+    if expected_type == "object":
+        return isinstance(val, dict)
+    return not isinstance(val, (dict, list))
+
+
+def _validate_call(call, index):
+    """[(kind, message)] for one call; names and keys resolve the way postprocessing will."""
+    name = call.get("name", "") if isinstance(call, dict) else ""
+    resolved, _ = index.match_name(name)
+    prop_types = index.types.get(resolved)
+    if prop_types is None:
+        return [("unknown_tool", f"unknown function '{name}'")]
+
+    args = call.get("arguments", {})
+    if isinstance(args, str):
+        try:
+            args = json.loads(args)
+        except ValueError:
+            return [("bad_arguments", f"{resolved}: arguments are not valid JSON")]
+    if not isinstance(args, dict):
+        return [("bad_arguments", f"{resolved}: arguments must be an object")]
+
+    # A clock time in a "time" arg fills hour/minute; a spelled-out hour is still a type error
+    if index.splits_time[resolved] and "time" not in prop_types and isinstance(args.get("time"), str):
+        parsed = parse_time(args["time"])
+        if parsed is not None:
+            args = dict(args, hour=parsed[0], minute=parsed[1])
+
+    errors, supplied = [], set()
+    for key, val in args.items():
+        prop = key if key in prop_types else index.match_key(resolved, key)[0]
+        if prop is None:
+            continue        # extra args are dropped by postprocessing
+        supplied.add(prop)
+        if not _type_ok(val, prop_types[prop]):
+            errors.append(("bad_type", f"{resolved}: arg '{prop}' expects {prop_types[prop]}, got {val!r}"))
+    for req in index.required[resolved]:
+        if req not in supplied:
+            errors.append(("missing_arg", f"{resolved}: missing required arg '{req}'"))
+    return errors
+
+
+def validate_tool_calls(calls: list, tools: list, min_calls: int = 0) -> dict:
+    """
+    Structural check of raw model output against the toolset, compiled
+    once per toolset through the ToolIndex cache.
+
+    Returns {"valid", "score", "errors"}: valid when there is at least
+    one call, at least `min_calls` of them, and every call names a known
+    tool with its required args of the right types. score is the share
+    of calls that pass, out of max(len(calls), min_calls) — routing
+    multiplies confidence by it.
+    """
+    index = _tool_index(tools)
+    problems, passing = [], 0
+    for call in calls:
+        found = _validate_call(call, index)
+        passing += not found
+        problems += found
+    if not calls:
+        problems.append(("no_calls", "no function calls"))
+    elif len(calls) < min_calls:
+        problems.append(("too_few_calls", f"expected at least {min_calls} calls for the detected intents, got {len(calls)}"))
+    for kind, _ in problems:
+        _metrics.inc("swissblaiz_validation_errors_total", kind=kind)
+    denominator = max(len(calls), min_calls)
+    return {
+        "valid": not problems,
+        "score": passing / denominator if denominator else 0.0,
+        "errors": [message for _, message in problems],
+    }
 
 
 def _normalize_integer(v):
     if isinstance(v, int): return v
     if isinstance(v, float): return int(v)
     if isinstance(v, str):
-        v_clean = v.strip().lower()
-        word_to_num = {
-            "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
-            "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
-            "eleven": 11, "twelve": 12, "fifteen": 15, "twenty": 20,
-            "thirty": 30, "forty-five": 45,
-        }
-        if v_clean in word_to_num: return word_to_num[v_clean]
-        try: return int(float(v_clean))
-        except: return 0
+        n = parse_number(v)
+        return 0 if n is None else n
     return 0
 
 
@@ -230,17 +1523,100 @@ def _normalize_integer(v):
 # 5. HYBRID GENERATION — Edge + Cloud Fallback
 # ═══════════════════════════════════════════════════════════════
 
-def generate_hybrid(messages, tools, confidence_threshold=0.5):
+# ── Confidence calibration (fitted offline by calibration.py) ──
+
+class Calibrator:
+    """
+    Per-complexity map from routing confidence to expected local F1.
+    Isotonic tiers are piecewise-linear knots, Platt tiers a sigmoid;
+    tiers without a fit pass confidence through. An artifact may also
+    carry thresholds chosen on the calibrated scale, which then replace
+    the CONFIDENCE_THRESHOLD_* constants for those tiers.
+    """
+
+    def __init__(self, artifact):
+        self.method = artifact["method"]
+        self.thresholds = dict(artifact.get("thresholds", {}))
+        if self.method == "isotonic":
+            self.tiers = {t: (tuple(p["x"]), tuple(p["y"])) for t, p in artifact["tiers"].items()}
+        elif self.method == "platt":
+            self.tiers = {t: (p["a"], p["b"]) for t, p in artifact["tiers"].items()}
+        else:
+            raise ValueError(f"unknown calibration method {self.method!r}")
+
+    def __call__(self, complexity, confidence):
+        params = self.tiers.get(complexity)
+        if params is None:
+            return confidence
+        if self.method == "platt":
+            a, b = params
+            z = max(-60.0, min(60.0, a * confidence + b))
+            return 1.0 / (1.0 + math.exp(-z))
+        xs, ys = params
+        i = bisect.bisect_right(xs, confidence)
+        if i == 0:
+            return ys[0]
+        if i == len(xs):
+            return ys[-1]
+        x0, x1 = xs[i - 1], xs[i]
+        return ys[i - 1] + (ys[i] - ys[i - 1]) * (confidence - x0) / (x1 - x0)
+
+
+_calibrator = None
+
+
+def load_calibration(path):
+    """Install the calibration artifact at `path` (None removes it); returns the Calibrator."""
+    global _calibrator
+    start = time.perf_counter()
+    if path is None:
+        _calibrator = None
+    else:
+        with open(path) as f:
+            _calibrator = Calibrator(json.load(f))
+    _startup["load calibration"] = (time.perf_counter() - start) * 1000
+    return _calibrator
+
+
+if CALIBRATION_PATH:
+    load_calibration(CALIBRATION_PATH)
+
+
+@_logged
+@_profiled
+def generate_hybrid(messages, tools, confidence_threshold=0.5, cloud_session=None, session=None,
+                    on_event=None, escalate=True):
     """
     SwissblAIz V3 Hybrid Compute.
     
     Strategy:
     1. Classify complexity
-    2. Run on-device via FunctionGemma + Cactus 
-    3. If confidence < threshold or no calls, fall back to Gemini Flash
-    4. Post-process and normalize all function calls for F1
+    2. Run the CASCADE tiers on-device, cheapest first (by default just
+       FunctionGemma + Cactus)
+    3. Validate each tier's calls structurally and post-process them for F1
+    4. If that fails validation and confidence is short, re-prompt the
+       edge model with the errors, up to REPAIR_MAX_ATTEMPTS within
+       REPAIR_BUDGET_MS
+    5. If no tier's confidence x validation score reaches its threshold,
+       fall back to Gemini Flash
+
+    Pass a `CloudSession` to keep cloud history (and its context cache)
+    across turns instead of resending the whole conversation, or a
+    `Session` to also keep the on-device KV state between turns.
+
+    `on_event(stage, payload)` is called as each stage finishes
+    ("classify", "infer", "repair", "route", "postprocess") — the server streams
+    these to the demo UI.
+
+    With `escalate=False` a result that needs the cloud comes back as the
+    local one flagged `needs_cloud`; finish it with `escalate_to_cloud` and
+    log the final result with `log_request`.
     """
-    user_text = next((m["content"] for m in messages if m["role"] == "user"), "")
+    kv_key = session.id if session is not None else None
+
+    # Route on the newest turn — earlier turns are context, not new intents
+    user_text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    start = time.perf_counter()
     complexity = classify_complexity(user_text, tools)
     
     THRESHOLDS = {
@@ -249,33 +1625,190 @@ def generate_hybrid(messages, tools, confidence_threshold=0.5):
         "HARD": CONFIDENCE_THRESHOLD_HARD,
     }
     threshold = THRESHOLDS.get(complexity, confidence_threshold)
-    
-    # Step 1: Try on-device
-    local = generate_cactus(messages, tools)
-    
-    # Step 2: Decide if cloud fallback needed
-    needs_cloud = local["confidence"] < threshold or len(local["function_calls"]) == 0
-    
-    if needs_cloud and local["confidence"] < threshold:
-        try:
-            cloud = generate_cloud(messages, tools)
-            cloud["source"] = "cloud (fallback)"
-            cloud["local_confidence"] = local["confidence"]
-            cloud["total_time_ms"] += local["total_time_ms"]
-            
-            # Post-process cloud calls
-            cloud["function_calls"] = [postprocess_call(c, tools) for c in cloud["function_calls"]]
-            return cloud
-        except Exception as e:
-            # Cloud failed, fall through to local
-            pass
-    
+    _metrics.inc("swissblaiz_requests_total", complexity=complexity)
+    if on_event:
+        on_event("classify", {"complexity": complexity, "threshold": threshold,
+                              "ms": (time.perf_counter() - start) * 1000})
+
+    # Steps 1-4 per cascade tier, cheapest first; the first confident one answers
+    min_calls = min(len(_intent_matcher.intents(user_text)), len(tools))
+    local, confidence, spent_ms, needs_cloud = None, -1.0, 0.0, True
+    for tier in CASCADE:
+        if local is not None and spent_ms > tier.get("budget_ms", float("inf")):
+            continue
+        result, tier_confidence, tier_threshold = _run_tier(
+            tier, messages, tools, complexity, min_calls, threshold, kv_key, on_event)
+        spent_ms += result["total_time_ms"]
+        if local is None or tier_confidence >= confidence:
+            local, confidence, threshold = result, tier_confidence, tier_threshold
+        if tier_confidence >= tier_threshold:
+            local, confidence, threshold, needs_cloud = result, tier_confidence, tier_threshold, False
+            break
+    local["total_time_ms"] = spent_ms
+    _metrics.observe("swissblaiz_local_confidence", confidence, complexity=complexity)
+
+    # Step 5: Decide if cloud fallback needed
+    if on_event:
+        on_event("route", {"decision": "cloud" if needs_cloud else "on-device",
+                           "confidence": confidence, "match_score": local["match_score"],
+                           "validation_score": local["validation"]["score"],
+                           "errors": local["validation"]["errors"], "threshold": threshold})
+
+    if needs_cloud:
+        if not escalate:
+            # Caller (e.g. the scheduler) runs the cloud half on its own capacity
+            local["needs_cloud"] = True
+            return local
+        return escalate_to_cloud(messages, tools, local, cloud_session=cloud_session, session=session,
+                                 on_event=on_event)
+
     # Use local result
-    local["source"] = "on-device"
-    local["function_calls"] = [postprocess_call(c, tools) for c in local["function_calls"]]
+    _record_route("on-device", local)
+    if on_event:
+        on_event("postprocess", {"calls": len(local["function_calls"]), "source": local["source"]})
     return local
 
 
+def _run_tier(tier, messages, tools, complexity, min_calls, threshold, kv_key, on_event):
+    """
+    One on-device cascade tier: generate, validate and normalize, and for
+    model tiers retry structurally invalid output. Returns (result,
+    routing confidence, this tier's threshold for `complexity`).
+    """
+    calibrator = _calibrator if tier.get("calibrated") else None
+    if calibrator is not None:
+        threshold = calibrator.thresholds.get(complexity, threshold)
+    threshold = tier.get("thresholds", {}).get(complexity, threshold)
+    path = tier.get("path")
+
+    # Step 1: Generate; ensemble tiers vote over several samples
+    if tier["backend"] == "rules":
+        local = generate_rules(messages, tools)
+    elif tier["backend"] != "cactus":
+        raise ValueError(f"unknown cascade backend {tier['backend']!r}")
+    elif complexity in ENSEMBLE_TIERS and ENSEMBLE_SAMPLES > 1:
+        local = sample_ensemble(messages, tools, kv_key=kv_key, path=path)
+    else:
+        local = generate_cactus(messages, tools, kv_key=kv_key, path=path)
+    local["tier"] = tier["name"]
+    _metrics.inc("swissblaiz_tier_runs_total", tier=tier["name"])
+    if on_event:
+        on_event("infer", {"target": "on-device", "tier": tier["name"], "confidence": local["confidence"],
+                           "calls": len(local["function_calls"]), "ms": local["total_time_ms"],
+                           "samples": local.get("samples", 1)})
+
+    # Step 2: Check the raw calls against the toolset, then normalize them
+    raw_calls = local["function_calls"]
+    confidence = _assess_local(local, tools, min_calls, complexity, calibrator)
+    local["source"] = "on-device"
+    if tier["backend"] == "rules":
+        return local, confidence, threshold
+
+    # Step 3: Structural failures get a bounded on-device retry with the errors spelled out
+    first_ms = estimate_ms = local["total_time_ms"]
+    attempts, spent_ms = 0, 0.0
+    latest, latest_calls = local, raw_calls
+    while (confidence < threshold and not latest["validation"]["valid"] and attempts < REPAIR_MAX_ATTEMPTS
+           and spent_ms + estimate_ms <= REPAIR_BUDGET_MS):
+        attempts += 1
+        # No kv_key: the session's next turn carries only the accepted calls, not these reflection
+        # turns, so they must not leave their tokens in its cache (the reset hands it back clean)
+        prompt = build_reflection_prompt(messages, latest["validation"]["errors"], latest_calls)
+        latest = generate_cactus(prompt, tools, path=path)
+        latest_calls = latest["function_calls"]
+        estimate_ms = latest["total_time_ms"]
+        spent_ms += estimate_ms
+        retry_confidence = _assess_local(latest, tools, min_calls, complexity, calibrator)
+        _metrics.inc("swissblaiz_repair_attempts_total", complexity=complexity)
+        if on_event:
+            on_event("repair", {"attempt": attempts, "tier": tier["name"], "confidence": retry_confidence,
+                                "errors": latest["validation"]["errors"], "ms": estimate_ms})
+        if retry_confidence >= confidence:
+            latest["source"], latest["tier"] = "on-device", tier["name"]
+            local, confidence = latest, retry_confidence
+    if attempts:
+        local["repair_attempts"] = attempts
+        local["total_time_ms"] = first_ms + spent_ms
+    return local, confidence, threshold
+
+
+def _assess_local(local, tools, min_calls, complexity, calibrator):
+    """
+    Validate and normalize an on-device result in place; returns its routing
+    confidence. Guessed names/keys and structural failures discount the SDK
+    confidence, then calibration turns it into expected local F1 for the tier.
+    """
+    validation = local["validation"] = validate_tool_calls(local["function_calls"], tools, min_calls)
+    local["function_calls"], local["match_score"] = postprocess_scored(local["function_calls"], tools)
+    confidence = local["confidence"] * local["match_score"] * validation["score"]
+    if calibrator is not None:
+        confidence = local["calibrated_confidence"] = calibrator(complexity, confidence)
+    return confidence
+
+
+def build_reflection_prompt(messages, errors, prev_calls):
+    """
+    `messages` plus the rejected calls as an assistant turn and a user turn
+    listing what was wrong with them — what the on-device model sees when
+    it is asked to repair its own output.
+    """
+    feedback = "\n".join(f"- {e}" for e in errors)
+    return list(messages) + [
+        {"role": "assistant", "content": "", "function_calls": prev_calls},
+        {"role": "user", "content": (
+            f"Those function calls were rejected:\n{feedback}\n"
+            "Call the tools again using only the functions provided, with every required "
+            "argument and the right types, and one call per thing I asked for."
+        )},
+    ]
+
+
+def _record_route(route, result):
+    _metrics.inc("swissblaiz_routed_total", route=route)
+    _metrics.observe("swissblaiz_request_ms", result["total_time_ms"], route=route)
+
+
+def escalate_to_cloud(messages, tools, local, cloud_session=None, session=None, on_event=None):
+    """
+    Cloud half of generate_hybrid: replace `local` with Gemini's answer, or
+    keep it if the cloud fails. A `session`'s CloudSession (and with it the
+    google.genai import) is only created here, on the first turn that escalates.
+    """
+    local.pop("needs_cloud", None)
+    try:
+        if cloud_session is None and session is not None:
+            cloud_session = session.cloud_session()
+        if cloud_session is not None:
+            cloud = cloud_session.generate(messages)
+        else:
+            cloud = generate_cloud(messages, tools)
+        if on_event:
+            on_event("infer", {"target": "cloud", "calls": len(cloud["function_calls"]),
+                               "ms": cloud["total_time_ms"]})
+        cloud["source"] = "cloud (fallback)"
+        cloud["tier"] = "cloud"
+        cloud["local_confidence"] = local["confidence"]
+        cloud["local_validation"] = local.get("validation")
+        cloud["local_calls"] = local["function_calls"]
+        cloud["local_tier"] = local.get("tier")
+        cloud["total_time_ms"] += local["total_time_ms"]
+
+        # Post-process cloud calls
+        cloud["function_calls"] = postprocess_batch(cloud["function_calls"], tools)
+        _record_route("cloud", cloud)
+        if on_event:
+            on_event("postprocess", {"calls": len(cloud["function_calls"]), "source": cloud["source"]})
+        return cloud
+    except Exception as e:
+        # Cloud failed, fall back to local
+        _metrics.inc("swissblaiz_cloud_errors_total", error=type(e).__name__)
+        _record_route("fallback", local)
+        if on_event:
+            on_event("infer", {"target": "cloud", "error": str(e)})
+            on_event("postprocess", {"calls": len(local["function_calls"]), "source": local["source"]})
+        return local
+
+
 # Wrapper functions
 def generate_local(messages, tools):
     return generate_hybrid(messages, tools, confidence_threshold=1.0)
@@ -284,11 +1817,248 @@ def generate_cloud_only(messages, tools):
     return generate_hybrid(messages, tools, confidence_threshold=0.0)
 
 
+# ═══════════════════════════════════════════════════════════════
+# 6. SESSIONS — Multi-turn state for follow-up queries
+# ═══════════════════════════════════════════════════════════════
+
+class Session:
+    """
+    One multi-turn conversation: its turns, the last resolved tool calls,
+    the on-device KV state (via the pooled model) and a cloud history.
+
+        session = Session(tools)
+        session.generate("What's the weather in London?")
+        session.generate("and in Paris too")
+    """
+
+    def __init__(self, tools, session_id=None, max_turns=SESSION_MAX_TURNS):
+        self.id = session_id or uuid.uuid4().hex
+        self.tools = tools
+        self.max_turns = max_turns
+        self.messages = []
+        self.last_calls = []
+        self.last_used = time.time()
+        self._cloud = None
+        self._lock = threading.Lock()   # one turn at a time; turns share messages and KV state
+
+    def cloud_session(self):
+        if self._cloud is None:
+            self._cloud = CloudSession(self.tools)
+        return self._cloud
+
+    def generate(self, text, on_event=None):
+        """Run one user turn through the hybrid pipeline; concurrent turns queue up."""
+        with self._lock:
+            self.last_used = time.time()
+            self.messages.append({"role": "user", "content": text})
+            result = generate_hybrid(self.messages, self.tools, session=self, on_event=on_event)
+            self.last_calls = result["function_calls"]
+            self.messages.append({"role": "assistant", "content": "", "function_calls": self.last_calls})
+            self._trim()
+            return result
+
+    def _trim(self):
+        """Drop the oldest half of the turns once over budget."""
+        user_turns = [i for i, m in enumerate(self.messages) if m["role"] == "user"]
+        if len(user_turns) <= self.max_turns:
+            return
+        keep_from = user_turns[-max(1, self.max_turns // 2)]
+        self.messages = self.messages[keep_from:]
+        # The cached prefixes no longer match — rebuild both on the next turn
+        self._reset_state()
+
+    def _reset_state(self):
+        if self._cloud is not None:
+            self._cloud.close()
+            self._cloud = None
+        # Forget ownership so the next call on that handle, stateless or not, resets it
+        for path, owner in list(_kv_owner.items()):
+            if owner == self.id:
+                _kv_owner.pop(path, None)
+
+    def close(self):
+        self._reset_state()
+
+
+class SessionStore:
+    """Bounded, LRU-ordered set of sessions with idle eviction."""
+
+    def __init__(self, max_sessions=SESSION_MAX_ACTIVE, idle_ttl_s=SESSION_IDLE_TTL_S):
+        self.max_sessions = max_sessions
+        self.idle_ttl_s = idle_ttl_s
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id, tools):
+        """Fetch a live session, or start a new one under `session_id`."""
+        with self._lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None or session.tools != tools:
+                if session is not None:
+                    session.close()
+                session = Session(tools, session_id=session_id)
+                self._sessions[session.id] = session
+            self._sessions.move_to_end(session.id)
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                evicted.close()
+            return session
+
+    def close(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+
+    def _evict_idle(self):
+        cutoff = time.time() - self.idle_ttl_s
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= cutoff:
+                break
+            self._sessions.popitem(last=False)
+            session.close()
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+# ═══════════════════════════════════════════════════════════════
+# 7. STARTUP — Deferred imports, warmup, readiness
+# ═══════════════════════════════════════════════════════════════
+
+_ready = threading.Event()
+
+
+def _synthetic_queries(tools):
+    """One request per tool, phrased from its description."""
+    return [t.get("description") or t["name"].replace("_", " ") for t in tools] or ["Hello"]
+
+
+def warmup(toolsets=None, rounds=WARMUP_ROUNDS, target_p50_ms=WARMUP_TARGET_P50_MS, cloud=True):
+    """
+    Pay the cold-start costs before the first user does:
+      1. import the SDK and load the model of every cactus tier in CASCADE,
+         so the first request that escalates a tier doesn't load it;
+      2. run synthetic queries `rounds` times for every toolset (the given
+         ones, else every toolset in the postprocessing cache) on the first
+         cactus tier, covering the first-token compile and building each
+         toolset's index. These calls are stateless, so the SDK resets its
+         KV state after each: no prompt prefix carries into real requests;
+      3. pre-connect the Gemini client (DNS + TLS) with a metadata call.
+
+    is_ready() flips only once the p50 of the warm rounds (all but the
+    first) is within target_p50_ms; with nothing measured (rounds=0 or no
+    toolsets) p50_ms is None and it stays unset. Cloud errors are reported
+    but don't block readiness — on-device traffic can still be served.
+    """
+    start = time.perf_counter()
+    paths = list(dict.fromkeys(tier.get("path") for tier in CASCADE if tier["backend"] == "cactus")) or [None]
+    for path in paths:
+        _get_model(path)
+    if toolsets is None:
+        with _tool_index_lock:
+            toolsets = [index.tools for index in _tool_indexes.values()] or [[]]
+
+    cold, warm = [], []
+    for tools in toolsets:
+        _tool_index(tools)
+        queries = _synthetic_queries(tools)
+        for round_ in range(rounds):
+            for text in queries:
+                t0 = time.perf_counter()
+                generate_cactus([{"role": "user", "content": text}], tools, path=paths[0])
+                (warm if round_ or rounds == 1 else cold).append((time.perf_counter() - t0) * 1000)
+
+    cloud_status = "skipped"
+    if cloud and os.environ.get("GEMINI_API_KEY"):
+        try:
+            _get_cloud_client().models.get(model=GEMINI_MODEL)
+            cloud_status = "connected"
+        except Exception as e:
+            cloud_status = f"error: {e}"
+
+    p50 = statistics.median(warm) if warm else None
+    if p50 is not None and p50 <= target_p50_ms:
+        _ready.set()
+    else:
+        _ready.clear()
+    elapsed = (time.perf_counter() - start) * 1000
+    _startup["warmup"] = elapsed
+    return {
+        "ready": _ready.is_set(),
+        "p50_ms": p50,
+        "target_p50_ms": target_p50_ms,
+        "cold_p50_ms": statistics.median(cold) if cold else None,
+        "queries": len(cold) + len(warm),
+        "toolsets": len(toolsets),
+        "models": len(paths),
+        "cloud": cloud_status,
+        "total_ms": elapsed,
+    }
+
+
+def is_ready():
+    """True once warmup() has met its latency target."""
+    return _ready.is_set()
+
+
+def start_warmup(**kwargs):
+    """Run warmup(**kwargs) on a background daemon thread; returns the thread."""
+    def run():
+        try:
+            warmup(**kwargs)
+        except Exception:
+            pass        # stays not-ready; the first real request surfaces the error
+
+    thread = threading.Thread(target=run, name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def startup_report():
+    """Startup steps and their wall time in ms, in the order they happened."""
+    return dict(_startup)
+
+
+_startup["import main"] = (time.perf_counter() - _IMPORT_START) * 1000
+
+if os.environ.get("SWISSBLAIZ_WARMUP") == "1":
+    start_warmup()
+
+if os.environ.get("SWISSBLAIZ_PROFILE"):
+    from profiler import SamplingProfiler
+    _profiler = SamplingProfiler.from_env().start()
+    atexit.register(disable_profiling)
+
+if os.environ.get("SWISSBLAIZ_INFERENCE_LOG"):
+    from inference_log import InferenceLog
+    _inference_log = InferenceLog.from_env().start()
+    atexit.register(disable_inference_log)
+
+
 # ═══════════════════════════════════════════════════════════════
 # EXAMPLE USAGE
 # ═══════════════════════════════════════════════════════════════
 
 if __name__ == "__main__":
+    if "--startup" in sys.argv[1:]:
+        # -X importtime, but for what a request actually waits on
+        start_warmup().join()
+        print(f"  {'ms':>9}  step")
+        for step, ms in startup_report().items():
+            print(f"  {ms:>9.1f}  {step}")
+        sys.exit(0)
+
+    if "--warmup" in sys.argv[1:]:
+        from benchmark import BENCHMARKS
+        toolsets = list({tuple(map(id, c["tools"])): c["tools"] for c in BENCHMARKS}.values())
+        report = warmup(toolsets)
+        for k, v in report.items():
+            print(f"  {k:<14} {v}")
+        sys.exit(0 if report["ready"] else 1)
+
     tools = [{
         "name": "get_weather",
         "description": "Get current weather for a location",
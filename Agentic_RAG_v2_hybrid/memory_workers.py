@@ -0,0 +1,59 @@
+"""
+Per-worker memory with N processes each holding the on-device model.
+
+Starts N independent (spawned) worker processes that load FunctionGemma
+through main._get_model, waits until all of them are resident, and
+prints each one's RSS / PSS / shared / private memory, the pages mapped
+from the weight files, and the model's load footprint (RSS growth across
+cactus_init). Summed RSS counts shared pages once per worker; summed PSS
+is what the host really pays.
+
+Whether workers share the model is up to the SDK: weights it mmaps show
+up under weights_*_mb and are shared through the page cache, weights it
+copies into its own buffers show up in model_load_mb and private_mb, and
+cost one copy per worker.
+
+Usage:
+  python memory_workers.py --workers 4
+"""
+
+import argparse
+import multiprocessing as mp
+
+
+def _worker(index, ready, done, reports):
+    import main
+    main._get_model()
+    ready.wait()            # everyone loaded, so shared pages are counted as shared
+    reports.put((index, main.memory_report()))
+    done.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure per-worker model memory")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    ready = ctx.Barrier(args.workers + 1)
+    done = ctx.Event()
+    reports = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(i, ready, done, reports)) for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    ready.wait()
+    rows = sorted(reports.get() for _ in procs)
+    done.set()
+    for p in procs:
+        p.join()
+
+    cols = ["rss_mb", "pss_mb", "shared_mb", "private_mb", "weights_rss_mb", "weights_pss_mb", "model_load_mb"]
+    print(f"  {'worker':<8}" + "".join(f"{c:>16}" for c in cols))
+    for index, report in rows:
+        print(f"  {index:<8}" + "".join(f"{report.get(c, 0):>16.1f}" for c in cols))
+    total = {c: sum(r.get(c, 0) for _, r in rows) for c in cols}
+    print(f"  {'total':<8}" + "".join(f"{total[c]:>16.1f}" for c in cols))
+    if total["rss_mb"]:
+        print(f"\n  Host cost (sum PSS) {total['pss_mb']:.0f} MB vs naive sum RSS {total['rss_mb']:.0f} MB")
+        print(f"  Model load footprint {total['model_load_mb']:.0f} MB summed, "
+              f"weight-file pages {total['weights_pss_mb']:.0f} MB PSS")
@@ -0,0 +1,201 @@
+"""
+Metrics export — Prometheus text exposition and StatsD for the hybrid router.
+
+main.py records into an in-process sink (main.Metrics) by default:
+
+  swissblaiz_requests_total{complexity}            requests routed per tier
+  swissblaiz_routed_total{route}                   on-device | cloud | fallback | shed
+                                                   (fallback = cloud failed or had no
+                                                   capacity, local kept; shed = the
+                                                   scheduler's edge queue was full,
+                                                   the cloud answered)
+  swissblaiz_request_ms{route}                     histogram of total_time_ms
+  swissblaiz_local_confidence{complexity}          histogram of routing confidence
+  swissblaiz_cloud_errors_total{error}             by exception type
+  swissblaiz_json_parse_failures_total{stage}      completion | arguments
+  swissblaiz_postprocess_repairs_total{kind}       tool_name | argument_key |
+                                                   dropped_key | unknown_tool
+  swissblaiz_inference_log_dropped_total           requests the inference log had
+                                                   no queue room for
+
+This module turns a snapshot of it into the Prometheus text format
+(server.py serves it at GET /metrics) and offers sinks that plug in with
+main.set_metrics_sink: StatsdSink pushes every update over UDP, Fanout
+sends to several sinks so /metrics keeps working alongside StatsD.
+
+Usage:
+  python metrics.py --port 9464                      # run BENCHMARKS, then serve /metrics
+  python metrics.py --statsd 127.0.0.1:8125          # run BENCHMARKS, push to StatsD
+"""
+
+import argparse, socket, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import main
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ── Prometheus text format ──
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+def render_prometheus(snapshot=None, gauges=None):
+    """
+    Text exposition of a Metrics.snapshot() (the active sink's by default),
+    plus optional `gauges` {name: value} for point-in-time values such as
+    queue depths.
+    """
+    if snapshot is None:
+        snapshot = main.get_metrics().snapshot()
+    lines = []
+
+    def grouped(series):
+        by_name = {}
+        for (name, labels), value in sorted(series.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        return by_name.items()
+
+    for name, rows in grouped(snapshot["counters"]):
+        lines.append(f"# TYPE {name} counter")
+        lines += [f"{name}{_labels(labels)} {_number(v)}" for labels, v in rows]
+
+    for name, rows in grouped(snapshot["histograms"]):
+        lines.append(f"# TYPE {name} histogram")
+        for labels, (bounds, counts, total) in rows:
+            cumulative = 0
+            for bound, n in zip(list(bounds) + [float("inf")], counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(float(total))}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ── Sinks ──
+
+class StatsdSink:
+    """
+    Fire-and-forget UDP: one datagram per update, send errors ignored.
+    With `tags` labels go out DogStatsD-style (`|#k:v`), otherwise they
+    are folded into the metric name (`name.k.v`) for plain StatsD.
+    """
+
+    def __init__(self, host="127.0.0.1", port=8125, tags=True):
+        self.address = (host, port)
+        self.tags = tags
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def _send(self, name, value, kind, labels):
+        if self.tags:
+            line = f"{name}:{value}|{kind}"
+            if labels:
+                line += "|#" + ",".join(f"{k}:{v}" for k, v in sorted(labels.items()))
+        else:
+            suffix = "".join(f".{k}.{v}" for k, v in sorted(labels.items()))
+            line = f"{name}{suffix}:{value}|{kind}"
+        try:
+            self._sock.sendto(line.encode(), self.address)
+        except OSError:
+            pass
+
+    def inc(self, name, value=1, **labels):
+        self._send(name, value, "c", labels)
+
+    def observe(self, name, value, **labels):
+        self._send(name, value, "h" if self.tags else "ms", labels)
+
+
+class Fanout:
+    """Sends every update to each of `sinks`."""
+
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def inc(self, name, value=1, **labels):
+        for sink in self.sinks:
+            sink.inc(name, value, **labels)
+
+    def observe(self, name, value, **labels):
+        for sink in self.sinks:
+            sink.observe(name, value, **labels)
+
+    def snapshot(self):
+        """The first sink that keeps state, so /metrics still renders."""
+        for sink in self.sinks:
+            if hasattr(sink, "snapshot"):
+                return sink.snapshot()
+        return {"counters": {}, "histograms": {}}
+
+
+def add_statsd(address, tags=True):
+    """Keep the active sink and also push to StatsD at "host:port"; returns the StatsdSink."""
+    host, _, port = address.rpartition(":")
+    statsd = StatsdSink(host or "127.0.0.1", int(port), tags=tags)
+    main.set_metrics_sink(Fanout(main.get_metrics(), statsd))
+    return statsd
+
+
+# ── Standalone endpoint ──
+
+def start_http_server(port, host="127.0.0.1"):
+    """Serve GET /metrics from a daemon thread, for processes without server.py."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=httpd.serve_forever, name="metrics", daemon=True).start()
+    return httpd
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark and export router metrics")
+    parser.add_argument("--port", type=int, help="Serve /metrics on this port after the run")
+    parser.add_argument("--statsd", help="host:port to push updates to while running")
+    parser.add_argument("--plain", action="store_true", help="StatsD without DogStatsD tags")
+    args = parser.parse_args()
+
+    from benchmark import run_benchmark
+    if args.statsd:
+        add_statsd(args.statsd, tags=not args.plain)
+    run_benchmark()
+    print(render_prometheus())
+    if args.port:
+        httpd = start_http_server(args.port)
+        print(f"  Serving http://127.0.0.1:{args.port}/metrics (Ctrl-C to stop)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            httpd.shutdown()
@@ -0,0 +1,180 @@
+"""
+Pareto frontier explorer — F1 vs p95 latency vs on-device ratio.
+
+compute_total_score folds three objectives into one fixed weighting. This
+sweeps per-complexity routing thresholds over a run recorded with
+`simulate.py record`, measures (avg F1, p95 latency, on-device ratio) for
+every configuration per difficulty and overall, and keeps the
+non-dominated ones: higher F1, lower p95, more on-device. Pick operating
+points per device class from the frontier instead of from the weights.
+
+Usage:
+  python pareto.py run.jsonl.gz --steps 11 --out pareto
+  # -> pareto.json + pareto.html (static, inline SVG)
+"""
+
+import argparse, html, json
+import numpy as np
+
+from simulate import COMPLEXITIES, DIFFICULTIES, Replay, load_records
+
+GROUPS = DIFFICULTIES + ["overall"]
+
+
+def configurations(steps):
+    """Every (EASY, MEDIUM, HARD) threshold triple on an even grid over [0, 1]."""
+    # Plus one just past 1.0, which escalates everything
+    grid = np.append(np.linspace(0, 1, steps), np.nextafter(1.0, 2.0))
+    e, m, h = np.meshgrid(grid, grid, grid, indexing="ij")
+    return np.stack([e.ravel(), m.ravel(), h.ravel()], axis=1)
+
+
+def measure(replay, configs, chunk=64):
+    """
+    Objectives per configuration and group.
+    Returns {group: (K, 3) array of [avg_f1, p95_ms, on_device_ratio]}.
+    """
+    # Escalate where confidence < threshold of the case's complexity
+    case_thresholds = configs[:, replay.complexity]               # (K, N)
+    out = {}
+    for g, group in enumerate(GROUPS):
+        idx = np.flatnonzero(replay.difficulty >= 0) if group == "overall" else np.flatnonzero(replay.difficulty == g)
+        if not len(idx):
+            continue
+        local, escalated = replay.local[idx], replay.escalated[idx]
+        rows = []
+        for start in range(0, len(configs), chunk):
+            esc = replay.confidence[idx] < case_thresholds[start:start + chunk, idx]    # (k, n)
+            f1 = np.where(esc, escalated[:, 0], local[:, 0]).mean(axis=1)
+            p95 = np.percentile(np.where(esc, escalated[:, 1], local[:, 1]), 95, axis=1)
+            on_device = np.where(esc, escalated[:, 2], local[:, 2]).mean(axis=1)
+            rows.append(np.stack([f1, p95, on_device], axis=1))
+        out[group] = np.concatenate(rows)
+    return out
+
+
+def frontier(points):
+    """Indices of non-dominated rows of (avg_f1, p95_ms, on_device_ratio)."""
+    # Flip latency so every objective is maximized
+    objectives = points * np.array([1.0, -1.0, 1.0])
+    keep = []
+    for i, p in enumerate(objectives):
+        dominated = np.all(objectives >= p, axis=1) & np.any(objectives > p, axis=1)
+        if not dominated.any():
+            keep.append(i)
+    # Collapse configurations with identical outcomes to the first one
+    _, first = np.unique(points[keep], axis=0, return_index=True)
+    keep = [keep[i] for i in sorted(first)]
+    return sorted(keep, key=lambda i: points[i, 1])
+
+
+def explore(records, steps=11):
+    replay = Replay(records)
+    configs = configurations(steps)
+    measured = measure(replay, configs)
+    report = {"cases": len(records), "configurations": len(configs), "groups": {}}
+    for group, points in measured.items():
+        front = frontier(points)
+        report["groups"][group] = {
+            "cases": int((replay.difficulty >= 0).sum() if group == "overall"
+                         else (replay.difficulty == GROUPS.index(group)).sum()),
+            "frontier": [_point(configs[i], points[i]) for i in front],
+            "all": [_point(c, p) for c, p in zip(configs, points)],
+        }
+    return report
+
+
+def _point(config, objectives):
+    return {
+        "thresholds": {c: round(float(t), 4) for c, t in zip(COMPLEXITIES, config)},
+        "f1": float(objectives[0]),
+        "p95_ms": float(objectives[1]),
+        "on_device": float(objectives[2]),
+    }
+
+
+# ── HTML ──
+
+W, H, PAD = 420, 300, 44
+
+
+def _chart(group, data):
+    points, front = data["all"], data["frontier"]
+    max_ms = max(p["p95_ms"] for p in points) or 1.0
+
+    def xy(p):
+        return PAD + p["p95_ms"] / max_ms * (W - 2 * PAD), H - PAD - p["f1"] * (H - 2 * PAD)
+
+    parts = [f'<svg width="{W}" height="{H}" viewBox="0 0 {W} {H}">',
+             f'<line x1="{PAD}" y1="{H - PAD}" x2="{W - PAD}" y2="{H - PAD}" class="axis"/>',
+             f'<line x1="{PAD}" y1="{PAD}" x2="{PAD}" y2="{H - PAD}" class="axis"/>',
+             f'<text x="{W / 2}" y="{H - 8}" class="label">p95 latency (ms, max {max_ms:.0f})</text>',
+             f'<text x="12" y="{H / 2}" class="label" transform="rotate(-90 12 {H / 2})">avg F1</text>']
+    for p in points:
+        x, y = xy(p)
+        parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="2" class="config" '
+                     f'style="opacity:{0.15 + 0.6 * p["on_device"]:.2f}"/>')
+    path = " ".join(f"{x:.1f},{y:.1f}" for x, y in map(xy, front))
+    parts.append(f'<polyline points="{path}" class="frontier"/>')
+    for p in front:
+        x, y = xy(p)
+        t = p["thresholds"]
+        tip = (f"F1 {p['f1']:.3f} | p95 {p['p95_ms']:.0f}ms | on-device {p['on_device']:.0%}\n"
+               f"EASY<{t['EASY']} MEDIUM<{t['MEDIUM']} HARD<{t['HARD']}")
+        parts.append(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="4" class="optimal">'
+                     f'<title>{html.escape(tip)}</title></circle>')
+    parts.append("</svg>")
+
+    rows = "".join(
+        f"<tr><td>{p['f1']:.3f}</td><td>{p['p95_ms']:.0f}</td><td>{p['on_device']:.0%}</td>"
+        f"<td>{p['thresholds']['EASY']}</td><td>{p['thresholds']['MEDIUM']}</td><td>{p['thresholds']['HARD']}</td></tr>"
+        for p in front
+    )
+    return (f'<section><h2>{group} <small>({data["cases"]} cases, {len(front)} optimal)</small></h2>'
+            + "".join(parts)
+            + "<table><tr><th>F1</th><th>p95 ms</th><th>on-device</th><th>EASY</th><th>MEDIUM</th><th>HARD</th></tr>"
+            + rows + "</table></section>")
+
+
+def render_html(report):
+    charts = "".join(_chart(g, report["groups"][g]) for g in GROUPS if g in report["groups"])
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>SwissblAIz routing frontier</title>
+<style>
+  body {{ font: 13px system-ui, sans-serif; background: #0b0f14; color: #d8dee9; margin: 24px; }}
+  section {{ display: inline-block; vertical-align: top; margin: 0 24px 24px 0; }}
+  h2 small {{ color: #7b8794; font-weight: normal; }}
+  .axis {{ stroke: #4c566a; }}
+  .label {{ fill: #7b8794; font-size: 11px; text-anchor: middle; }}
+  .config {{ fill: #5e81ac; }}
+  .frontier {{ fill: none; stroke: #ebcb8b; stroke-width: 1.5; }}
+  .optimal {{ fill: #ebcb8b; }}
+  table {{ border-collapse: collapse; margin-top: 8px; }}
+  td, th {{ padding: 2px 8px; text-align: right; border-bottom: 1px solid #2e3440; }}
+</style></head><body>
+<h1>Routing frontier</h1>
+<p>{report["cases"]} recorded cases, {report["configurations"]} threshold configurations.
+Dots are configurations (opacity = on-device ratio); the line joins the Pareto-optimal ones.</p>
+{charts}
+</body></html>
+"""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pareto frontier of routing configurations")
+    parser.add_argument("log", help="Run recorded with simulate.py record")
+    parser.add_argument("--steps", type=int, default=11, help="Thresholds per complexity")
+    parser.add_argument("--out", default="pareto", help="Output prefix for .json and .html")
+    args = parser.parse_args()
+
+    report = explore(load_records(args.log), args.steps)
+    with open(args.out + ".json", "w") as f:
+        json.dump({"cases": report["cases"], "configurations": report["configurations"],
+                   "groups": {g: {k: v for k, v in d.items() if k != "all"} for g, d in report["groups"].items()}},
+                  f, indent=2)
+    with open(args.out + ".html", "w") as f:
+        f.write(render_html(report))
+    for group in GROUPS:
+        if group in report["groups"]:
+            print(f"  {group:<8} {len(report['groups'][group]['frontier'])} optimal of {report['configurations']}")
+    print(f"  Wrote {args.out}.json and {args.out}.html")
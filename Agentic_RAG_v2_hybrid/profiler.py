@@ -0,0 +1,195 @@
+"""
+Sampling profiler for the request path — flamegraphs for any run.
+
+A daemon thread wakes `rate_hz` times a second and records the Python
+stack of every thread currently inside generate_hybrid (via
+sys._current_frames, so requests are never interrupted or traced).
+Threads outside a request are not walked at all, and while nothing is in
+flight the sampler only wakes up and goes back to sleep.
+
+Time inside the SDK or the Gemini client shows up on the Python frame
+that called it (generate_cactus, CloudSession.generate, ...), which is
+exactly the attribution wanted: classify_complexity vs postprocessing vs
+JSON parsing vs the model.
+
+Every `every` requests the samples so far are written to out_dir as
+  profile-<first>-<last>.collapsed         flamegraph.pl / speedscope / inferno
+  profile-<first>-<last>.speedscope.json   https://www.speedscope.app
+
+Enable with main.enable_profiling(...), `SWISSBLAIZ_PROFILE=<dir>` (plus
+optional SWISSBLAIZ_PROFILE_HZ / _EVERY / _FORMAT), or
+`python benchmark.py --profile <dir>`.
+"""
+
+import json, os, sys, threading
+from collections import Counter
+from contextlib import contextmanager
+
+PROFILE_RATE_HZ = 200
+PROFILE_EVERY = 100         # requests per output file
+FORMATS = {"collapsed": ".collapsed", "speedscope": ".speedscope.json"}
+
+
+class SamplingProfiler:
+    def __init__(self, out_dir="profiles", rate_hz=PROFILE_RATE_HZ, every=PROFILE_EVERY, fmt="collapsed"):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown profile format {fmt!r}, expected one of {sorted(FORMATS)}")
+        self.out_dir = out_dir
+        self.interval = 1.0 / rate_hz
+        self.every = every
+        self.fmt = fmt
+        self.requests = 0
+        self.samples = 0
+        self.files = []
+        self._active = {}           # thread id -> nesting depth of tracked calls
+        self._lock = threading.Lock()
+        self._batch = Counter()     # stack (frame ids, root first) -> samples since the last file
+        self._total = Counter()     # same, for the whole run
+        self._frame_ids = {}        # code object -> index into _frames
+        self._frames = []           # (function, file, first line)
+        self._batch_start = 0
+        self._flush_due = False
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        return cls(
+            environ.get("SWISSBLAIZ_PROFILE") or "profiles",
+            rate_hz=float(environ.get("SWISSBLAIZ_PROFILE_HZ", PROFILE_RATE_HZ)),
+            every=int(environ.get("SWISSBLAIZ_PROFILE_EVERY", PROFILE_EVERY)),
+            fmt=environ.get("SWISSBLAIZ_PROFILE_FORMAT", "collapsed"),
+        )
+
+    # ── Request tracking (called on the request threads) ──
+
+    @contextmanager
+    def track(self):
+        """Sample the calling thread for the duration of the block."""
+        tid = threading.get_ident()
+        with self._lock:
+            self._active[tid] = self._active.get(tid, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                depth = self._active.pop(tid) - 1
+                if depth:
+                    self._active[tid] = depth
+                else:
+                    self.requests += 1
+                    # Written by the sampler thread, never on the request path
+                    self._flush_due = self.requests - self._batch_start >= self.every
+
+    # ── Sampler thread ──
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and write whatever is left; returns every file written."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        return self.files
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self._active:
+                self._sample()
+            if self._flush_due:
+                self.flush()
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for tid in list(self._active):
+            frame = frames.get(tid)
+            if frame is not None:
+                stack = self._stack(frame)
+                self._batch[stack] += 1
+                self._total[stack] += 1
+                self.samples += 1
+
+    def _stack(self, frame):
+        ids = []
+        while frame is not None:
+            code = frame.f_code
+            i = self._frame_ids.get(code)
+            if i is None:
+                i = self._frame_ids[code] = len(self._frames)
+                self._frames.append((code.co_name, code.co_filename, code.co_firstlineno))
+            ids.append(i)
+            frame = frame.f_back
+        ids.reverse()
+        return tuple(ids)
+
+    # ── Output ──
+
+    def flush(self):
+        """Write samples gathered since the last file; returns its path, or None if there were none."""
+        with self._lock:
+            first, last = self._batch_start + 1, self.requests
+            self._batch_start = self.requests
+            self._flush_due = False
+        batch, self._batch = self._batch, Counter()
+        if not batch:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, f"profile-{first:06d}-{last:06d}{FORMATS[self.fmt]}")
+        with open(path, "w") as f:
+            if self.fmt == "collapsed":
+                f.write(render_collapsed(batch, self._frames))
+            else:
+                json.dump(render_speedscope(batch, self._frames, self.interval * 1000,
+                                            name=f"requests {first}-{last}"), f)
+        self.files.append(path)
+        return path
+
+    def top(self, n=10):
+        """[(function label, share of samples it was on the stack)] over the whole run."""
+        inclusive = Counter()
+        for stack, count in self._total.items():
+            for i in set(stack):
+                inclusive[i] += count
+        total = sum(self._total.values()) or 1
+        return [(_label(self._frames[i]), c / total) for i, c in inclusive.most_common(n)]
+
+
+def _label(frame):
+    name, filename, line = frame
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+def render_collapsed(counts, frames):
+    """Brendan Gregg's folded format: `root;caller;leaf count` per line."""
+    return "".join(
+        ";".join(_label(frames[i]) for i in stack) + f" {n}\n"
+        for stack, n in sorted(counts.items())
+    )
+
+
+def render_speedscope(counts, frames, interval_ms, name="swissblaiz"):
+    """A speedscope "sampled" profile; each distinct stack weighted by its sample time."""
+    stacks = sorted(counts)
+    weights = [counts[s] * interval_ms for s in stacks]
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": n, "file": f, "line": line} for n, f, line in frames]},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": [list(s) for s in stacks],
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "swissblaiz profiler",
+    }
@@ -0,0 +1,286 @@
+"""
+Admission control and priority queuing for edge vs cloud capacity.
+
+Two bounded pools, each with its own workers and priority queue:
+  - edge:  generate_cactus + routing (one worker per loaded model)
+  - cloud: Gemini escalations (bounded by the API rate limit)
+
+Jobs are ordered by deadline, bucketed to DEADLINE_BUCKET_MS, then by
+difficulty: deadlines that close together tie, and the pool's preferred
+difficulty goes first. A job whose deadline has passed by the time a
+worker picks it up is not run: an expired edge or cloud-only job fails
+with `DeadlineExceeded`, an expired escalation keeps the local answer.
+
+A saturated pool sheds to the other path: a full edge queue sends new
+requests straight to the cloud, a full cloud queue keeps the local
+answer. When both are full the request is rejected with `Overloaded`.
+
+server.py runs stateless requests through a Scheduler with --scheduler and
+exports gauges() on /metrics. With the inference log on, each request is
+logged once its final answer exists: escalated, kept-local and shed ones
+by the scheduler, on-device ones by generate_hybrid.
+
+Usage:
+  scheduler = Scheduler(edge_workers=1, cloud_workers=4)
+  result = scheduler.submit(messages, tools, deadline_ms=800).result()
+  print(scheduler.stats())
+"""
+
+import heapq, itertools, threading, time
+from concurrent.futures import Future
+
+from main import (
+    classify_complexity, generate_hybrid, escalate_to_cloud,
+    generate_cloud, postprocess_batch, get_metrics, log_request, _record_route,
+)
+
+DEFAULT_DEADLINE_MS = 1000
+DEADLINE_BUCKET_MS = 100
+
+# Lower rank runs first. The edge favours short EASY jobs, the cloud the
+# HARD ones it is most likely to be answering.
+EDGE_RANK = {"EASY": 0, "MEDIUM": 1, "HARD": 2}
+CLOUD_RANK = {"HARD": 0, "MEDIUM": 1, "EASY": 2}
+
+
+class Overloaded(Exception):
+    """Both the edge and the cloud queue are full."""
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed while it was still queued."""
+
+
+def priority(deadline, rank):
+    """Heap key: deadline (monotonic seconds) in DEADLINE_BUCKET_MS buckets, then rank."""
+    return int(deadline * 1000 // DEADLINE_BUCKET_MS), rank
+
+
+class Trace:
+    """A request's on_event: forwards to the caller's and keeps the events for log_request."""
+
+    def __init__(self, on_event=None):
+        self.on_event = on_event
+        self.events = []
+        self.start = time.perf_counter()
+
+    def __call__(self, stage, payload):
+        self.events.append((stage, payload))
+        if self.on_event is not None:
+            self.on_event(stage, payload)
+
+    def log(self, messages, tools, result):
+        log_request(messages, tools, result, self.events, (time.perf_counter() - self.start) * 1000)
+
+
+class Pool:
+    """Fixed worker threads draining a bounded priority queue."""
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.completed = 0
+        self.expired = 0
+        self.refused = 0
+        self.peak_depth = 0
+        self.wait_ms_total = 0.0
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    @property
+    def depth(self):
+        return len(self._heap)
+
+    def try_submit(self, priority, fn, *args, deadline=None, on_expire=None):
+        """
+        Queue `fn(*args)`; False if the queue is full. If a worker only
+        gets to it after `deadline` (time.monotonic()), `on_expire(*args)`
+        runs instead.
+        """
+        with self._cond:
+            if self._closed or len(self._heap) >= self.max_queue:
+                self.refused += 1
+                return False
+            heapq.heappush(self._heap, (priority, next(self._seq), time.perf_counter(),
+                                        deadline, fn, on_expire, args))
+            self.peak_depth = max(self.peak_depth, len(self._heap))
+            self._cond.notify()
+            return True
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                _, _, enqueued, deadline, fn, on_expire, args = heapq.heappop(self._heap)
+                self.running += 1
+                self.wait_ms_total += (time.perf_counter() - enqueued) * 1000
+                expired = deadline is not None and time.monotonic() > deadline
+                if expired:
+                    self.expired += 1
+            try:
+                if not expired:
+                    fn(*args)
+                elif on_expire is not None:
+                    on_expire(*args)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    if not expired:
+                        self.completed += 1
+
+    def stats(self):
+        with self._cond:
+            started = self.completed + self.expired
+            return {
+                "depth": len(self._heap),
+                "peak_depth": self.peak_depth,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "workers": self.workers,
+                "completed": self.completed,
+                "expired": self.expired,
+                "refused": self.refused,
+                "avg_wait_ms": self.wait_ms_total / started if started else 0.0,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join()
+
+
+class Scheduler:
+    def __init__(self, edge_workers=1, cloud_workers=4, edge_queue=16, cloud_queue=32):
+        self.edge = Pool("edge", edge_workers, edge_queue)
+        self.cloud = Pool("cloud", cloud_workers, cloud_queue)
+        self.shed_to_cloud = 0
+        self.shed_to_edge = 0
+        self.rejected = 0
+        self._lock = threading.Lock()   # the counters above; jobs finish on many threads
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def submit(self, messages, tools, deadline_ms=None, on_event=None):
+        """Schedule one request; returns a Future resolving to the hybrid result."""
+        user_text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        complexity = classify_complexity(user_text, tools)
+        deadline = time.monotonic() + (deadline_ms or DEFAULT_DEADLINE_MS) / 1000
+        result = Future()
+        result.set_running_or_notify_cancel()
+        trace = Trace(on_event)
+
+        if self.edge.try_submit(priority(deadline, EDGE_RANK[complexity]), self._edge_job,
+                                messages, tools, deadline, complexity, trace, result,
+                                deadline=deadline, on_expire=self._expired_job):
+            return result
+
+        # Edge saturated — answer from the cloud rather than queue behind it
+        if self.cloud.try_submit(priority(deadline, CLOUD_RANK[complexity]), self._cloud_only_job,
+                                 messages, tools, deadline, complexity, trace, result,
+                                 deadline=deadline, on_expire=self._expired_job):
+            self._count("shed_to_cloud")
+            return result
+
+        self._count("rejected")
+        result.set_exception(Overloaded("edge and cloud queues are full"))
+        return result
+
+    def _edge_job(self, messages, tools, deadline, complexity, trace, result):
+        try:
+            local = generate_hybrid(messages, tools, on_event=trace, escalate=False)
+        except Exception as e:
+            result.set_exception(e)
+            return
+        if not local.get("needs_cloud"):
+            result.set_result(local)
+            return
+        if self.cloud.try_submit(priority(deadline, CLOUD_RANK[complexity]), self._escalate_job,
+                                 messages, tools, local, trace, result,
+                                 deadline=deadline, on_expire=self._keep_local):
+            return
+        # Cloud saturated — the local answer is better than waiting
+        self._count("shed_to_edge")
+        self._keep_local(messages, tools, local, trace, result)
+
+    def _escalate_job(self, messages, tools, local, trace, result):
+        try:
+            cloud = escalate_to_cloud(messages, tools, local, on_event=trace)
+        except Exception as e:
+            result.set_exception(e)
+            return
+        trace.log(messages, tools, cloud)
+        result.set_result(cloud)
+
+    def _keep_local(self, messages, tools, local, trace, result):
+        """No cloud capacity or time left: answer with the local result, routed as a fallback."""
+        local.pop("needs_cloud", None)
+        _record_route("fallback", local)
+        trace("postprocess", {"calls": len(local["function_calls"]), "source": local["source"]})
+        trace.log(messages, tools, local)
+        result.set_result(local)
+
+    def _cloud_only_job(self, messages, tools, deadline, complexity, trace, result):
+        metrics = get_metrics()
+        metrics.inc("swissblaiz_requests_total", complexity=complexity)
+        trace("classify", {"complexity": complexity, "threshold": None})
+        try:
+            cloud = generate_cloud(messages, tools)
+            trace("infer", {"target": "cloud", "calls": len(cloud["function_calls"]),
+                            "ms": cloud["total_time_ms"]})
+            cloud["function_calls"] = postprocess_batch(cloud["function_calls"], tools)
+            cloud["source"] = "cloud (shed)"
+            cloud["tier"] = "cloud"
+        except Exception as e:
+            metrics.inc("swissblaiz_cloud_errors_total", error=type(e).__name__)
+            result.set_exception(e)
+            return
+        _record_route("shed", cloud)
+        trace("postprocess", {"calls": len(cloud["function_calls"]), "source": cloud["source"]})
+        trace.log(messages, tools, cloud)
+        result.set_result(cloud)
+
+    def _expired_job(self, messages, tools, deadline, complexity, trace, result):
+        late_ms = (time.monotonic() - deadline) * 1000
+        result.set_exception(DeadlineExceeded(f"{complexity} request queued {late_ms:.0f}ms past its deadline"))
+
+    def stats(self):
+        """Queue depths and shedding counters, for metrics export."""
+        with self._lock:
+            counters = {
+                "shed_to_cloud": self.shed_to_cloud,
+                "shed_to_edge": self.shed_to_edge,
+                "rejected": self.rejected,
+            }
+        return {"edge": self.edge.stats(), "cloud": self.cloud.stats(), **counters}
+
+    def gauges(self):
+        """stats() as flat Prometheus gauges, for metrics.render_prometheus(gauges=...)."""
+        stats = self.stats()
+        gauges = {}
+        for pool in ("edge", "cloud"):
+            for key in ("depth", "running", "expired", "refused"):
+                gauges[f"swissblaiz_scheduler_{pool}_{key}"] = stats[pool][key]
+        for key in ("shed_to_cloud", "shed_to_edge", "rejected"):
+            gauges[f"swissblaiz_scheduler_{key}"] = stats[key]
+        return gauges
+
+    def close(self):
+        self.edge.close()
+        self.cloud.close()
@@ -0,0 +1,357 @@
+"""
+Corpus-scale F1 scoring — bit-identical to benchmark.compute_f1, and fast
+at re-scoring runs that are already encoded.
+
+Every call is canonicalized once into a hashable (name, frozenset(args))
+tuple, with values normalized exactly like benchmark._normalize, and
+interned to a small int by a CallVocab. Cases then compare as int tuples.
+
+A predicted call matches an expected one when the names agree and the
+expected items are a subset of the predicted items (_call_matches). Unless
+a tool shows up with nested key sets (one call's keys a strict subset of
+another's), that relation is plain id equality and compute_f1's greedy
+matching is a multiset intersection. For the nested tools the greedy loop
+is replayed on ids with a memoized pair relation.
+
+Per-case F1 and per-difficulty means are computed with NumPy when it is
+installed, in pure Python otherwise.
+
+Encoding is the bottleneck, and it is Python-bound: a call already seen
+in the same raw form is a single dict lookup, but every call of a fresh
+prediction run is still visited once. So scoring a fresh run end to end
+(encode + score) is only ~1.1-1.5x faster than a compute_f1 loop, well
+short of 10x. The ~7x is for runs that are already encoded (policy
+sweeps, repeated reports). Encode the expectations once per corpus and
+reuse them (`python microbench.py scoring`).
+
+Usage:
+  from scoring import CallVocab, encode, score_encoded, score_corpus
+  report = score_corpus(predicted_lists, expected_lists, difficulties)
+  report["by_difficulty"]["hard"]["avg_f1"]
+
+  # Re-scoring many prediction runs against one corpus: encode it once
+  vocab = CallVocab()
+  expected = encode(expected_lists, vocab)
+  report = score_encoded(encode(run_a, vocab), expected, vocab, difficulties)
+"""
+
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _freeze(v):
+    """Hashable stand-in for v that compares equal exactly when v does."""
+    if isinstance(v, dict):
+        return (dict, frozenset((k, _freeze(x)) for k, x in v.items()))
+    if isinstance(v, list):
+        return (list, tuple(_freeze(x) for x in v))
+    if isinstance(v, tuple):
+        return (tuple, tuple(_freeze(x) for x in v))
+    if isinstance(v, set):
+        return (set, frozenset(_freeze(x) for x in v))
+    return v
+
+
+def canonicalize_call(call):
+    """(name, frozenset((key, normalized value))) — None if arguments isn't a dict."""
+    args = call.get("arguments", {})
+    if not isinstance(args, dict):
+        return None
+    return (call["name"], frozenset(
+        (k, v.strip().lower() if isinstance(v, str) else _freeze(v))
+        for k, v in args.items()
+    ))
+
+
+class CallVocab:
+    """Interns canonical calls to ints and memoizes the match relation between them."""
+
+    def __init__(self):
+        self.calls = []
+        self._ids = {}
+        self._keysets = {}      # name -> distinct argument key sets seen
+        self._by_name = {}      # name -> ids
+        self._loose = set()     # ids of tools whose key sets nest, so subset != equality
+        self._pairs = {}
+        self._raw = {}          # (name, tuple(args.items())) as the call arrived -> id
+
+    def __len__(self):
+        return len(self.calls)
+
+    def intern(self, call):
+        canon = canonicalize_call(call)
+        if canon is None:
+            return None
+        i = self._ids.get(canon)
+        if i is None:
+            i = self._ids[canon] = len(self.calls)
+            self.calls.append(canon)
+            name, items = canon
+            keys = frozenset(k for k, _ in items)
+            ids = self._by_name.setdefault(name, [])
+            ids.append(i)
+            seen = self._keysets.setdefault(name, set())
+            if keys not in seen:
+                if any(keys < k or k < keys for k in seen):
+                    self._loose.update(ids)
+                seen.add(keys)
+            if ids[0] in self._loose:
+                self._loose.add(i)
+        return i
+
+    def encode(self, calls):
+        """
+        Tuple of ids for a call list, or None if any call can't be
+        canonicalized. A call seen before in the same raw form (same name,
+        same argument items in the same order) is looked up without being
+        canonicalized again; eval corpora repeat the same few calls.
+        """
+        raw = self._raw
+        ids = []
+        for c in calls:
+            try:
+                key = (c["name"], tuple(c["arguments"].items()))
+                i = raw[key]
+            except KeyError:
+                i = self.intern(c)
+                if i is None:
+                    return None
+                if "arguments" in c:
+                    raw[key] = i
+            except (TypeError, AttributeError):
+                # Unhashable values or non-dict arguments: canonicalize every time
+                i = self.intern(c)
+                if i is None:
+                    return None
+            ids.append(i)
+        return tuple(ids)
+
+    def matches(self, p, e):
+        if p == e:
+            return True
+        m = self._pairs.get((p, e))
+        if m is None:
+            (p_name, p_items), (e_name, e_items) = self.calls[p], self.calls[e]
+            m = self._pairs[(p, e)] = p_name == e_name and e_items <= p_items
+        return m
+
+    def match_count(self, pred, exp):
+        """Matched calls, as compute_f1's greedy first-fit would count them."""
+        if pred == exp:
+            return len(exp)
+        if self._loose.isdisjoint(exp):
+            # Ids only match themselves: multiset intersection
+            if len(exp) == 1:
+                return int(exp[0] in pred)
+            if len(pred) == 1:
+                return int(pred[0] in exp)
+            counts = {}
+            for p in pred:
+                counts[p] = counts.get(p, 0) + 1
+            matched = 0
+            for e in exp:
+                c = counts.get(e)
+                if c:
+                    counts[e] = c - 1
+                    matched += 1
+            return matched
+
+        matched = 0
+        used = set()
+        for e in exp:
+            for i, p in enumerate(pred):
+                if i not in used and self.matches(p, e):
+                    matched += 1
+                    used.add(i)
+                    break
+        return matched
+
+
+def _f1(matched, n_pred, n_exp):
+    if not n_pred and not n_exp:
+        return 1.0
+    if not n_pred or not n_exp:
+        return 0.0
+    precision = matched / n_pred
+    recall = matched / n_exp
+    if precision + recall == 0:
+        return 0.0
+    return 2 * precision * recall / (precision + recall)
+
+
+def score_case(predicted_calls, expected_calls):
+    """Drop-in replacement for benchmark.compute_f1."""
+    vocab = CallVocab()
+    pred, exp = vocab.encode(predicted_calls), vocab.encode(expected_calls)
+    if pred is None or exp is None:
+        from benchmark import compute_f1
+        return compute_f1(predicted_calls, expected_calls)
+    return _f1(vocab.match_count(pred, exp), len(pred), len(exp))
+
+
+class Encoded:
+    """
+    A corpus side encoded once: per-case id tuples, plus the flat (CSR)
+    arrays the vectorized matcher works on, built on first use. Cases
+    whose calls can't be canonicalized are None and count as empty.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.odd = [i for i, t in enumerate(ids) if t is None]
+        if self.odd:
+            ids = [t or () for t in ids]
+        self.lengths = list(map(len, ids))
+        self._flat = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def flat(self):
+        """(per-case lengths, flat ids, case index of each id) as int64 arrays."""
+        if self._flat is None:
+            lengths = np.asarray(self.lengths, dtype=np.int64)
+            flat = np.fromiter(chain.from_iterable(t or () for t in self.ids),
+                               dtype=np.int64, count=int(lengths.sum()))
+            case = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+            self._flat = (lengths, flat, case)
+        return self._flat
+
+
+def encode(call_lists, vocab):
+    """Canonicalize and intern every case's calls once."""
+    raw, ids = vocab._raw, []
+    for calls in call_lists:
+        try:
+            # Every call already seen in this raw form: one dict lookup each
+            ids.append(tuple([raw[(c["name"], tuple(c["arguments"].items()))] for c in calls]))
+        except (KeyError, TypeError, AttributeError):
+            ids.append(vocab.encode(calls))
+    return Encoded(ids)
+
+
+def _counted(keys):
+    """Sorted distinct keys and their counts. Keys arrive grouped by case, so
+    the stable (run-aware) sort is close to linear."""
+    if not len(keys):
+        return keys, keys
+    keys = np.sort(keys, kind="stable")
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.diff(np.r_[starts, len(keys)])
+
+
+def match_counts(pred, exp, vocab):
+    """
+    Matched calls per case. With NumPy the multiset intersection runs over
+    the whole corpus at once: (case, id) keys are counted on both sides and
+    the overlap is min(count) summed per case. Cases touching a nested tool
+    are then recounted with the greedy replay.
+    """
+    if np is None:
+        return [vocab.match_count(p or (), e or ()) for p, e in zip(pred.ids, exp.ids)]
+
+    n, V = len(pred), max(len(vocab), 1)
+    _, p_flat, p_case = pred.flat()
+    _, e_flat, e_case = exp.flat()
+    p_keys, p_counts = _counted(p_case * V + p_flat)
+    e_keys, e_counts = _counted(e_case * V + e_flat)
+    if not len(e_keys):
+        return np.zeros(n, dtype=np.int64)
+    at = np.minimum(np.searchsorted(e_keys, p_keys), len(e_keys) - 1)
+    hit = e_keys[at] == p_keys
+    matched = np.bincount(p_keys[hit] // V, weights=np.minimum(p_counts[hit], e_counts[at[hit]]),
+                          minlength=n).astype(np.int64)
+
+    if vocab._loose:
+        loose = np.fromiter(vocab._loose, dtype=np.int64, count=len(vocab._loose))
+        for i in np.unique(e_case[np.isin(e_flat, loose)]).tolist():
+            matched[i] = vocab.match_count(pred.ids[i] or (), exp.ids[i])
+    return matched
+
+
+def f1_scores(matched, n_pred, n_exp):
+    """Per-case F1 from match counts — vectorized when NumPy is available."""
+    if np is None:
+        # Few distinct (matched, n_pred, n_exp) triples: compute each once
+        table = {}
+        out = []
+        for key in zip(matched, n_pred, n_exp):
+            f1 = table.get(key)
+            if f1 is None:
+                f1 = table[key] = _f1(*key)
+            out.append(f1)
+        return out
+
+    matched = np.asarray(matched, dtype=np.float64)
+    n_pred = np.asarray(n_pred, dtype=np.float64)
+    n_exp = np.asarray(n_exp, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = matched / n_pred
+        recall = matched / n_exp
+        f1 = 2 * precision * recall / (precision + recall)
+    f1 = np.where(precision + recall == 0, 0.0, f1)
+    f1 = np.where((n_pred == 0) | (n_exp == 0), 0.0, f1)
+    return np.where((n_pred == 0) & (n_exp == 0), 1.0, f1)
+
+
+def _report(f1, difficulties):
+    n = len(f1)
+    report = {"f1": f1, "avg_f1": 0.0, "by_difficulty": {}}
+    if not n:
+        return report
+
+    if np is not None:
+        report["avg_f1"] = float(f1.sum() / n)
+        if difficulties is not None:
+            labels = sorted(set(difficulties))
+            code_of = {d: i for i, d in enumerate(labels)}
+            codes = np.fromiter(map(code_of.__getitem__, difficulties), dtype=np.int64, count=n)
+            sums = np.bincount(codes, weights=f1, minlength=len(labels))
+            counts = np.bincount(codes, minlength=len(labels))
+            for i, d in enumerate(labels):
+                report["by_difficulty"][d] = {"n": int(counts[i]), "avg_f1": float(sums[i] / counts[i])}
+        return report
+
+    report["avg_f1"] = sum(f1) / n
+    if difficulties is not None:
+        groups = {}
+        for d, score in zip(difficulties, f1):
+            groups.setdefault(d, []).append(score)
+        for d in sorted(groups):
+            scores = groups[d]
+            report["by_difficulty"][d] = {"n": len(scores), "avg_f1": sum(scores) / len(scores)}
+    return report
+
+
+def score_encoded(pred, exp, vocab, difficulties=None, predicted=None, expected=None):
+    """
+    Score two encoded sides of a corpus against each other.
+
+    Cases that couldn't be encoded are scored with compute_f1 on the raw
+    `predicted` / `expected` lists when given, else as empty.
+
+    Returns {"f1": per-case scores, "avg_f1": float,
+             "by_difficulty": {difficulty: {"n": int, "avg_f1": float}}}.
+    """
+    if np is None:
+        n_pred, n_exp = pred.lengths, exp.lengths
+    else:
+        n_pred, n_exp = pred.flat()[0], exp.flat()[0]
+    f1 = f1_scores(match_counts(pred, exp, vocab), n_pred, n_exp)
+    odd = sorted(set(pred.odd) | set(exp.odd))
+    if odd and predicted is not None and expected is not None:
+        from benchmark import compute_f1
+        for i in odd:
+            f1[i] = compute_f1(predicted[i], expected[i])
+    return _report(f1, difficulties)
+
+
+def score_corpus(predicted, expected, difficulties=None):
+    """Score parallel lists of predicted / expected call lists (see score_encoded)."""
+    vocab = CallVocab()
+    return score_encoded(encode(predicted, vocab), encode(expected, vocab), vocab,
+                         difficulties, predicted, expected)
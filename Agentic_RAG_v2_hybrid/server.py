@@ -0,0 +1,348 @@
+"""
+Local inference server — exposes generate_hybrid to the voice demo.
+
+  GET  /health        liveness + admission counters
+  GET  /ready         200 once warmup met its p50 target, 503 before
+                      (warms DEFAULT_TOOLS plus every --warmup-tools schema)
+  GET  /metrics       Prometheus text format (router counters + admission and
+                      scheduler gauges)
+  POST /v1/generate   {"query" | "messages", "tools"?, "session_id"?, "deadline_ms"?}
+                      -> result JSON
+  GET  /v1/stream     WebSocket; send the same JSON per turn and receive
+                      {"event": "classify" | "infer" | "route" | "postprocess", ...}
+                      followed by {"event": "result", "result": {...}}
+
+Stdlib asyncio only (HTTP/1.1 + RFC 6455 framing). Inference runs on a
+thread pool; admission control rejects work with 429 (Retry-After) once
+the pool and its waiting room are full. With --scheduler, stateless
+requests go through scheduler.Scheduler instead: separate edge and cloud
+queues ordered by deadline, shedding between them, 504 once a request's
+deadline passes in the queue. Session turns always use the thread pool.
+
+Usage:
+  python server.py --port 8765 --max-concurrency 4 --max-queue 16
+  python server.py --statsd 127.0.0.1:8125     # also push metrics to StatsD
+  python server.py --scheduler --edge-workers 1 # edge/cloud queues with deadlines
+  python server.py --warmup-tools demo/tools.json  # also warm the schema the demo sends
+  open "demo/index.html?backend=ws://localhost:8765"
+"""
+
+import argparse, asyncio, base64, hashlib, json, struct, time
+from concurrent.futures import ThreadPoolExecutor
+
+import main
+import metrics
+from main import SessionStore, generate_hybrid
+from scheduler import DeadlineExceeded, Overloaded, Scheduler
+from benchmark import (
+    TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_SEND_MESSAGE, TOOL_CREATE_REMINDER,
+    TOOL_SEARCH_CONTACTS, TOOL_PLAY_MUSIC, TOOL_SET_TIMER,
+)
+
+DEFAULT_TOOLS = [
+    TOOL_GET_WEATHER, TOOL_SET_ALARM, TOOL_SEND_MESSAGE, TOOL_CREATE_REMINDER,
+    TOOL_SEARCH_CONTACTS, TOOL_PLAY_MUSIC, TOOL_SET_TIMER,
+]
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+MAX_BODY_BYTES = 1 << 20
+
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "GET, POST, OPTIONS",
+    "Access-Control-Allow-Headers": "Content-Type",
+}
+
+
+class Busy(Exception):
+    """Raised when admission control turns a request away."""
+
+
+class Admission:
+    """At most `max_concurrency` requests running and `max_queue` waiting."""
+
+    def __init__(self, max_concurrency, max_queue):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    async def __aenter__(self):
+        if self.running + self.waiting >= self.max_concurrency + self.max_queue:
+            raise Busy("server at capacity")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+
+    async def __aexit__(self, *exc):
+        self.running -= 1
+        self._slots.release()
+
+
+class InferenceServer:
+    def __init__(self, max_concurrency=4, max_queue=16, scheduler=None, warmup_toolsets=()):
+        self.admission = Admission(max_concurrency, max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="infer")
+        self.scheduler = scheduler
+        self.warmup_toolsets = [DEFAULT_TOOLS, *warmup_toolsets]
+        self.sessions = SessionStore()
+        self.warmup_report = None
+        self.require_warmup = True
+
+    # ── Inference ──
+
+    def _run(self, request, on_event):
+        """Blocking: one turn of the hybrid pipeline (runs on the executor)."""
+        tools = request.get("tools") or DEFAULT_TOOLS
+        session_id = request.get("session_id")
+        if "messages" in request:
+            return generate_hybrid(request["messages"], tools, on_event=on_event)
+        if session_id:
+            return self.sessions.get(session_id, tools).generate(request["query"], on_event=on_event)
+        return generate_hybrid([{"role": "user", "content": request["query"]}], tools, on_event=on_event)
+
+    async def infer(self, request, on_event=None):
+        if "messages" not in request and not isinstance(request.get("query"), str):
+            raise ValueError("request needs 'query' or 'messages'")
+        loop = asyncio.get_running_loop()
+        forward = None
+        if on_event is not None:
+            # Pipeline stages fire on the worker thread; hop back onto the loop
+            forward = lambda stage, payload: loop.call_soon_threadsafe(on_event, stage, payload)
+        if self.scheduler is not None and not request.get("session_id"):
+            # The scheduler does its own admission (Overloaded) and deadline handling
+            messages = request.get("messages") or [{"role": "user", "content": request["query"]}]
+            return await asyncio.wrap_future(self.scheduler.submit(
+                messages, request.get("tools") or DEFAULT_TOOLS, request.get("deadline_ms"), forward))
+        async with self.admission:
+            return await loop.run_in_executor(self.executor, self._run, request, forward)
+
+    async def warmup(self):
+        """main.warmup on the executor, for the default toolset and the clients' (warmup_toolsets)."""
+        loop = asyncio.get_running_loop()
+        try:
+            self.warmup_report = await loop.run_in_executor(self.executor, main.warmup, self.warmup_toolsets)
+        except Exception as e:
+            print(f"  Warmup failed: {e}", flush=True)
+            return
+        p50 = self.warmup_report["p50_ms"]
+        print(f"  Warmup: p50 {'-' if p50 is None else f'{p50:.0f}ms'}, "
+              f"{'ready' if self.warmup_report['ready'] else 'NOT ready'}", flush=True)
+
+    # ── HTTP ──
+
+    async def handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, path, _ = request_line.split(" ", 2)
+            headers = {}
+            for line in header_lines:
+                if ":" in line:
+                    k, v = line.split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+
+            if headers.get("upgrade", "").lower() == "websocket" and path == "/v1/stream":
+                await self.handle_websocket(reader, writer, headers)
+                return
+
+            if method == "OPTIONS":
+                await self.respond(writer, 204, None)
+            elif method == "GET" and path == "/health":
+                await self.respond(writer, 200, {
+                    "status": "ok",
+                    "running": self.admission.running,
+                    "waiting": self.admission.waiting,
+                    "sessions": len(self.sessions),
+                })
+            elif method == "GET" and path == "/ready":
+                ready = main.is_ready() or not self.require_warmup
+                await self.respond(writer, 200 if ready else 503, {"ready": ready, "warmup": self.warmup_report})
+            elif method == "GET" and path == "/metrics":
+                gauges = {
+                    "swissblaiz_server_running": self.admission.running,
+                    "swissblaiz_server_waiting": self.admission.waiting,
+                    "swissblaiz_server_sessions": len(self.sessions),
+                }
+                if self.scheduler is not None:
+                    gauges.update(self.scheduler.gauges())
+                await self.respond(writer, 200, metrics.render_prometheus(gauges=gauges))
+            elif method == "POST" and path == "/v1/generate":
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {"error": "body too large"})
+                    return
+                body = await reader.readexactly(length)
+                try:
+                    result = await self.infer(json.loads(body))
+                except (Busy, Overloaded) as e:
+                    await self.respond(writer, 429, {"error": str(e)}, {"Retry-After": "1"})
+                    return
+                except DeadlineExceeded as e:
+                    await self.respond(writer, 504, {"error": str(e)})
+                    return
+                except (ValueError, KeyError) as e:
+                    await self.respond(writer, 400, {"error": str(e)})
+                    return
+                await self.respond(writer, 200, result)
+            else:
+                await self.respond(writer, 404, {"error": f"no route for {method} {path}"})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            await self.respond(writer, 500, {"error": str(e)})
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, body, extra_headers=None):
+        """JSON for dicts, text/plain (the metrics exposition) for str."""
+        if isinstance(body, str):
+            payload, content_type = body.encode(), metrics.CONTENT_TYPE
+        else:
+            payload, content_type = b"" if body is None else json.dumps(body).encode(), "application/json"
+        lines = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+        headers = dict(CORS_HEADERS, **{"Content-Length": str(len(payload)), "Connection": "close"})
+        if body is not None:
+            headers["Content-Type"] = content_type
+        headers.update(extra_headers or {})
+        lines += [f"{k}: {v}" for k, v in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload)
+        await writer.drain()
+
+    # ── WebSocket ──
+
+    async def handle_websocket(self, reader, writer, headers):
+        key = headers.get("sec-websocket-key", "")
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write((
+            "HTTP/1.1 101 Switching Protocols\r\n"
+            "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept}\r\n\r\n"
+        ).encode())
+        await writer.drain()
+
+        while True:
+            opcode, data = await _ws_read(reader)
+            if opcode == 0x8:   # close
+                _ws_write(writer, 0x8, data[:2])
+                await writer.drain()
+                return
+            if opcode == 0x9:   # ping
+                _ws_write(writer, 0xA, data)
+                await writer.drain()
+                continue
+            if opcode != 0x1:
+                continue
+
+            def send_event(stage, payload):
+                _ws_write(writer, 0x1, json.dumps(dict(payload, event=stage)).encode())
+
+            start = time.perf_counter()
+            try:
+                request = json.loads(data)
+                result = await self.infer(request, on_event=send_event)
+                send_event("result", {"result": result, "server_ms": (time.perf_counter() - start) * 1000})
+            except (Busy, Overloaded, DeadlineExceeded) as e:
+                send_event("error", {"error": str(e), "retry": True})
+            except Exception as e:
+                send_event("error", {"error": str(e)})
+            await writer.drain()
+
+
+_REASONS = {
+    101: "Switching Protocols", 200: "OK", 204: "No Content", 400: "Bad Request",
+    404: "Not Found", 413: "Payload Too Large", 429: "Too Many Requests", 500: "Internal Server Error",
+    503: "Service Unavailable", 504: "Gateway Timeout",
+}
+
+
+async def _ws_read(reader):
+    """Read one (possibly fragmented) client message -> (opcode, payload)."""
+    opcode, chunks = None, []
+    while True:
+        b1, b2 = await reader.readexactly(2)
+        fin, frame_op = b1 & 0x80, b1 & 0x0F
+        length = b2 & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await reader.readexactly(8))[0]
+        if length > MAX_BODY_BYTES:
+            raise ConnectionError("frame too large")
+        mask = await reader.readexactly(4) if b2 & 0x80 else None
+        data = await reader.readexactly(length)
+        if mask:
+            data = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+        if frame_op >= 0x8:           # control frames may interleave fragments
+            return frame_op, data
+        if frame_op:
+            opcode = frame_op
+        chunks.append(data)
+        if fin:
+            return opcode, b"".join(chunks)
+
+
+def _ws_write(writer, opcode, data):
+    header = bytes([0x80 | opcode])
+    if len(data) < 126:
+        header += bytes([len(data)])
+    elif len(data) < 1 << 16:
+        header += bytes([126]) + struct.pack("!H", len(data))
+    else:
+        header += bytes([127]) + struct.pack("!Q", len(data))
+    writer.write(header + data)
+
+
+def load_toolsets(path):
+    """Toolsets from a JSON file holding one tool list or a list of them."""
+    with open(path) as f:
+        toolsets = json.load(f)
+    if toolsets and isinstance(toolsets[0], dict):
+        toolsets = [toolsets]
+    return toolsets
+
+
+async def serve(host, port, max_concurrency, max_queue, preload=True, scheduler=None, warmup_toolsets=()):
+    server = InferenceServer(max_concurrency=max_concurrency, max_queue=max_queue, scheduler=scheduler,
+                             warmup_toolsets=warmup_toolsets)
+    server.require_warmup = preload
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"  Serving on http://{host}:{port}  (ws://{host}:{port}/v1/stream)", flush=True)
+    if preload:
+        # Listen first so /health answers; /ready stays 503 until warm
+        print("  Warming up...", flush=True)
+        asyncio.get_running_loop().create_task(server.warmup())
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SwissblAIz local inference server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Requests running at once")
+    parser.add_argument("--max-queue", type=int, default=16, help="Requests allowed to wait")
+    parser.add_argument("--no-preload", action="store_true", help="Skip warmup; load models on first request")
+    parser.add_argument("--statsd", help="host:port to also push metrics to (DogStatsD tags)")
+    parser.add_argument("--scheduler", action="store_true",
+                        help="Queue stateless requests on separate edge/cloud pools with deadlines")
+    parser.add_argument("--edge-workers", type=int, default=1, help="Scheduler edge workers (one per model)")
+    parser.add_argument("--warmup-tools", action="append", default=[], metavar="FILE",
+                        help="JSON tool list(s) clients send, warmed alongside the defaults (repeatable)")
+    args = parser.parse_args()
+    if args.statsd:
+        metrics.add_statsd(args.statsd)
+    scheduler = None
+    if args.scheduler:
+        scheduler = Scheduler(edge_workers=args.edge_workers, cloud_workers=args.max_concurrency,
+                              edge_queue=args.max_queue, cloud_queue=2 * args.max_queue)
+    try:
+        warmup_toolsets = [tools for path in args.warmup_tools for tools in load_toolsets(path)]
+        asyncio.run(serve(args.host, args.port, args.max_concurrency, args.max_queue,
+                          not args.no_preload, scheduler, warmup_toolsets))
+    except KeyboardInterrupt:
+        pass
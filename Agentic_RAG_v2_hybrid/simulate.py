@@ -0,0 +1,248 @@
+"""
+Offline routing simulator — replay one recorded run through any routing policy.
+
+`record` runs every case once on-device and once escalated to the cloud,
+and logs both outcomes (calls, F1, latency, source) with the routing
+features generate_hybrid sees: complexity, raw confidence, name/key
+match score and structural validation score. After that, a policy only chooses which outcome each case
+gets, so its compute_total_score is known without re-running inference.
+
+The on-device half is itself shaped by the thresholds live when it was
+recorded (saved as `recorded_thresholds`): repairs only run below the
+threshold, and a cascade stops at its first confident tier. A case whose
+first pass came from a one-tier cascade and validated cleanly took
+neither branch, so its local outcome is the same under any threshold;
+those records are marked `threshold_free` and replay exactly under every
+policy. The others replay exactly only at the recording thresholds;
+`sweep` reports how many there are, and a run recorded with
+REPAIR_MAX_ATTEMPTS = 0 and a one-tier CASCADE has none.
+
+  - evaluate(records, policy)  exact compute_total_score for any callable
+                               policy(record) -> escalate?
+  - Replay                     vectorized scoring: per-difficulty sums are
+                               linear in the escalation mask, so a threshold
+                               per complexity reduces to prefix sums over
+                               cases sorted by confidence; a whole grid of
+                               (EASY, MEDIUM, HARD) thresholds is one
+                               broadcast. score_masks() handles arbitrary
+                               masks (rules, predictors) as a matrix product.
+
+Usage:
+  python simulate.py record run.jsonl.gz [--corpus benchmarks.jsonl.gz]
+  python simulate.py sweep run.jsonl.gz [--steps 41]
+"""
+
+import argparse, json, time
+import numpy as np
+
+from benchmark import compute_f1, compute_total_score
+from corpus import open_jsonl
+
+DIFFICULTIES = ["easy", "medium", "hard"]
+DIFFICULTY_WEIGHTS = np.array([0.20, 0.30, 0.50])
+COMPLEXITIES = ["EASY", "MEDIUM", "HARD"]
+TIME_BASELINE_MS = 500
+
+
+# ── Recording ──
+
+def record(cases, path):
+    """Run each case locally and escalated; write one JSONL record per case."""
+    import main
+    from main import classify_complexity, generate_hybrid, escalate_to_cloud
+
+    thresholds = {"EASY": main.CONFIDENCE_THRESHOLD_EASY, "MEDIUM": main.CONFIDENCE_THRESHOLD_MEDIUM,
+                  "HARD": main.CONFIDENCE_THRESHOLD_HARD}
+
+    count = 0
+    with open_jsonl(path, "w") as f:
+        for case in cases:
+            messages, tools = case["messages"], case["tools"]
+            user_text = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+            # escalate=False always hands back the local half; then force the cloud half too
+            local = generate_hybrid(messages, tools, escalate=False)
+            local.pop("needs_cloud", None)
+            escalated = escalate_to_cloud(messages, tools, dict(local))
+            expected = case["expected_calls"]
+            # Neither a repair nor a second tier could have changed the local half
+            threshold_free = (len(main.CASCADE) == 1 and not local.get("repair_attempts")
+                              and local.get("validation", {}).get("valid", True))
+            f.write(json.dumps({
+                "name": case["name"],
+                "difficulty": case["difficulty"],
+                "complexity": classify_complexity(user_text, tools),
+                "raw_confidence": local["confidence"],
+                "match_score": local.get("match_score", 1.0),
+                "validation_score": local.get("validation", {}).get("score", 1.0),
+                "recorded_thresholds": thresholds,
+                "threshold_free": threshold_free,
+                "local": _outcome(local, expected),
+                "escalated": _outcome(escalated, expected),
+            }) + "\n")
+            count += 1
+            print(f"  [{count}] {case['name']:<28} local F1={compute_f1(local['function_calls'], expected):.2f}"
+                  f"  escalated F1={compute_f1(escalated['function_calls'], expected):.2f}", flush=True)
+    return count
+
+
+def _outcome(result, expected):
+    return {
+        "calls": result["function_calls"],
+        "f1": compute_f1(result["function_calls"], expected),
+        "time_ms": result["total_time_ms"],
+        "source": result.get("source", "unknown"),
+    }
+
+
+def load_records(path):
+    with open_jsonl(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def threshold_bound(records):
+    """Records whose local outcome holds only at their recording thresholds (see module docstring)."""
+    return [r for r in records if not r.get("threshold_free", False)]
+
+
+def routing_confidence(r):
+    """The confidence generate_hybrid compares against its threshold (before calibration)."""
+    return r["raw_confidence"] * r["match_score"] * r.get("validation_score", 1.0)
+
+
+# ── Exact evaluation ──
+
+def threshold_policy(thresholds):
+    """Escalate when routing confidence < thresholds[complexity], like generate_hybrid."""
+    return lambda r: routing_confidence(r) < thresholds[r["complexity"]]
+
+
+def evaluate(records, policy):
+    """compute_total_score for one policy — exact, via the benchmark's own code."""
+    results = []
+    for r in records:
+        outcome = r["escalated"] if policy(r) else r["local"]
+        results.append({
+            "difficulty": r["difficulty"],
+            "f1": outcome["f1"],
+            "total_time_ms": outcome["time_ms"],
+            "source": outcome["source"],
+        })
+    return compute_total_score(results)
+
+
+# ── Vectorized evaluation ──
+
+class Replay:
+    """Column view of a recorded run for scoring many policies at once."""
+
+    def __init__(self, records):
+        self.records = records
+        d_code = {d: i for i, d in enumerate(DIFFICULTIES)}
+        c_code = {c: i for i, c in enumerate(COMPLEXITIES)}
+        # Difficulties outside the weighted three don't count, as in compute_total_score
+        self.difficulty = np.array([d_code.get(r["difficulty"], -1) for r in records])
+        self.complexity = np.array([c_code[r["complexity"]] for r in records])
+        self.confidence = np.array([routing_confidence(r) for r in records], dtype=np.float64)
+
+        def metrics(side):
+            return np.array([[r[side]["f1"], r[side]["time_ms"], r[side]["source"] == "on-device"]
+                             for r in records], dtype=np.float64).reshape(len(records), 3)
+
+        # (N, metric) with metrics f1, time_ms, on_device
+        self.local, self.escalated = local, escalated = metrics("local"), metrics("escalated")
+        # (N, difficulty, metric): each case contributes only to its own difficulty
+        onehot = (self.difficulty[:, None] == np.arange(len(DIFFICULTIES))).astype(np.float64)
+        self.base = np.einsum("nd,nm->dm", onehot, local)
+        self.delta = onehot[:, :, None] * (escalated - local)[:, None, :]
+        self.counts = onehot.sum(axis=0)
+
+    def score_sums(self, sums):
+        """compute_total_score from per-difficulty metric sums of shape (..., 3, 3)."""
+        n = np.where(self.counts > 0, self.counts, 1)[:, None]
+        avg = sums / n
+        time_score = np.maximum(0.0, 1 - avg[..., 1] / TIME_BASELINE_MS)
+        level = 0.60 * avg[..., 0] + 0.15 * time_score + 0.25 * avg[..., 2]
+        level = np.where(self.counts > 0, level, 0.0)
+        return (level * DIFFICULTY_WEIGHTS).sum(axis=-1) * 100
+
+    def score_masks(self, masks, chunk=256):
+        """Scores for a (K, N) boolean array of escalation masks."""
+        masks = np.atleast_2d(np.asarray(masks, dtype=np.float64))
+        flat_delta = self.delta.reshape(len(self.records), -1)
+        out = []
+        for start in range(0, len(masks), chunk):
+            sums = self.base + (masks[start:start + chunk] @ flat_delta).reshape(-1, 3, 3)
+            out.append(self.score_sums(sums))
+        return np.concatenate(out) if out else np.empty(0)
+
+    def _prefix(self, complexity, thresholds):
+        """Delta sums per threshold when escalating cases of one complexity with confidence < t."""
+        sel = np.flatnonzero(self.complexity == complexity)
+        order = sel[np.argsort(self.confidence[sel], kind="stable")]
+        conf = self.confidence[order]
+        cum = np.concatenate([np.zeros((1, 3, 3)), np.cumsum(self.delta[order], axis=0)])
+        return cum[np.searchsorted(conf, thresholds, side="left")]
+
+    def sweep(self, thresholds):
+        """
+        Score every (EASY, MEDIUM, HARD) threshold combination from `thresholds`.
+        Returns an array of shape (T, T, T) indexed like the complexities.
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        e, m, h = (self._prefix(c, thresholds) for c in range(len(COMPLEXITIES)))
+        sums = (self.base
+                + e[:, None, None]
+                + m[None, :, None]
+                + h[None, None, :])
+        return self.score_sums(sums)
+
+
+def best_thresholds(replay, thresholds):
+    scores = replay.sweep(thresholds)
+    i, j, k = np.unravel_index(np.argmax(scores), scores.shape)
+    return {"EASY": float(thresholds[i]), "MEDIUM": float(thresholds[j]), "HARD": float(thresholds[k])}, float(scores[i, j, k])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded run through routing policies")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record", help="Run cases locally and escalated, log both")
+    rec.add_argument("out")
+    rec.add_argument("--corpus", help="JSONL(.gz) corpus instead of the built-in cases")
+    rec.add_argument("--shard", default="0/1", help="i/n: record every n-th case starting at i")
+    sw = sub.add_parser("sweep", help="Search per-complexity thresholds over a recorded run")
+    sw.add_argument("log")
+    sw.add_argument("--steps", type=int, default=41, help="Thresholds per complexity, evenly over [0, 1]")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from corpus import iter_cases, parse_shard
+        from benchmark import BENCHMARKS
+        shard, num_shards = parse_shard(args.shard)
+        cases = iter_cases(args.corpus, shard, num_shards) if args.corpus else BENCHMARKS[shard::num_shards]
+        print(f"  Recorded {record(cases, args.out)} cases to {args.out}")
+    else:
+        import main
+        records = load_records(args.log)
+        replay = Replay(records)
+        # Just past 1.0 so the top step escalates everything
+        grid = np.append(np.linspace(0, 1, args.steps), np.nextafter(1.0, 2.0))
+
+        start = time.perf_counter()
+        scores = replay.sweep(grid)
+        elapsed = time.perf_counter() - start
+        print(f"  {len(records)} cases, {scores.size:,} policies in {elapsed * 1000:.1f}ms "
+              f"({scores.size / elapsed:,.0f} policies/s)")
+        bound = threshold_bound(records)
+        if bound:
+            print(f"  {len(bound)} cases repaired or cascaded at record time: scores are exact only at "
+                  f"their recording thresholds, approximate elsewhere")
+
+        current = {"EASY": main.CONFIDENCE_THRESHOLD_EASY, "MEDIUM": main.CONFIDENCE_THRESHOLD_MEDIUM,
+                   "HARD": main.CONFIDENCE_THRESHOLD_HARD}
+        best, best_score = best_thresholds(replay, grid)
+        for label, policy in [("current", current), ("never escalate", dict.fromkeys(COMPLEXITIES, 0.0)),
+                              ("always escalate", dict.fromkeys(COMPLEXITIES, 2.0)), ("best", best)]:
+            exact = evaluate(records, threshold_policy(policy))
+            thresholds = "  ".join(f"{c}={t:.3f}" for c, t in policy.items())
+            print(f"  {label:<16} {exact:6.2f}%   {thresholds}")
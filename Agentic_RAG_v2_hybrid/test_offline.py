@@ -16,6 +16,11 @@ cactus_module.cactus_destroy = lambda *a, **kw: None
 sys.modules["cactus"] = cactus_module
 
 from main import classify_complexity, validate_tool_calls, build_reflection_prompt
+from main import postprocess_call, postprocess_batch
+from main import parse_number, parse_time, format_time
+from main import ToolIndex, postprocess_scored
+from main import IntentMatcher, detect_intents
+import main
 
 TOOLS = [
     {"name": "get_weather", "description": "Get weather", "parameters": {"type": "object", "properties": {"location": {"type": "string", "description": "City"}}, "required": ["location"]}},
@@ -114,6 +119,12 @@ for desc, calls, tools, expected_valid in trn_tests:
 
 print(f"\n  TRN: {passed}/{len(trn_tests)} correct")
 
+partial = validate_tool_calls([{"name": "get_weather", "arguments": {"location": "Paris"}}], TOOLS, min_calls=2)
+assert not partial["valid"] and partial["score"] == 0.5, partial
+spoken = validate_tool_calls([{"name": "setAlarm", "arguments": {"time": "7:30 AM"}}], TOOLS)
+assert spoken["valid"], spoken
+print(f"  [PASS] too few calls for the intents halves the score; repairable names and clock times pass")
+
 # ── 3. TEST REFLECTION PROMPT ──
 print("\n=== 3. REFLECTION PROMPT ===\n")
 
@@ -127,6 +138,1087 @@ assert "missing required arg" in reflection[-1]["content"], "Error not injected"
 print(f"  [PASS] Builds 3-message reflection prompt with error injection")
 print(f"  [PASS] Error context: '{reflection[-1]['content'][:70]}...'")
 
+replies = iter(['{"function_calls":[{"name":"send_message","arguments":{"recipient":"Bob"}}],"confidence":0.9,"total_time_ms":40}',
+                '{"function_calls":[{"name":"send_message","arguments":{"recipient":"Bob","message":"hi"}}],"confidence":0.8,"total_time_ms":30}'])
+seen = []
+cactus_module.cactus_complete = lambda model, messages, **kw: seen.append(messages) or next(replies)
+repaired = main.generate_hybrid([{"role": "user", "content": "Text Bob hi"}], TOOLS[1:2])
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+assert repaired["source"] == "on-device" and repaired["repair_attempts"] == 1, repaired
+assert repaired["validation"]["valid"] and repaired["total_time_ms"] == 70, repaired
+assert "missing required arg 'message'" in seen[1][-1]["content"]
+print(f"  [PASS] invalid local output repaired on-device in 1 attempt ({repaired['total_time_ms']}ms), no cloud call")
+
+# ── 4. TEST BATCH POSTPROCESSING ──
+print("\n=== 4. BATCH POSTPROCESSING ===\n")
+
+logged = [
+    {"name": "GET_WEATHER", "arguments": {"location": " Paris "}},
+    {"name": "set_alarm", "arguments": {"Hour": "7", "minute": "fifteen"}},
+    {"name": "send_message", "arguments": '{"recipient": "Bob"}'},
+    {"name": "launch_rockets", "arguments": {"count": 3}},
+]
+batch = postprocess_batch(logged, TOOLS)
+assert batch == [postprocess_call(c, TOOLS) for c in logged], "Batch differs from per-call"
+assert batch[0] == {"name": "get_weather", "arguments": {"location": "Paris"}}
+assert batch[1] == {"name": "set_alarm", "arguments": {"hour": 7, "minute": 15}}
+assert batch[2] == {"name": "send_message", "arguments": {"recipient": "Bob", "message": ""}}
+assert batch[3]["name"] == "launch_rockets"
+print(f"  [PASS] postprocess_batch matches postprocess_call on {len(logged)} logged calls")
+
+# ── 5. PROPERTY TESTS: NUMBER & TIME NORMALIZATION ──
+print("\n=== 5. NUMBER & TIME NORMALIZATION (properties) ===\n")
+
+import random
+rng = random.Random(29)
+
+UNITS = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten",
+         "eleven", "twelve", "thirteen", "fourteen", "fifteen", "sixteen", "seventeen", "eighteen", "nineteen"]
+TENS = ["", "", "twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"]
+
+def spell(n, sep):
+    if n < 20:
+        return UNITS[n]
+    if n < 100:
+        return TENS[n // 10] + (sep + UNITS[n % 10] if n % 10 else "")
+    rest = n % 100
+    return UNITS[n // 100] + " hundred" + (rng.choice([" and ", " "]) + spell(rest, sep) if rest else "")
+
+def spoken_times(h, m):
+    """Equivalent renderings of a 24h time."""
+    h12, ap = h % 12 or 12, "AM" if h < 12 else "PM"
+    out = [f"{h12}:{m:02d} {ap}", f"{h12}:{m:02d}{ap.lower()}", f"{h:02d}:{m:02d}" if h > 12 else f"{h12}:{m:02d} {ap}"]
+    if m == 0:
+        out += [f"{h12} {ap}", f"{spell(h12, ' ')} {ap.lower()}", f"{h12} o'clock {ap}"]
+    if m == 30:
+        out.append(f"half past {spell(h12, ' ')} {ap}")
+    if m == 15:
+        out.append(f"quarter past {h12} {ap.lower()}")
+    if m == 45:
+        out.append(f"quarter to {spell(h12 % 12 + 1, '-')} {ap}")
+    if 0 < m < 60 and m % 5 == 0 and m not in (15, 30, 45):
+        out.append(f"{spell(h12, ' ')} {spell(m, rng.choice([' ', '-']))} {ap.lower()}")
+    return out
+
+cases = 0
+for _ in range(500):
+    n = rng.randrange(1000)
+    for text in (str(n), spell(n, rng.choice([" ", "-"])), f"{n} minutes", f" {spell(n, '-').upper()} "):
+        assert parse_number(text) == n, (text, parse_number(text))
+        cases += 1
+print(f"  [PASS] parse_number round-trips {cases} spelled/digit numbers")
+
+cases = 0
+for _ in range(500):
+    h, m = rng.randrange(24), rng.choice([0, 5, 15, 30, 45, rng.randrange(60)])
+    for text in spoken_times(h, m):
+        assert parse_time(text) == (h, m), (text, parse_time(text), (h, m))
+        assert parse_time(format_time(*parse_time(text))) == (h, m)
+        cases += 1
+print(f"  [PASS] parse_time/format_time round-trip {cases} renderings")
+
+for text in ["", "soon", "25:00", "13 pm", "7:75"]:
+    assert parse_time(text) is None, text
+for ordinal, n in [("first", 1), ("twelfth", 12), ("twentieth", 20), ("twenty-third", 23), ("5th", 5)]:
+    assert parse_number(ordinal) == n, ordinal
+print(f"  [PASS] rejects non-times, parses ordinals")
+
+alarm = postprocess_call({"name": "set_alarm", "arguments": {"time": "quarter to seven am"}}, TOOLS)
+assert alarm["arguments"] == {"hour": 6, "minute": 45}, alarm
+reminder = postprocess_call({"name": "create_reminder", "arguments": {"title": "x", "time": "15:00"}}, TOOLS)
+assert reminder["arguments"]["time"] == "3:00 PM", reminder
+print(f"  [PASS] splits spoken times into hour/minute, canonicalizes time strings")
+
+# ── 6. TEST FUZZY TOOL / KEY MATCHING ──
+print("\n=== 6. FUZZY MATCHING ===\n")
+
+index = ToolIndex(TOOLS)
+fuzzy_tests = [
+    ("get_weather", "get_weather", 1.0),
+    ("setAlarm", "set_alarm", 1.0),
+    ("Search-Contacts", "search_contacts", 1.0),
+    ("weather_get", "get_weather", 0.9),
+    ("get_wether", "get_weather", 0.9),
+    ("create_remindr", "create_reminder", 0.9),
+    ("launch_rockets", "launch_rockets", 0.0),
+    ("set", "set", 0.0),
+]
+passed = 0
+for raw, expected, min_score in fuzzy_tests:
+    name, score = index.match_name(raw)
+    ok = name == expected and (score >= min_score if min_score else score == 0.0)
+    passed += ok
+    print(f"  [{'PASS' if ok else 'FAIL'}] {raw:<16} -> {name:<16} score={score:.2f}")
+print(f"\n  Fuzzy: {passed}/{len(fuzzy_tests)} correct")
+
+calls, score = postprocess_scored([{"name": "sendMessage", "arguments": {"recipent": "Bob", "message": "hi"}}], TOOLS)
+assert calls == [{"name": "send_message", "arguments": {"recipient": "Bob", "message": "hi"}}], calls
+assert 0.75 <= score < 1.0, score
+print(f"  [PASS] repairs near-miss keys and reports match score {score:.2f}")
+
+# ── 7. TEST CORPUS SCORING ──
+print("\n=== 7. CORPUS SCORING ===\n")
+
+from benchmark import compute_f1
+from scoring import score_case, score_corpus
+
+rng = random.Random(33)
+pool = [
+    {"name": "get_weather", "arguments": {"location": "London"}},
+    {"name": "get_weather", "arguments": {"location": " london "}},
+    {"name": "get_weather", "arguments": {"location": "Paris", "units": "c"}},
+    {"name": "set_alarm", "arguments": {"hour": 7, "minute": 0}},
+    {"name": "set_alarm", "arguments": {"hour": 7.0, "minute": False}},
+    {"name": "set_alarm", "arguments": {"hour": 7}},
+    {"name": "play_music", "arguments": {"song": ["a", "b"]}},
+    {"name": "play_music", "arguments": {"song": ("a", "b")}},
+    {"name": "send_message", "arguments": {"recipient": {"name": "Bob"}, "message": "hi"}},
+    {"name": "send_message", "arguments": "Bob"},
+    {"name": "set_timer", "arguments": {}},
+]
+predicted = [rng.choices(pool, k=rng.randint(0, 3)) for _ in range(2000)]
+expected = [[c for c in rng.choices(pool, k=rng.randint(0, 3)) if isinstance(c["arguments"], dict)]
+            for _ in range(2000)]
+reference = [compute_f1(p, e) for p, e in zip(predicted, expected)]
+assert [score_case(p, e) for p, e in zip(predicted, expected)] == reference
+report = score_corpus(predicted, expected, ["easy", "hard"] * 1000)
+assert [float(f) for f in report["f1"]] == reference
+assert report["by_difficulty"]["easy"]["n"] == 1000
+# Expectations encoded once; later runs hit the vocab's raw-form cache
+from scoring import CallVocab, encode, score_encoded
+vocab = CallVocab()
+exp = encode(expected, vocab)
+for run in (predicted, [rng.choices(pool, k=rng.randint(0, 3)) for _ in range(2000)]):
+    rescored = score_encoded(encode(run, vocab), exp, vocab, predicted=run, expected=expected)
+    assert [float(f) for f in rescored["f1"]] == [compute_f1(p, e) for p, e in zip(run, expected)]
+print(f"  [PASS] score_case/score_corpus/score_encoded bit-identical to compute_f1 on {len(reference)} cases")
+
+# ── 8. TEST INTENT MATCHER ──
+print("\n=== 8. INTENT MATCHER ===\n")
+
+intent_tests = [
+    ("Send Bob a text", {"message"}),
+    ("Read the context of the display", set()),
+    ("Replay the pretext", set()),
+    ("Texting Emma; forecasts please", {"message", "weather"}),
+    ("Wake me at 7 and look up Tom", {"alarm", "search"}),
+    ("PLAY some Music", {"music"}),
+]
+passed = 0
+for text, expected in intent_tests:
+    found = {intent for _, _, intent, _ in detect_intents(text)}
+    ok = found == expected
+    passed += ok
+    print(f"  [{'PASS' if ok else 'FAIL'}] {text:<34} -> {sorted(found)}")
+print(f"\n  Intents: {passed}/{len(intent_tests)} correct")
+
+spans = detect_intents("Please text Ana, then play jazz")
+assert [(s, e, i) for s, e, i, _ in spans] == [(7, 11, "message"), (22, 26, "music")], spans
+matcher = IntentMatcher({"a": ["he", "she", "hers"], "b": ["his"]})
+assert [(s, e, kw) for s, e, _, kw in matcher.find("ushers his she")] == [(7, 10, "his"), (11, 14, "she")]
+print(f"  [PASS] spans index the original text, overlapping keywords respect word boundaries")
+
+# ── 9. TEST METRICS ──
+print("\n=== 9. METRICS ===\n")
+
+from metrics import render_prometheus
+
+sink = main.Metrics()
+previous = main.set_metrics_sink(sink)
+postprocess_scored([{"name": "sendMessage", "arguments": {"recipent": "Bob", "message": "hi", "zzz": 1}},
+                    {"name": "launch_rockets", "arguments": "{oops"}], TOOLS)
+cactus_module.cactus_complete = lambda *a, **kw: "not json"
+local = main.generate_hybrid([{"role": "user", "content": "Set a timer for 5 minutes"}], TOOLS, escalate=False)
+assert local.get("needs_cloud"), local
+
+def cloud_down(messages, tools):
+    raise TimeoutError("no network")
+
+main.generate_cloud, real_generate_cloud = cloud_down, main.generate_cloud
+result = main.escalate_to_cloud([{"role": "user", "content": "Set a timer for 5 minutes"}], TOOLS, local)
+main.generate_cloud = real_generate_cloud
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+main.set_metrics_sink(previous)
+
+# Router metrics carry at most one label; key by its value
+counters = {(name, labels[0][1] if labels else None): n for (name, labels), n in sink.snapshot()["counters"].items()}
+expected_counters = {
+    ("swissblaiz_postprocess_repairs_total", "tool_name"): 1,
+    ("swissblaiz_postprocess_repairs_total", "argument_key"): 1,
+    ("swissblaiz_postprocess_repairs_total", "dropped_key"): 1,
+    ("swissblaiz_postprocess_repairs_total", "unknown_tool"): 1,
+    ("swissblaiz_json_parse_failures_total", "arguments"): 1,
+    ("swissblaiz_json_parse_failures_total", "completion"): 3,
+    ("swissblaiz_tier_runs_total", "functiongemma-270m"): 1,
+    ("swissblaiz_requests_total", "MEDIUM"): 1,
+    ("swissblaiz_validation_errors_total", "no_calls"): 3,
+    ("swissblaiz_repair_attempts_total", "MEDIUM"): 2,
+    ("swissblaiz_cloud_errors_total", "TimeoutError"): 1,
+    ("swissblaiz_routed_total", "fallback"): 1,
+}
+assert counters == expected_counters, counters
+print(f"  [PASS] counts repairs, parse failures, complexity, cloud errors and fallbacks")
+
+text = render_prometheus(sink.snapshot(), gauges={"swissblaiz_server_running": 2})
+assert 'swissblaiz_local_confidence_bucket{complexity="MEDIUM",le="0.1"} 1' in text, text
+assert 'swissblaiz_local_confidence_bucket{complexity="MEDIUM",le="+Inf"} 1' in text
+assert 'swissblaiz_request_ms_count{route="fallback"} 1' in text
+assert "# TYPE swissblaiz_routed_total counter" in text and "swissblaiz_server_running 2" in text
+print(f"  [PASS] Prometheus exposition: cumulative buckets, _sum/_count, gauges")
+
+# ── 10. TEST PROFILER ──
+print("\n=== 10. PROFILER ===\n")
+
+import tempfile, time as _time
+
+def slow_complete(*a, **kw):
+    _time.sleep(0.05)
+    return '{"function_calls":[],"confidence":0.9,"total_time_ms":50}'
+
+cactus_module.cactus_complete = slow_complete
+with tempfile.TemporaryDirectory() as out_dir:
+    profiler = main.enable_profiling(out_dir, rate_hz=1000, every=2, fmt="speedscope")
+    for _ in range(3):
+        main.generate_hybrid([{"role": "user", "content": "Play some jazz"}], TOOLS)
+    files = main.disable_profiling()
+    assert [os.path.basename(f) for f in files] == ["profile-000001-000002.speedscope.json",
+                                                    "profile-000003-000003.speedscope.json"], files
+    with open(files[0]) as f:
+        profile = json.load(f)
+    names = {frame["name"] for frame in profile["shared"]["frames"]}
+    assert {"generate_hybrid", "generate_cactus"} <= names, names
+    assert profile["profiles"][0]["endValue"] > 0
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+assert main._profiler is None and profiler.requests == 3
+print(f"  [PASS] {profiler.samples} samples over {profiler.requests} requests, one speedscope file per 2 requests")
+top = dict(profiler.top(20))
+assert any(label.startswith("generate_cactus") and share > 0.5 for label, share in top.items()), top
+print(f"  [PASS] time attributed to generate_cactus")
+
+# ── 11. TEST CONFIDENCE CALIBRATION ──
+print("\n=== 11. CONFIDENCE CALIBRATION ===\n")
+
+from calibration import fit_isotonic, fit_platt
+
+xs, ys = fit_isotonic([0.1, 0.2, 0.3, 0.4, 0.4, 0.5], [0.0, 1.0, 0.0, 1.0, 0.0, 1.0])
+assert xs == [0.1, 0.2, 0.3, 0.4, 0.5] and ys == [0.0, 0.5, 0.5, 0.5, 1.0], (xs, ys)
+assert all(a <= b for a, b in zip(ys, ys[1:]))
+a, b = fit_platt([0.1, 0.3, 0.5, 0.7, 0.9] * 20, [0, 0, 1, 1, 1] * 10 + [0, 1, 0, 1, 1] * 10)
+assert a > 0, (a, b)
+print(f"  [PASS] isotonic fit pools violators and ties; Platt slope {a:.2f} is increasing")
+
+calibrator = main.Calibrator({"method": "isotonic", "thresholds": {"MEDIUM": 0.4},
+                              "tiers": {"MEDIUM": {"x": [0.0, 0.5], "y": [0.2, 0.8]}}})
+assert abs(calibrator("MEDIUM", 0.25) - 0.5) < 1e-12 and calibrator("MEDIUM", 0.9) == 0.8
+assert calibrator("EASY", 0.33) == 0.33
+with tempfile.TemporaryDirectory() as out_dir:
+    path = os.path.join(out_dir, "calibration.json")
+    with open(path, "w") as f:
+        json.dump({"method": "isotonic", "thresholds": {"MEDIUM": 0.1},
+                   "tiers": {"MEDIUM": {"x": [0.0, 1.0], "y": [0.3, 0.9]}}}, f)
+    main.load_calibration(path)
+    load_us = main.startup_report()["load calibration"] * 1000
+# Raw confidence 0 calibrates to 0.3 >= 0.1, so the MEDIUM query stays on-device
+routed = main.generate_hybrid([{"role": "user", "content": "Set a timer for 5 minutes"}], TOOLS, escalate=False)
+main.load_calibration(None)
+assert not routed.get("needs_cloud") and routed["calibrated_confidence"] == 0.3, routed
+print(f"  [PASS] calibrated confidence and artifact thresholds drive routing "
+      f"(artifact loaded in {load_us:.0f}us)")
+
+# ── 12. TEST EDGE ENSEMBLE ──
+print("\n=== 12. EDGE ENSEMBLE ===\n")
+
+def scripted(*replies):
+    queue, options = iter(replies), []
+    def complete(model, messages, **kw):
+        options.append(kw.get("temperature"))
+        calls, conf = next(queue)
+        return json.dumps({"function_calls": calls, "confidence": conf, "total_time_ms": 20})
+    return complete, options
+
+paris = [{"name": "get_weather", "arguments": {"location": "Paris"}}]
+rome = [{"name": "get_weather", "arguments": {"location": "Rome"}}]
+cactus_module.cactus_complete, options = scripted((paris, 0.4), (rome, 0.9), (paris, 0.5))
+voted = main.sample_ensemble([{"role": "user", "content": "Weather in Paris?"}], TOOLS, samples=3, agree=2)
+assert voted["function_calls"] == paris and voted["samples"] == 3, voted
+assert abs(voted["agreement"] - 2 / 3) < 1e-12 and abs(voted["confidence"] - 2 / 3 * 0.45) < 1e-12, voted
+assert voted["sample_confidence"] == 0.5 and voted["total_time_ms"] == 60 and options == [0.3] * 3
+cactus_module.cactus_complete, _ = scripted((paris, 0.4), ([{"name": "get_weather", "arguments": {"location": " PARIS"}}], 0.3))
+voted = main.sample_ensemble([{"role": "user", "content": "Weather in Paris?"}], TOOLS, samples=5, agree=2)
+assert voted["samples"] == 2 and voted["agreement"] == 1.0 and voted["sample_ms"] == [20, 20], voted
+# Agreement alone no longer clears MEDIUM's 0.5: two confident-but-low samples still escalate
+assert abs(voted["confidence"] - 0.35) < 1e-12, voted
+
+# Opt-in: MEDIUM requests only vote when ENSEMBLE_TIERS names the tier
+cactus_module.cactus_complete, options = scripted(*[(paris, 0.9)] * 4)
+single = main.generate_hybrid([{"role": "user", "content": "Weather in Paris?"}], TOOLS[:3])
+main.ENSEMBLE_TIERS = ("MEDIUM",)
+ensembled = main.generate_hybrid([{"role": "user", "content": "Weather in Paris?"}], TOOLS[:3])
+main.ENSEMBLE_TIERS = ()
+assert "samples" not in single and ensembled["samples"] == 2 and len(options) == 3, (single, ensembled)
+assert abs(ensembled["confidence"] - 0.9) < 1e-12 and ensembled["source"] == "on-device", ensembled
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+print(f"  [PASS] majority over normalized calls, agreement x SDK confidence, stops once 2 agree, opt-in per tier")
+
+# ── 13. TEST CASCADE ──
+print("\n=== 13. CASCADE ===\n")
+
+rules = main.generate_rules([{"role": "user", "content": "Look up Jake in my contacts, send him a message saying rock and roll, and set a 15 minute timer."}], TOOLS)
+assert rules["confidence"] == 1.0 and [c["arguments"] for c in rules["function_calls"]] == [
+    {"query": "Jake"}, {"recipient": "Jake", "message": "rock and roll"}, {"minutes": "15"}], rules
+assert main.generate_rules([{"role": "user", "content": "Text him saying hi"}], TOOLS)["confidence"] == 0.0
+print(f"  [PASS] rules split clauses, keep 'and' inside messages, resolve pronouns")
+
+default_cascade = main.CASCADE
+main.CASCADE = [{"name": "rules", "backend": "rules"},
+                {"name": "edge", "backend": "cactus", "path": "edge-weights"},
+                {"name": "bigger", "backend": "cactus", "path": "bigger-weights", "budget_ms": 10}]
+paths = []
+def by_path(model, messages, **kw):
+    paths.append(model)
+    return json.dumps({"function_calls": [{"name": "play_music", "arguments": {"song": "jazz"}}],
+                       "confidence": 0.95, "total_time_ms": 30})
+cactus_module.cactus_init = lambda path, *a, **kw: path
+cactus_module.cactus_complete = by_path
+easy = main.generate_hybrid([{"role": "user", "content": "Set a timer for 5 minutes"}], TOOLS[4:5])
+hard = main.generate_hybrid([{"role": "user", "content": "Put on something relaxing"}], TOOLS[3:4])
+cactus_module.cactus_complete = lambda model, messages, **kw: paths.append(model) or '{"function_calls":[],"confidence":0,"total_time_ms":30}'
+skipped = main.generate_hybrid([{"role": "user", "content": "Put on something relaxing"}], TOOLS[3:4], escalate=False)
+main.CASCADE = default_cascade
+cactus_module.cactus_init = lambda *a, **kw: {}
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+main.release_models()
+assert easy["tier"] == "rules" and easy["function_calls"] == [{"name": "set_timer", "arguments": {"minutes": 5}}], easy
+assert hard["tier"] == "edge" and hard["total_time_ms"] >= 30, hard
+# The edge tier's 30ms (plus its repairs) is over the bigger tier's 10ms budget, so it's skipped
+assert skipped["needs_cloud"] and set(paths) == {"edge-weights"}, (skipped, paths)
+print(f"  [PASS] first confident tier answers; budgets skip slower tiers; models load lazily per tier")
+
+# SWISSBLAIZ_CASCADE: inline JSON or a file, validated before any request runs
+tiers = [{"name": "rules", "backend": "rules"}, {"name": "edge", "backend": "cactus", "budget_ms": 50}]
+assert main.load_cascade(json.dumps(tiers)) == tiers
+with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+    json.dump(tiers, f)
+assert main.load_cascade(f.name) == tiers
+os.unlink(f.name)
+for bad, reason in [("[]", "non-empty"), ('{"name": "rules"}', "list"), ('[{"backend": "rules"}]', "name"),
+                    ('[{"name": "a", "backend": "onnx"}]', "onnx"), ('[{"name": "a"}]', "backend"),
+                    ('[{"name": "a", "backend": "rules"}, {"name": "a", "backend": "cactus"}]', "duplicate"),
+                    ('[{"name": "a", "backend": "rules", "thresholds": 0.5}]', "thresholds")]:
+    try:
+        main.load_cascade(bad)
+        assert False, bad
+    except ValueError as e:
+        assert reason in str(e), (bad, e)
+print(f"  [PASS] cascade config inline or from a file; empty lists, bad tiers rejected on load")
+
+# ── 14. TEST MODEL VARIANTS ──
+print("\n=== 14. MODEL VARIANTS ===\n")
+
+import tempfile
+from benchmark import BENCHMARKS, compare_variants
+default_variants = dict(main.MODEL_VARIANTS)
+with tempfile.TemporaryDirectory() as tmp:
+    main.MODEL_VARIANTS.update(int8=os.path.join(tmp, "int8"), int4=os.path.join(tmp, "int4"))
+    os.makedirs(main.MODEL_VARIANTS["int8"])
+    # The small profile's int4 build isn't on disk yet, so it falls back to the default build
+    fallback = main.select_variant(profile="small")
+    os.makedirs(main.MODEL_VARIANTS["int4"])
+    with open(os.path.join(main.MODEL_VARIANTS["int4"], "weights.bin"), "wb") as f:
+        f.write(b"\0" * 4096)
+    small = main.select_variant(profile="small")
+    small_path = main.functiongemma_path
+    try:
+        main.select_variant("fp4")
+        raise AssertionError("unknown variant accepted")
+    except ValueError:
+        pass
+    try:
+        main.select_variant(profile="tiny")
+        raise AssertionError("unknown profile accepted")
+    except ValueError as e:
+        assert "'small', 'standard'" in str(e), e
+    main.select_variant("int8")
+
+    loaded = []
+    def by_variant(model, messages, **kw):
+        loaded.append(model)
+        calls = [{"name": "get_weather", "arguments": {"location": "San Francisco"}}] if model.endswith("int8") else []
+        return json.dumps({"function_calls": calls, "confidence": 0.9,
+                           "total_time_ms": 40 if model.endswith("int8") else 25})
+    cactus_module.cactus_init = lambda path, *a, **kw: path
+    cactus_module.cactus_complete = by_variant
+    rows = compare_variants(cases=BENCHMARKS[:2])
+    cactus_module.cactus_init = lambda *a, **kw: {}
+    cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+    selected = main.MODEL_VARIANT, main.functiongemma_path
+main.MODEL_VARIANTS.clear()
+main.MODEL_VARIANTS.update(default_variants)
+main.select_variant("int8")
+assert fallback == "int8" and small == "int4" and small_path.endswith("int4"), (fallback, small, small_path)
+assert [r["variant"] for r in rows] == ["int8", "int4"] and len(loaded) == 4, (rows, loaded)
+assert rows[0]["f1"] == 0.5 and rows[1]["f1"] == 0.0, rows        # only BENCHMARKS[0] is a weather query
+assert rows[0]["avg_ms"] == 40 and rows[1]["avg_ms"] == 25 and rows[1]["disk_mb"] > 0, rows
+assert selected[0] == "int8" and selected[1].endswith("int8"), selected
+print(f"  [PASS] device profiles pick a build on disk; --variants reports F1/latency/memory per build")
+
+# ── 15. TEST COMPLETION PARSING ──
+print("\n=== 15. COMPLETION PARSING ===\n")
+
+raw = b'{"function_calls":[{"name":"SetAlarm","arguments":{"Hour":"7","minute":"30"}}],"confidence":0.8,"total_time_ms":12}'
+for completion in (raw, memoryview(raw), raw.decode()):
+    parsed = main._parse_completion(completion)
+    assert type(parsed) is dict and parsed["confidence"] == 0.8 and parsed["total_time_ms"] == 12, parsed
+fixed = postprocess_batch(parsed["function_calls"], TOOLS)
+assert fixed == [{"name": "set_alarm", "arguments": {"hour": 7, "minute": 30}}], fixed
+assert parsed["function_calls"][0]["arguments"] == {"Hour": "7", "minute": "30"}      # postprocessing copies
+assert main._parse_completion("not json")["function_calls"] == [] and main._parse_completion("[1]")["confidence"] == 0
+sparse = main._parse_completion('{"function_calls":[],"response":"ok"}')
+assert sparse == {"function_calls": [], "response": "ok", "total_time_ms": 0, "confidence": 0}, sparse
+
+# The repair turn shows the model what it actually said, not the postprocessed calls
+assistant_turn = next(m for m in seen[1] if m["role"] == "assistant")
+assert json.loads(assistant_turn["content"]) == [{"name": "send_message", "arguments": {"recipient": "Bob"}}], assistant_turn
+print(f"  [PASS] completions parse once (str, bytes or memoryview) into plain dicts; postprocessing copies")
+
+# ── 16. TEST INFERENCE LOG ──
+print("\n=== 16. INFERENCE LOG ===\n")
+
+from inference_log import InferenceLog, iter_records, summarize, toolset_hash
+with tempfile.TemporaryDirectory() as tmp:
+    main.enable_inference_log(tmp, max_records=2)
+    cactus_module.cactus_complete = lambda *a, **kw: ('{"function_calls":[{"name":"get_weather","arguments":'
+                                                      '{"location":"Paris"}}],"confidence":0.95,"total_time_ms":20}')
+    weather = main.generate_hybrid([{"role": "user", "content": "Weather in Paris?"}], TOOLS[:1])
+    events = []
+    main.generate_hybrid([{"role": "user", "content": "Weather in Paris?"}], TOOLS[:1],
+                         on_event=lambda stage, payload: events.append(stage))
+    cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":5}'
+    # Nothing on-device and no cloud here: the cloud error is logged and the local result kept
+    main.generate_hybrid([{"role": "user", "content": "Text Bob hi"}], TOOLS[1:2])
+    files = main.disable_inference_log()
+    records = list(iter_records(tmp))
+    leftovers = [f for f in os.listdir(tmp) if f.endswith(".part")]
+assert len(files) == 2 and not leftovers, (files, leftovers)      # rotated after 2 records, renamed on close
+assert len(records) == 3 and events[0] == "classify", (records, events)
+first, last = records[0], records[2]
+assert first["toolset"] == toolset_hash(TOOLS[:1]) and first["tools"] == TOOLS[:1], first
+assert first["complexity"] == "EASY" and first["source"] == "on-device" and first["cloud"] is None, first
+assert first["local"]["calls"] == [{"name": "get_weather", "arguments": {"location": "Paris"}}], first
+assert [s["stage"] for s in first["stages"]] == ["classify", "infer"] and first["total_ms"] >= 0, first
+assert last["cloud"] and "error" in last["cloud"] and last["local"]["validation"]["errors"], last
+routes, stage_ms = summarize(records)
+assert routes[("EASY", "on-device")] == 3 and len(stage_ms["total"]) == 3, routes
+
+stalled = InferenceLog(queue_size=1)        # writer never started: the second submit has no room
+assert stalled.submit([], [], {}, [], 0.0) and not stalled.submit([], [], {}, [], 0.0) and stalled.dropped == 1
+
+# A record that can't be serialized is counted and skipped; the writer keeps going
+with tempfile.TemporaryDirectory() as tmp:
+    survivor = InferenceLog(tmp).start()
+    bad_call = {"name": "get_weather", "arguments": {"location": object()}}
+    survivor.submit([], TOOLS[:1], {"function_calls": [bad_call], "source": "on-device"}, [], 1.0)
+    survivor.submit([], TOOLS[:1], {"function_calls": [], "source": "on-device"}, [], 1.0)
+    survivor.stop()
+    kept_records = list(iter_records(tmp))
+assert survivor.failed == 1 and "TypeError" in survivor.last_error and survivor.written == 1, survivor.last_error
+assert len(kept_records) == 1 and kept_records[0]["tools"] == TOOLS[:1], kept_records
+print(f"  [PASS] requests logged off-thread to rotating gzip JSONL; full queue drops instead of blocking; bad records skipped")
+
+# ── 17. TEST KV STATE ──
+print("\n=== 17. KV STATE ===\n")
+
+import threading, time
+resets = []
+cactus_module.cactus_reset = lambda model: resets.append(model)
+cactus_module.cactus_complete = lambda *a, **kw: ('{"function_calls":[{"name":"get_weather","arguments":'
+                                                  '{"location":"Paris"}}],"confidence":0.95,"total_time_ms":20}')
+main.release_models()
+ask = lambda: main.generate_hybrid([{"role": "user", "content": "Weather in Paris?"}], TOOLS[:1])
+ask(); ask()
+stateless = len(resets)
+alice, bob = main.Session(TOOLS[:1], max_turns=2), main.Session(TOOLS[:1])
+alice.generate("Weather in Paris?")
+alice.generate("and in Paris again")
+continued = len(resets)
+bob.generate("Weather in Paris?")
+alice.generate("Weather in Paris?")         # third turn: over max_turns, so alice is trimmed
+switched = len(resets)
+trimmed_owner = main._kv_owner.get(main.functiongemma_path)
+ask()
+after_trim = len(resets)
+
+# Turns of one session run one at a time, even when requests for it overlap
+inside, overlap = [0], []
+def slow_complete(*a, **kw):
+    inside[0] += 1
+    overlap.append(inside[0])
+    time.sleep(0.02)
+    inside[0] -= 1
+    return '{"function_calls":[{"name":"get_weather","arguments":{"location":"Paris"}}],"confidence":0.95,"total_time_ms":20}'
+cactus_module.cactus_complete = slow_complete
+carol = main.Session(TOOLS[:1])
+threads = [threading.Thread(target=carol.generate, args=("Weather in Paris?",)) for _ in range(3)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+# Repairs and extra ensemble samples run outside the session, so its next turn starts clean
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":1}'
+erin = main.Session(TOOLS[:1])
+before_repair = len(resets)
+repaired_turn = erin.generate("Weather in Paris?")
+repair_resets = len(resets) - before_repair
+repair_owner = main._kv_owner.get(main.functiongemma_path)
+drawn_samples = iter(range(100))
+cactus_module.cactus_complete = lambda *a, **kw: json.dumps({"function_calls": [
+    {"name": "get_weather", "arguments": {"location": f"City {next(drawn_samples)}"}}], "confidence": 0.9, "total_time_ms": 1})
+real_ensemble_tiers, main.ENSEMBLE_TIERS = main.ENSEMBLE_TIERS, ("EASY",)
+before_samples = len(resets)
+voted_turn = main.Session(TOOLS[:1]).generate("Weather in Paris?")
+sample_resets = len(resets) - before_samples
+main.ENSEMBLE_TIERS = real_ensemble_tiers
+sample_owner = main._kv_owner.get(main.functiongemma_path)
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+# Without google.genai a session still answers on-device, and an escalation falls back instead of raising
+real_genai, real_types = main.genai, main.types
+main.genai = main.types = main._LazyModule("swissblaiz_missing_genai")
+dave = main.Session(TOOLS[:1])
+fallback_turn = dave.generate("Weather in Paris?")
+main.genai, main.types = real_genai, real_types
+del cactus_module.cactus_reset
+main.release_models()
+assert stateless == 2, resets                       # every stateless call starts from a clean cache
+assert continued == stateless + 1, resets            # alice's second turn reuses her prefix
+assert switched == continued + 2, resets             # bob takes the handle, then alice takes it back
+assert trimmed_owner is None and after_trim == switched + 1, (trimmed_owner, resets)
+assert max(overlap) == 1 and len(carol.messages) == 6, (overlap, carol.messages)
+assert repaired_turn.get("repair_attempts") and repair_resets == 1 + repaired_turn["repair_attempts"], (repaired_turn, resets)
+assert repair_owner is None, repair_owner
+assert voted_turn["samples"] == main.ENSEMBLE_SAMPLES and sample_resets == main.ENSEMBLE_SAMPLES and sample_owner is None
+assert alice._cloud is None and carol._cloud is None, "CloudSession built for on-device turns"
+assert fallback_turn["source"] == "on-device" and dave._cloud is None, fallback_turn
+print(f"  [PASS] KV cache reused only by the same session; trims, stateless calls, repairs and extra samples reset it; turns serialized")
+print(f"  [PASS] sessions build their CloudSession (and import genai) only when a turn escalates")
+
+# ── 18. TEST CLOUD SESSION CACHE ──
+print("\n=== 18. CLOUD SESSION CACHE ===\n")
+
+class _Record:
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(kwargs)
+fake_types = bt.ModuleType("google.genai.types")
+fake_types.__getattr__ = lambda name: type(name, (_Record,), {})
+fake_types.Part = type("Part", (_Record,), {"from_function_response": staticmethod(lambda **kw: _Record(**kw))})
+
+class FakeGemini:
+    """Gemini client double: caches live until `expire()`; cached requests for dead ones fail."""
+    def __init__(self):
+        self.live, self.log, self.n = set(), [], 0
+        self.caches = self.models = self
+    def create(self, model, config):
+        self.n += 1
+        name = f"cachedContents/{self.n}"
+        self.live.add(name)
+        self.log.append(("create", name))
+        return _Record(name=name)
+    def update(self, name, config):
+        if name not in self.live:
+            raise RuntimeError("404 cached content not found")
+        self.log.append(("update", name))
+    def delete(self, name):
+        self.live.discard(name)
+    def expire(self):
+        self.live.clear()
+    def generate_content(self, model, contents, config):
+        cached = getattr(config, "cached_content", None)
+        if cached is not None and cached not in self.live:
+            raise RuntimeError("403 cached content expired")
+        self.log.append(("generate", cached))
+        call = _Record(name="get_weather", args={"location": "Paris"})
+        return _Record(candidates=[_Record(content=_Record(parts=[_Record(function_call=call)]))])
+
+real_types, real_client, real_min_tokens = main.types, main._cloud_client, main.CLOUD_CACHE_MIN_TOKENS
+main.types, main._cloud_client, main.CLOUD_CACHE_MIN_TOKENS = fake_types, FakeGemini(), 1
+gemini = main._cloud_client
+cloud = main.CloudSession(TOOLS[:1])
+turns = [{"role": "user", "content": "Weather in Paris?"}]
+cloud.generate(turns)                                   # one turn: nothing settled to cache yet
+turns += [{"role": "assistant", "content": "", "function_calls": [{"name": "get_weather", "arguments": {"location": "Paris"}}]},
+          {"role": "user", "content": "And tomorrow?"}]
+second = cloud.generate(turns)
+created = gemini.log[-2:]
+cloud._cache_expires = time.monotonic() + 1             # about to lapse: extended, not rebuilt
+cloud.generate(turns)
+extended = cloud._cache_expires - time.monotonic()
+gemini.expire()                                         # gone server-side before we noticed
+cloud._cache_expires = time.monotonic() + main.CLOUD_CACHE_TTL_S
+fallback = cloud.generate(turns)
+after_fallback = list(gemini.log)
+main.types, main._cloud_client, main.CLOUD_CACHE_MIN_TOKENS = real_types, real_client, real_min_tokens
+assert created == [("create", "cachedContents/1"), ("generate", "cachedContents/1")], gemini.log
+assert second["function_calls"] == [{"name": "get_weather", "arguments": {"location": "Paris"}}], second
+assert after_fallback[3:5] == [("update", "cachedContents/1"), ("generate", "cachedContents/1")], after_fallback
+assert extended > main.CLOUD_CACHE_TTL_S - 5, extended
+# The expired cache fails the request; it is dropped and the same turn goes out uncached
+assert after_fallback[5:] == [("generate", None)] and fallback["function_calls"], after_fallback
+assert cloud._cache is None, cloud._cache
+print(f"  [PASS] cloud cache created once settled, TTL extended before expiry, rejected cache falls back uncached")
+
+# ── 19. TEST SCHEDULER ──
+print("\n=== 19. SCHEDULER ===\n")
+
+import asyncio
+import scheduler as sched
+from server import InferenceServer
+
+# One worker held busy; queued jobs run by deadline bucket, then rank, then arrival
+gate, order, expired = threading.Event(), [], []
+pool = sched.Pool("test", 1, 8)
+pool.try_submit((-1, 0), gate.wait)
+bucket = (int(time.monotonic() * 1000 // sched.DEADLINE_BUCKET_MS) + 600) * sched.DEADLINE_BUCKET_MS / 1000 + 0.02
+for label, deadline, rank in [("late-easy", bucket + 1, 0), ("soon-hard", bucket, 2),
+                              ("soon-easy", bucket + 0.05, 0), ("soon-easy-2", bucket + 0.01, 0)]:
+    pool.try_submit(sched.priority(deadline, rank), order.append, label)
+pool.try_submit((0, 0), order.append, "stale", deadline=time.monotonic() - 1, on_expire=expired.append)
+refused = sched.Pool("full", 0, 0).try_submit((0, 0), order.append, "refused")
+gate.set()
+pool.close()
+assert order == ["soon-easy", "soon-easy-2", "soon-hard", "late-easy"], order
+assert expired == ["stale"] and pool.stats()["expired"] == 1 and pool.stats()["completed"] == 5, pool.stats()
+assert not refused
+
+sink = main.Metrics()
+previous = main.set_metrics_sink(sink)
+paris_reply = json.dumps({"function_calls": [{"name": "get_weather", "arguments": {"location": "Paris"}}],
+                          "confidence": 0.95, "total_time_ms": 5})
+query = [{"role": "user", "content": "Weather in Paris?"}]
+cactus_module.cactus_complete = lambda *a, **kw: paris_reply
+edge = sched.Scheduler(edge_workers=1, cloud_workers=1)
+on_device = edge.submit(query, TOOLS[:1]).result(timeout=5)
+
+# Edge queue full: straight to the cloud, counted and routed as shed
+sched.generate_cloud = lambda messages, tools: {"function_calls": [{"name": "get_weather", "arguments": {"location": " Paris "}}],
+                                                "total_time_ms": 30}
+shed = sched.Scheduler(edge_workers=1, cloud_workers=1, edge_queue=0)
+from_cloud = shed.submit(query, TOOLS[:1]).result(timeout=5)
+# Cloud queue full: a result that needs the cloud keeps its local answer
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+kept = sched.Scheduler(edge_workers=1, cloud_workers=1, cloud_queue=0)
+kept_local = kept.submit(query, TOOLS[:1]).result(timeout=5)
+# Both full: rejected
+overloaded = sched.Scheduler(edge_workers=0, cloud_workers=0, edge_queue=0, cloud_queue=0).submit(query, TOOLS[:1])
+
+# A request still queued behind a slow one past its deadline fails instead of running late
+started, release = threading.Event(), threading.Event()
+cactus_module.cactus_complete = lambda *a, **kw: (started.set(), release.wait(5), paris_reply)[2]
+slow = edge.submit(query, TOOLS[:1], deadline_ms=5000)
+started.wait(5)
+late = edge.submit(query, TOOLS[:1], deadline_ms=1)
+time.sleep(0.05)
+release.set()
+slow.result(timeout=5)
+late_error = late.exception(timeout=5)
+
+# server.py hands stateless requests to the scheduler and exports its gauges
+cactus_module.cactus_complete = lambda *a, **kw: paris_reply
+served = asyncio.run(InferenceServer(scheduler=edge).infer({"query": "Weather in Paris?", "tools": TOOLS[:1]}))
+gauges = edge.gauges()
+exposition = render_prometheus(sink.snapshot(), gauges=dict(gauges, **shed.gauges()))
+for running in (edge, shed, kept):
+    running.close()
+sched.generate_cloud = main.generate_cloud
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+main.set_metrics_sink(previous)
+
+counters = {(name, labels[0][1] if labels else None): n for (name, labels), n in sink.snapshot()["counters"].items()}
+assert on_device["source"] == "on-device" and served["source"] == "on-device", (on_device, served)
+assert from_cloud["source"] == "cloud (shed)" and from_cloud["function_calls"][0]["arguments"] == {"location": "Paris"}
+assert shed.stats()["shed_to_cloud"] == 1 and counters[("swissblaiz_routed_total", "shed")] == 1, counters
+assert "needs_cloud" not in kept_local and kept.stats()["shed_to_edge"] == 1, kept_local
+assert counters[("swissblaiz_routed_total", "fallback")] == 1, counters
+assert isinstance(overloaded.exception(), sched.Overloaded)
+assert isinstance(late_error, sched.DeadlineExceeded), late_error
+assert gauges["swissblaiz_scheduler_edge_expired"] == 1 and gauges["swissblaiz_scheduler_edge_depth"] == 0, gauges
+assert "swissblaiz_scheduler_shed_to_cloud 1" in exposition, exposition
+print(f"  [PASS] deadline buckets then difficulty, expired jobs dropped, shedding routed and exported as gauges")
+
+# Logged once the final answer exists: on-device, escalated on the cloud pool, kept local, shed
+cloud_reply = lambda messages, tools: {"function_calls": [{"name": "get_weather", "arguments": {"location": "Paris"}}],
+                                       "total_time_ms": 30}
+main.generate_cloud, sched.generate_cloud = cloud_reply, cloud_reply
+with tempfile.TemporaryDirectory() as tmp:
+    main.enable_inference_log(tmp)
+    cactus_module.cactus_complete = lambda *a, **kw: paris_reply
+    logged = sched.Scheduler(edge_workers=1, cloud_workers=1)
+    answers = [logged.submit(query, TOOLS[:1]).result(timeout=5)]
+    cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":5}'
+    answers.append(logged.submit(query, TOOLS[:1]).result(timeout=5))
+    no_cloud = sched.Scheduler(edge_workers=1, cloud_workers=1, cloud_queue=0)
+    answers.append(no_cloud.submit(query, TOOLS[:1]).result(timeout=5))
+    no_edge = sched.Scheduler(edge_workers=1, cloud_workers=1, edge_queue=0)
+    answers.append(no_edge.submit(query, TOOLS[:1]).result(timeout=5))
+    for running in (logged, no_cloud, no_edge):
+        running.close()
+    main.disable_inference_log()
+    sched_records = list(iter_records(tmp))
+main.generate_cloud = sched.generate_cloud = real_generate_cloud
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+sources = ["on-device", "cloud (fallback)", "on-device", "cloud (shed)"]
+assert [a["source"] for a in answers] == sources, answers
+assert [r["source"] for r in sched_records] == sources and not any(r.get("needs_cloud") for r in sched_records), sched_records
+on_device_rec, escalated_rec, kept_rec, shed_rec = sched_records
+assert escalated_rec["cloud"]["calls"] == answers[1]["function_calls"] and escalated_rec["cloud"]["ms"] == 30, escalated_rec
+assert escalated_rec["local"]["calls"] == [] and escalated_rec["complexity"] == "EASY", escalated_rec
+assert kept_rec["cloud"] is None and kept_rec["local"]["routing_confidence"] is not None, kept_rec
+assert shed_rec["local"] is None and shed_rec["cloud"]["ms"] == 30 and shed_rec["complexity"] == "EASY", shed_rec
+print(f"  [PASS] scheduler logs the answer the client got: escalated, kept local and shed requests")
+
+# ── 20. TEST SIMULATE ──
+print("\n=== 20. SIMULATE ===\n")
+
+import numpy as np
+import simulate
+
+def by_request(model, messages, **kw):
+    text = messages[1]["content"]
+    if "Paris" in text:                                # clean, confident
+        calls, conf = [{"name": "get_weather", "arguments": {"location": "Paris"}}], 0.95
+    elif "timer" in text:                              # valid but unsure
+        calls, conf = [{"name": "set_timer", "arguments": {"minutes": 5}}], 0.3
+    else:                                              # nothing, so the repair loop runs
+        calls, conf = [], 0.2
+    return json.dumps({"function_calls": calls, "confidence": conf, "total_time_ms": 40})
+
+sim_cases = [
+    {"name": "paris", "difficulty": "easy", "messages": [{"role": "user", "content": "Weather in Paris?"}],
+     "tools": TOOLS[:1], "expected_calls": [{"name": "get_weather", "arguments": {"location": "Paris"}}]},
+    {"name": "timer", "difficulty": "medium", "messages": [{"role": "user", "content": "Set a timer for 5 minutes"}],
+     "tools": TOOLS, "expected_calls": [{"name": "set_timer", "arguments": {"minutes": 5}}]},
+    {"name": "alarm", "difficulty": "hard", "messages": [{"role": "user", "content": "Wake me up at 7 AM"}],
+     "tools": TOOLS, "expected_calls": [{"name": "set_alarm", "arguments": {"hour": 7, "minute": 0}}]},
+]
+cactus_module.cactus_complete = by_request
+main.generate_cloud, real_generate_cloud = (
+    lambda messages, tools: {"function_calls": [dict(c) for c in next(
+        case["expected_calls"] for case in sim_cases if case["messages"][0]["content"] == messages[-1]["content"])],
+        "total_time_ms": 300}), main.generate_cloud
+with tempfile.TemporaryDirectory() as out_dir:
+    path = os.path.join(out_dir, "run.jsonl.gz")
+    recorded = simulate.record(sim_cases, path)
+    records = simulate.load_records(path)
+main.generate_cloud = real_generate_cloud
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+
+assert recorded == 3 and [r["name"] for r in records] == ["paris", "timer", "alarm"], records
+assert [r["threshold_free"] for r in records] == [True, True, False], records
+assert simulate.threshold_bound(records) == records[2:]
+assert records[0]["recorded_thresholds"]["EASY"] == main.CONFIDENCE_THRESHOLD_EASY
+assert records[1]["local"]["f1"] == 1.0 and records[1]["escalated"]["time_ms"] == 340, records[1]
+# The vectorized sweep agrees with compute_total_score for every grid policy
+replay = simulate.Replay(records)
+grid = np.array([0.0, 0.25, 0.5, 0.96])
+scores = replay.sweep(grid)
+for i, j, k in [(0, 0, 0), (3, 3, 3), (0, 1, 2), (3, 0, 1)]:
+    policy = dict(zip(simulate.COMPLEXITIES, grid[[i, j, k]]))
+    exact = simulate.evaluate(records, simulate.threshold_policy(policy))
+    assert abs(scores[i, j, k] - exact) < 1e-9, (policy, scores[i, j, k], exact)
+mask_scores = replay.score_masks([[False, False, False], [True, True, True]])
+assert abs(mask_scores[0] - scores[0, 0, 0]) < 1e-9 and abs(mask_scores[1] - scores[3, 3, 3]) < 1e-9
+best, best_score = simulate.best_thresholds(replay, grid)
+assert best_score == scores.max() and abs(simulate.evaluate(records, simulate.threshold_policy(best)) - best_score) < 1e-9
+# Best keeps the right-but-unsure timer answer local and escalates the empty alarm one
+assert simulate.routing_confidence(records[1]) >= best[records[1]["complexity"]], best
+assert simulate.routing_confidence(records[2]) < best[records[2]["complexity"]], best
+print(f"  [PASS] record marks threshold-free cases; sweep and masks match compute_total_score exactly")
+
+# ── 21. TEST SERVER ──
+print("\n=== 21. SERVER ===\n")
+
+import server as srv
+
+# Requests decode fresh tool dicts every time; the index is still compiled once
+decoded = [json.loads(json.dumps(TOOLS)) for _ in range(2)]
+assert main._tool_index(decoded[0]) is main._tool_index(decoded[1]) is main._tool_index(TOOLS)
+
+async def http(port, method, path, body=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    payload = b"" if body is None else json.dumps(body).encode()
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\nContent-Length: {len(payload)}\r\n\r\n".encode() + payload)
+    await writer.drain()
+    head, _, content = (await reader.read()).partition(b"\r\n\r\n")
+    writer.close()
+    return int(head.split()[1]), head.decode(), content
+
+async def ws_turn(port, request):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET /v1/stream HTTP/1.1\r\nHost: test\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n\r\n")
+    handshake = await reader.readuntil(b"\r\n\r\n")
+    data, mask = json.dumps(request).encode(), b"\x01\x02\x03\x04"
+    writer.write(bytes([0x81, 0x80 | 126]) + len(data).to_bytes(2, "big") + mask
+                 + bytes(b ^ mask[i % 4] for i, b in enumerate(data)))
+    events = []
+    while not events or events[-1]["event"] not in ("result", "error"):
+        _, length = await reader.readexactly(2)
+        if length == 126:
+            length = int.from_bytes(await reader.readexactly(2), "big")
+        events.append(json.loads(await reader.readexactly(length)))
+    writer.write(bytes([0x88, 0x80]) + mask)
+    writer.close()
+    return handshake, events
+
+async def exercise_server():
+    server = srv.InferenceServer(max_concurrency=1, max_queue=0, warmup_toolsets=[TOOLS[:2]])
+    listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = listener.sockets[0].getsockname()[1]
+    out = {"health": await http(port, "GET", "/health"), "cold": await http(port, "GET", "/ready")}
+    await server.warmup()
+    out["ready"] = await http(port, "GET", "/ready")
+    out["generate"] = await http(port, "POST", "/v1/generate", {"query": "Weather in Paris?", "tools": TOOLS[:1]})
+    out["bad"] = await http(port, "POST", "/v1/generate", {"tools": TOOLS[:1]})
+    out["ws"] = await ws_turn(port, {"query": "Weather in Paris?", "tools": TOOLS[:1], "session_id": "demo"})
+    # One slot, no waiting room: a second request while the first is running is turned away
+    release.clear()
+    busy_in_flight = asyncio.ensure_future(http(port, "POST", "/v1/generate", {"query": "Weather in Paris?", "tools": TOOLS[:1]}))
+    while server.admission.running == 0:
+        await asyncio.sleep(0.005)
+    out["busy"] = await http(port, "POST", "/v1/generate", {"query": "Weather in Paris?", "tools": TOOLS[:1]})
+    release.set()
+    out["after_busy"] = await busy_in_flight
+    out["metrics"] = await http(port, "GET", "/metrics")
+    listener.close()
+    server.executor.shutdown()
+    return server, out
+
+release = threading.Event()
+release.set()
+cactus_module.cactus_complete = lambda *a, **kw: (release.wait(5), paris_reply)[1]
+main._ready.clear()
+served, responses = asyncio.run(exercise_server())
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+
+status, _, body = responses["health"]
+assert status == 200 and json.loads(body)["status"] == "ok", body
+assert responses["cold"][0] == 503 and responses["ready"][0] == 200, (responses["cold"], responses["ready"])
+assert served.warmup_report["toolsets"] == 2, served.warmup_report       # defaults + the client's schema
+status, _, body = responses["generate"]
+assert status == 200 and json.loads(body)["source"] == "on-device", body
+assert responses["bad"][0] == 400, responses["bad"]
+handshake, events = responses["ws"]
+assert b"101 Switching Protocols" in handshake and b"s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in handshake, handshake
+stages = [e["event"] for e in events]
+assert stages[0] == "classify" and {"infer", "route", "postprocess"} <= set(stages) and stages[-1] == "result", stages
+assert events[-1]["result"]["function_calls"] == [{"name": "get_weather", "arguments": {"location": "Paris"}}]
+status, head, _ = responses["busy"]
+assert status == 429 and "Retry-After: 1" in head and responses["after_busy"][0] == 200, head
+assert b"swissblaiz_server_sessions 1" in responses["metrics"][2], responses["metrics"]
+print(f"  [PASS] health, ready after warmup, generate, WS event stream, 429 past admission; tool index by content")
+
+# Worker threads share the tool-index LRUs; churn them past a tiny capacity from several at once
+real_cache_size, main.TOOL_INDEX_CACHE_SIZE = main.TOOL_INDEX_CACHE_SIZE, 2
+index_errors = []
+def churn(seed):
+    try:
+        for i in range(300):
+            toolset = json.loads(json.dumps(TOOLS[(seed + i) % 5:(seed + i) % 5 + 2]))   # fresh objects, 5 schemas
+            assert main._tool_index(toolset).tools == toolset
+    except Exception as e:
+        index_errors.append(repr(e))
+churners = [threading.Thread(target=churn, args=(n,)) for n in range(8)]
+for t in churners:
+    t.start()
+for t in churners:
+    t.join()
+main.TOOL_INDEX_CACHE_SIZE = real_cache_size
+assert not index_errors, index_errors[:3]
+print(f"  [PASS] tool-index caches stay consistent under concurrent lookups and eviction")
+
+# ── 22. TEST CORPUS ──
+print("\n=== 22. CORPUS ===\n")
+
+import subprocess
+import corpus
+
+corpus_dir = tempfile.mkdtemp()
+cases = BENCHMARKS[:12]
+for suffix in (".jsonl", ".jsonl.gz"):
+    path = os.path.join(corpus_dir, "bench" + suffix)
+    assert corpus.write_corpus(path, cases) == len(cases)
+    loaded = list(corpus.iter_cases(path))
+    assert loaded == [{k: c[k] for k in ("name", "difficulty", "messages", "tools", "expected_calls")} for c in cases]
+
+# Shards partition the file; identical definitions come back as one dict
+shards = [list(corpus.iter_cases(path, shard=i, num_shards=3)) for i in range(3)]
+assert sorted(c["name"] for s in shards for c in s) == sorted(c["name"] for c in cases)
+assert sum(len(s) for s in shards) == len(cases)
+weather = [t for c in loaded for t in c["tools"] if t["name"] == "get_weather"]
+assert len(weather) > 1 and all(t is weather[0] for t in weather)
+assert corpus.parse_shard("2/8") == (2, 8) and corpus.parse_shard("0") == (0, 1)
+for bad in ((3, 3), (-1, 2)):
+    try:
+        next(corpus.iter_cases(path, *bad))
+        assert False, bad
+    except ValueError:
+        pass
+
+broken = os.path.join(corpus_dir, "broken.jsonl")
+with open(broken, "w") as f:
+    f.write(json.dumps({"type": "case", "name": "x", "difficulty": "easy", "messages": [],
+                        "tools": ["missing"], "expected_calls": []}) + "\n")
+try:
+    list(corpus.iter_cases(broken))
+    assert False, "unknown tool id accepted"
+except ValueError as e:
+    assert "broken.jsonl:1" in str(e) and "missing" in str(e), e
+
+# Per-shard --totals-out files merge to the totals of one unsharded run
+from benchmark import compute_totals, print_summary
+results = [{"difficulty": c["difficulty"], "f1": (i % 4) / 4, "total_time_ms": 10.0 + i,
+            "source": "on-device" if i % 3 else "cloud"} for i, c in enumerate(cases)]
+totals_paths = []
+for i in range(3):
+    totals_paths.append(os.path.join(corpus_dir, f"shard{i}.json"))
+    with open(totals_paths[-1], "w") as f:
+        json.dump(compute_totals(results[i::3]), f)
+assert corpus.merge_totals_files(totals_paths) == compute_totals(results)
+out = subprocess.run([sys.executable, "corpus.py", "merge", *totals_paths], capture_output=True, text=True,
+                     cwd=os.path.dirname(os.path.abspath(corpus.__file__)))
+assert out.returncode == 0 and "Merged 3 shard totals" in out.stdout and "TOTAL SCORE" in out.stdout, out.stderr
+usage = subprocess.run([sys.executable, "corpus.py", "merge"], capture_output=True, text=True,
+                       cwd=os.path.dirname(os.path.abspath(corpus.__file__)))
+assert usage.returncode == 2 and "merge TOTALS.json" in usage.stdout
+print(f"  [PASS] round trip (.jsonl, .gz), {len(shards)} shards cover {len(cases)} cases, shared tools, bad ids; merge CLI")
+
+# ── 23. TEST PARETO ──
+print("\n=== 23. PARETO ===\n")
+
+import pareto
+
+# (avg_f1, p95_ms, on_device): 2 is dominated by 0, 3 repeats 0's outcome
+points = np.array([[1.0, 100, 0.5], [0.8, 50, 0.5], [0.8, 60, 0.5], [1.0, 100, 0.5], [0.5, 50, 1.0]])
+assert pareto.frontier(points) == [1, 4, 0], pareto.frontier(points)
+assert len(pareto.configurations(3)) == 4 ** 3
+
+# The records from section 20: one case per difficulty
+report = pareto.explore(records, steps=3)
+assert report["cases"] == 3 and report["configurations"] == 64
+assert set(report["groups"]) == {"easy", "medium", "hard", "overall"}
+assert [report["groups"][g]["cases"] for g in pareto.GROUPS] == [1, 1, 1, 3]
+def dominates(a, b):
+    better = (a["f1"] >= b["f1"], a["p95_ms"] <= b["p95_ms"], a["on_device"] >= b["on_device"])
+    return all(better) and (a["f1"], a["p95_ms"], a["on_device"]) != (b["f1"], b["p95_ms"], b["on_device"])
+for group, data in report["groups"].items():
+    front, every = data["frontier"], data["all"]
+    assert front and len(every) == 64
+    assert not any(dominates(p, q) for p in every for q in front), group
+    assert max(p["f1"] for p in front) == max(p["f1"] for p in every)
+    assert [q["p95_ms"] for q in front] == sorted(q["p95_ms"] for q in front)
+overall = report["groups"]["overall"]["frontier"]
+assert max(p["f1"] for p in overall) == 1.0 and max(p["on_device"] for p in overall) == 1.0, overall
+page = pareto.render_html(report)
+assert page.count("<svg") == 4 and "Routing frontier" in page
+print(f"  [PASS] non-dominated, deduplicated, sorted by p95; {len(overall)} overall optimal of {report['configurations']}")
+
+# ── 24. TEST MEMORY REPORT ──
+print("\n=== 24. MEMORY REPORT ===\n")
+
+import mmap
+
+report_keys = {"rss_mb", "pss_mb", "shared_mb", "private_mb", "weights_rss_mb", "weights_pss_mb", "model_load_mb"}
+if os.path.exists("/proc/self/smaps_rollup"):
+    with tempfile.TemporaryDirectory() as weights_dir:
+        weights_file = os.path.join(weights_dir, "weights.bin")
+        with open(weights_file, "wb") as f:
+            f.write(os.urandom(4 << 20))
+        with open(weights_file, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            sum(mapped[i] for i in range(0, len(mapped), mmap.PAGESIZE))   # fault every page in
+            mem = main.memory_report(weights_dir)
+            mem_sibling = main.memory_report(weights_dir[:-1])
+            mapped.close()
+    assert set(mem) == report_keys and all(isinstance(v, float) for v in mem.values()), mem
+    assert mem["rss_mb"] > 0 and mem["weights_rss_mb"] >= 3.9 and mem["weights_rss_mb"] <= mem["rss_mb"], mem
+    assert main.memory_report(os.path.join(weights_dir, "nothing-mapped"))["weights_rss_mb"] == 0.0
+    assert mem_sibling["weights_rss_mb"] == 0.0, mem_sibling    # a sibling variant whose name is a prefix
+    # A model the SDK copies into its own memory: counted as its load footprint, not as weight pages
+    main.release_models()
+    cactus_module.cactus_init = lambda path, *a, **kw: b"w" * (8 << 20)
+    main._get_model("copied-weights")
+    copied = main.memory_report("copied-weights")
+    main.release_models()
+    cactus_module.cactus_init = lambda *a, **kw: {}
+    assert copied["model_load_mb"] >= 7.5 and copied["weights_rss_mb"] == 0.0, copied
+    assert main.memory_report("copied-weights")["model_load_mb"] == 0.0
+else:
+    print("  (no /proc/self/smaps_rollup, key check only)")
+
+# Without /proc the report is empty rather than an error
+def no_proc(path, *a, **kw):
+    raise FileNotFoundError(path)
+main.open = no_proc
+try:
+    assert main.memory_report() == {}
+finally:
+    del main.open
+print(f"  [PASS] {sorted(report_keys)}; weight-file pages and model load footprint attributed; empty without /proc")
+
+# ── 25. TEST WARMUP ──
+print("\n=== 25. WARMUP ===\n")
+
+def stub_model(delay_s):
+    def complete(model, messages, **kw):
+        warmup_calls.append(messages[-1]["content"])
+        time.sleep(delay_s)
+        return '{"function_calls":[],"confidence":0.9,"total_time_ms":1}'
+    return complete
+
+warmup_calls = []
+main._ready.clear()
+cactus_module.cactus_complete = stub_model(0)
+fast = main.warmup(toolsets=[TOOLS[:2], TOOLS[2:5]], rounds=3, target_p50_ms=500, cloud=False)
+assert set(fast) == {"ready", "p50_ms", "target_p50_ms", "cold_p50_ms", "queries", "toolsets", "models", "cloud",
+                     "total_ms"}, fast
+assert fast["ready"] and main.is_ready() and fast["p50_ms"] <= 500, fast
+# Every round covers every tool of every toolset; the first round is the cold one
+assert fast["queries"] == len(warmup_calls) == 3 * 5 and fast["toolsets"] == 2 and fast["cloud"] == "skipped", fast
+assert warmup_calls[:2] == main._synthetic_queries(TOOLS[:2]) and fast["cold_p50_ms"] is not None
+
+# Too slow for the target: not ready. A single round counts as warm, with no cold p50
+cactus_module.cactus_complete = stub_model(0.02)
+slow = main.warmup(toolsets=[TOOLS[:1]], rounds=2, target_p50_ms=5, cloud=False)
+assert not slow["ready"] and not main.is_ready() and slow["p50_ms"] >= 20, slow
+single = main.warmup(toolsets=[TOOLS[:1]], rounds=1, target_p50_ms=0, cloud=False)
+assert single["cold_p50_ms"] is None and single["queries"] == 1 and not single["ready"], single
+# Nothing measured: no p50, and not ready
+for unmeasured in (main.warmup(toolsets=[TOOLS[:1]], rounds=0, cloud=False), main.warmup(toolsets=[], cloud=False)):
+    assert unmeasured["p50_ms"] is None and unmeasured["queries"] == 0 and not unmeasured["ready"], unmeasured
+
+# Every cactus tier's model is loaded up front, once per path
+loaded, default_cascade = [], main.CASCADE
+main.CASCADE = [{"name": "rules", "backend": "rules"}, {"name": "edge", "backend": "cactus", "path": "edge-weights"},
+                {"name": "bigger", "backend": "cactus", "path": "bigger-weights"},
+                {"name": "edge-again", "backend": "cactus", "path": "edge-weights", "budget_ms": 10}]
+cactus_module.cactus_init = lambda path, *a, **kw: loaded.append(path) or path
+main.release_models()
+tiered = main.warmup(toolsets=[TOOLS[:1]], rounds=2, target_p50_ms=500, cloud=False)
+main.CASCADE = default_cascade
+main.release_models()
+cactus_module.cactus_init = lambda *a, **kw: {}
+assert loaded == ["edge-weights", "bigger-weights"] and tiered["models"] == 2 and tiered["ready"], (loaded, tiered)
+
+# In the background: readiness flips when the thread finishes; errors leave it unset
+cactus_module.cactus_complete = stub_model(0)
+thread = main.start_warmup(toolsets=[TOOLS[:1]], rounds=2, cloud=False)
+thread.join(timeout=5)
+assert not thread.is_alive() and thread.name == "warmup" and main.is_ready()
+main._ready.clear()
+thread = main.start_warmup(toolsets=[[{"no": "name"}]], cloud=False)
+thread.join(timeout=5)
+assert not thread.is_alive() and not main.is_ready()
+cactus_module.cactus_complete = lambda *a, **kw: '{"function_calls":[],"confidence":0,"total_time_ms":0}'
+print(f"  [PASS] ready at p50 {fast['p50_ms']:.2f}ms <= 500ms, not ready at {slow['p50_ms']:.0f}ms > 5ms; background warmup")
+
 # ── SUMMARY ──
 print(f"\n{'=' * 60}")
 print(f"  ALL LOGIC TESTS COMPLETE")